@@ -1,35 +1,60 @@
 # app.py
 import asyncio
+import concurrent.futures
+import glob
 import hashlib
-import random
-from datetime import datetime, timedelta
-import re
-import pandas as pd
+import hmac
+import time
+from datetime import datetime
 import streamlit as st
 import sys
 import os
+import re
 import subprocess
-from calendar import monthrange
+import tempfile
+import uuid
 import base64
 import pathlib
 
+from utils import generate_dates_rule, normalize_date_text
+
+# pandas and the Playwright-backed scraper are imported lazily (post-login),
+# so the landing page renders without paying for them.
+_APP_T0 = time.perf_counter()
+
 # ---------------------------
 # Ensure Playwright Chromium is available (Render)
 # ---------------------------
-def ensure_playwright_chromium():
-    """Install Playwright Chromium at runtime if it's missing."""
+CHROMIUM_EXECUTABLE_GLOBS = [
+    os.path.join("chromium-*", "chrome-linux", "chrome"),
+    os.path.join("chromium-*", "chrome-win", "chrome.exe"),
+    os.path.join("chromium-*", "chrome-mac", "Chromium.app", "Contents", "MacOS", "Chromium"),
+]
+
+def find_playwright_chromium(browsers_path: str) -> str | None:
+    """Return the newest installed Playwright Chromium executable, whatever its revision."""
+    found = []
+    for pattern in CHROMIUM_EXECUTABLE_GLOBS:
+        found.extend(glob.glob(os.path.join(browsers_path, pattern)))
+    # Compare revisions as numbers: "chromium-999" must not beat "chromium-1140".
+    def revision(path: str) -> int:
+        m = re.search(r"chromium-(\d+)", path)
+        return int(m.group(1)) if m else -1
+    return max(found, key=revision) if found else None
+
+@st.cache_resource(show_spinner=False)
+def ensure_playwright_chromium() -> str | None:
+    """Install Playwright Chromium at runtime if it's missing. Runs once per process."""
     os.environ.setdefault("PLAYWRIGHT_BROWSERS_PATH", "/opt/render/.cache/ms-playwright")
-    chrome_path = os.path.join(
-        os.environ["PLAYWRIGHT_BROWSERS_PATH"],
-        "chromium-1129", "chrome-linux", "chrome"  # Playwright 1.46 bundle
-    )
-    if not os.path.exists(chrome_path):
+    browsers_path = os.environ["PLAYWRIGHT_BROWSERS_PATH"]
+    chrome_path = find_playwright_chromium(browsers_path)
+    if not chrome_path:
         try:
-            subprocess.run(["python", "-m", "playwright", "install", "chromium"], check=True)
+            subprocess.run([sys.executable, "-m", "playwright", "install", "chromium"], check=True)
         except Exception as e:
             print(f"[WARN] playwright install failed: {e}")
-
-ensure_playwright_chromium()
+        chrome_path = find_playwright_chromium(browsers_path)
+    return chrome_path
 
 # Force Proactor loop on Windows so Playwright can spawn Chromium
 if sys.platform.startswith("win"):
@@ -49,109 +74,6 @@ def _b64_image_or_empty(path: str) -> str:
     with open(p, "rb") as f:
         return base64.b64encode(f.read()).decode("utf-8")
 
-# ---------------------------
-# Month/date helpers
-# ---------------------------
-def first_of_month(d: datetime) -> datetime:
-    return d.replace(day=1)
-
-def add_months(d: datetime, n: int) -> datetime:
-    y = d.year + (d.month - 1 + n) // 12
-    m = (d.month - 1 + n) % 12 + 1
-    return datetime(y, m, 1)
-
-def month_end(d: datetime) -> datetime:
-    _, last = monthrange(d.year, d.month)
-    return d.replace(day=last)
-
-def normalize_date_text(text: str):
-    """Parse dd.mm.yyyy lines, drop invalid/duplicates, return (dates_list, normalized_sorted_text)."""
-    dates = []
-    seen = set()
-    for line in (text or "").splitlines():
-        s = line.strip()
-        if not s:
-            continue
-        try:
-            d = datetime.strptime(s, "%d.%m.%Y")
-            key = d.strftime("%Y-%m-%d")
-            if key not in seen:
-                dates.append(d)
-                seen.add(key)
-        except Exception:
-            pass
-    dates_sorted = sorted(dates)
-    normalized = "\n".join([d.strftime("%d.%m.%Y") for d in dates_sorted])
-    return dates_sorted, normalized
-
-def pick_two_dates_for_month(month_start: datetime, after_dt: datetime | None = None):
-    """
-    Pick 2 dates in the month:
-      - one weekday (Sun–Thu = 6,0,1,2,3)
-      - one weekend (Fri/Sat = 4,5)
-    If one bucket is empty, fall back to any remaining days to still return 2 unique dates.
-    `after_dt`: if provided, only consider days strictly > after_dt.
-    """
-    ms = month_start
-    me = month_end(month_start)
-    all_days = list(pd.date_range(ms, me, freq="D"))
-    if after_dt is not None:
-        all_days = [d for d in all_days if d.to_pydatetime() > after_dt]
-
-    weekdays = [d for d in all_days if d.weekday() in [6, 0, 1, 2, 3]]
-    weekends = [d for d in all_days if d.weekday() in [4, 5]]
-
-    seed = int(ms.strftime("%Y%m"))
-    rng = random.Random(seed)
-
-    chosen = []
-    if weekdays:
-        chosen.append(rng.choice(weekdays).to_pydatetime())
-    if weekends:
-        w = rng.choice(weekends).to_pydatetime()
-        if w not in chosen:
-            chosen.append(w)
-
-    if len(chosen) < 2:
-        remaining = [d.to_pydatetime() for d in all_days if d.to_pydatetime() not in chosen]
-        if remaining:
-            rng.shuffle(remaining)
-            while len(chosen) < 2 and remaining:
-                chosen.append(remaining.pop())
-    return sorted(chosen)
-
-def generate_dates_rule(start: datetime, months: int):
-    """
-    Rule:
-      - If fewer than 7 days remain in the start month (strictly after the start date),
-        skip this month and start from next month.
-      - Otherwise, include current month but pick only dates strictly after the chosen start.
-      - Always return exactly 2 dates per month (fallback if a bucket is empty).
-    """
-    end_curr = month_end(start)
-    days_after = (end_curr - start).days
-    include_current = days_after >= 7
-
-    out = []
-    if include_current:
-        ms = first_of_month(start)
-        out.extend(pick_two_dates_for_month(ms, after_dt=start))
-        base_month = add_months(ms, 1)
-        for i in range(months - 1):
-            msi = add_months(base_month, i)
-            out.extend(pick_two_dates_for_month(msi, after_dt=None))
-    else:
-        base_month = add_months(first_of_month(start), 1)
-        for i in range(months):
-            msi = add_months(base_month, i)
-            out.extend(pick_two_dates_for_month(msi, after_dt=None))
-    return sorted(set(out))
-
-# ---------------------------
-# Import the Booking.com scraper helpers
-# ---------------------------
-from scraper import scrape_hotels_for_dates, ddmmyyyy
-
 # ---------------------------
 # Basic page config
 # ---------------------------
@@ -176,6 +98,51 @@ BOOKING_URL_HELP = (
     "Paste the full property link from Booking.com (optional but recommended). "
     "Example: https://www.booking.com/hotel/de/steigenberger-frankfurter-hof.html"
 )
+ADMIN_SECTION = "🔧 Admin: scraper health"
+PERSISTENT_PROFILE_LABEL = "Reuse browser cache across runs"
+PERSISTENT_PROFILE_HELP = (
+    "Keeps a browser profile per worker on disk so Booking's scripts and styles "
+    "are not downloaded again for every hotel and date."
+)
+PROFILE_DIR = os.environ.get("RATECHECKER_PROFILE_DIR") or os.path.join(
+    tempfile.gettempdir(), "ratechecker-profiles"
+)
+ARCHIVE_LABEL = "Archive pages for offline replay"
+ARCHIVE_HELP = (
+    "Stores each property page and calendar response (compressed) so extraction "
+    "fixes can be tested later with `python archive.py replay` instead of scraping live."
+)
+ARCHIVE_DIR = os.environ.get("RATECHECKER_ARCHIVE_DIR") or os.path.join(
+    tempfile.gettempdir(), "ratechecker-archive"
+)
+COMPSET_LABEL = "Comp-set destination (optional)"
+COMPSET_HELP = (
+    "City or area of your competitive set, e.g. Frankfurt am Main. One dated search per date "
+    "prices every hotel it can match; the rest are checked on their own property page."
+)
+CHECKPOINT_DIR = os.environ.get("RATECHECKER_CHECKPOINT_DIR") or os.path.join(
+    tempfile.gettempdir(), "ratechecker-runs"
+)
+RESUME_HELP = (
+    "A previous run with exactly these hotels, dates and currency was interrupted or lost. "
+    "Keep its finished cells and scrape only the rest."
+)
+# Shared task queue file; when set, runs are published there and `python taskqueue.py work` processes help
+QUEUE_PATH = os.environ.get("RATECHECKER_QUEUE")
+QUEUE_PROGRESS = "{done} of {total} cells done · {workers} worker(s) active"
+TRACE_LABEL = "Profile slow cells"
+TRACE_HELP = (
+    "Keeps a Playwright trace (screenshots, network, DOM) of the slowest cells plus a small "
+    "random sample, and a Python profile of the whole run, as a zip download."
+)
+TRACE_DIR = os.environ.get("RATECHECKER_TRACE_DIR") or os.path.join(
+    tempfile.gettempdir(), "ratechecker-traces"
+)
+PORTFOLIO_UPLOAD = "Import hotel portfolio (CSV/XLSX)"
+PORTFOLIO_UPLOAD_HELP = (
+    "One hotel per row with a name column (hotel / name) and a link column "
+    "(booking_url / url / link). Rows are loaded into the table below."
+)
 
 # ---------------------------
 # Password protection (landing)
@@ -288,10 +255,126 @@ if not st.session_state.authenticated:
 
         st.markdown("</div>", unsafe_allow_html=True)
 
+    if "landing_ready_ms" not in st.session_state:
+        st.session_state.landing_ready_ms = round((time.perf_counter() - _APP_T0) * 1000, 1)
+        print(f"[INFO] landing page ready in {st.session_state.landing_ready_ms} ms")
+
     # Stop the rest of the app from rendering until logged in
     st.stop()
 
 
+# ---------------------------
+# Heavy imports (scraping view only)
+# ---------------------------
+import pandas as pd
+from scraper import PREFETCH, SCHEDULER, WarmBrowsers, prefetch_properties, scrape_hotels_for_dates
+from eventloop import BackgroundLoop
+import metrics
+import tracing
+import checkpoint
+from portfolio import read_portfolio, prepare_portfolio, unique_hotels, fan_out_results
+from export import NO_RATE, results_to_frame, pivot_rates, cache_age_grid, write_rates_csv, write_rates_xlsx
+
+ensure_playwright_chromium()
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_exporters() -> bool:
+    """Start the metrics history sampler and optional file/port exporters once per process."""
+    return metrics.start_exporters()
+
+start_metrics_exporters()
+
+@st.cache_resource(show_spinner=False)
+def scrape_loop() -> tuple:
+    """
+    One event loop per server process with a warm Playwright driver and
+    browser on it, started right away so the first run doesn't pay for it.
+    """
+    loop, warm = BackgroundLoop(), WarmBrowsers()
+    loop.submit(warm.start())
+    return loop, warm
+
+SCRAPE_LOOP, WARM_BROWSERS = scrape_loop()
+
+# ---------------------------
+# Admin view (sidebar, separate credentials from .streamlit/secrets.toml)
+# ---------------------------
+def check_admin(user: str, pwd: str) -> bool:
+    try:
+        creds = st.secrets["credentials"]
+        pairs = zip(list(creds.get("usernames", [])), list(creds.get("passwords", [])))
+    except Exception:
+        return False
+    # compare_digest only takes ASCII str; compare UTF-8 bytes so any input works
+    return any(hmac.compare_digest(user.encode("utf-8"), str(u).encode("utf-8"))
+               and hmac.compare_digest(pwd.encode("utf-8"), str(p).encode("utf-8")) for u, p in pairs)
+
+def _label_frame(values: dict, value_name: str) -> pd.DataFrame:
+    return pd.DataFrame([{**dict(k), value_name: v} for k, v in values.items()])
+
+def render_admin_panel():
+    """Charts of the process-wide scraper metrics (same data as the OpenMetrics export)."""
+    snap = metrics.take_snapshot()
+    cells = _label_frame(metrics.CELLS.values(), "cells")
+    total, ok = snap["cells_total"], snap["cells_ok"]
+
+    c1, c2 = st.columns(2)
+    c1.metric("Cells", int(total))
+    c2.metric("Success", f"{ok / total:.0%}" if total else "–")
+    c1.metric("Browsers open", int(snap["browsers_open"]))
+    c2.metric("Queue depth", int(snap["queue_depth"]))
+    c1.metric("In flight", int(snap["cells_in_flight"]))
+    c2.metric("Coalesced", int(sum(metrics.COALESCED.values().values())))
+    warm = WARM_BROWSERS.status()
+    c2.metric("Warm browsers", warm["idle"], help=f"Playwright restarts: {warm['restarts']}")
+    c1.metric("Cells waiting for a slot", SCHEDULER.waiting(), help=f"{SCHEDULER.busy} of {SCHEDULER.slots} slots busy")
+    checks = {dict(k).get("outcome"): v for k, v in metrics.PAGE_STATE_CHECKS.values().items()}
+    checked = checks.get("agree", 0) + checks.get("disagree", 0)
+    prefetch = PREFETCH.status()
+    c2.metric("Prefetched properties", prefetch["resolved"],
+              help=f"{prefetch['pending']} pending, {prefetch['failed']} failed recently")
+    c1.metric("Page-state agreement", f"{checks.get('agree', 0) / checked:.0%}" if checked else "–")
+    p50, p90 = metrics.CELL_SECONDS.quantile(0.5), metrics.CELL_SECONDS.quantile(0.9)
+    st.caption(f"Cell latency p50 ≤ {p50}s, p90 ≤ {p90}s" if p50 is not None else "No cells yet")
+
+    if not cells.empty:
+        st.markdown("**Cells by reason**")
+        by_reason = cells.assign(reason=cells["reason"].replace("", "OK")).groupby("reason")["cells"].sum()
+        st.bar_chart(by_reason)
+
+    hist = metrics.CELL_SECONDS.values()
+    if hist:
+        counts = [sum(row[i] for row in hist.values()) for i in range(len(metrics.CELL_SECONDS.buckets) + 1)]
+        labels = [f"≤{b}s" for b in metrics.CELL_SECONDS.buckets] + ["more"]
+        st.markdown("**Cell latency**")
+        st.bar_chart(pd.Series(counts, index=pd.CategoricalIndex(labels, categories=labels, ordered=True)))
+
+    if len(metrics.HISTORY) > 1:
+        history = pd.DataFrame(list(metrics.HISTORY))
+        history["ts"] = pd.to_datetime(history["ts"], unit="s")
+        history = history.set_index("ts")
+        elapsed_min = history.index.to_series().diff().dt.total_seconds().div(60)
+        st.markdown("**Cells per minute**")
+        st.line_chart(history["cells_total"].diff().div(elapsed_min).fillna(0))
+        st.markdown("**Browsers / queue**")
+        st.line_chart(history[["browsers_open", "queue_depth", "cells_in_flight"]])
+
+    st.download_button("Download OpenMetrics", metrics.render_openmetrics(),
+                       file_name="ratechecker.metrics.txt", mime="text/plain")
+
+with st.sidebar:
+    with st.expander(ADMIN_SECTION):
+        if not st.session_state.get("admin_ok"):
+            admin_user = st.text_input("Admin user", key="admin_user")
+            admin_pwd = st.text_input("Admin password", type="password", key="admin_pwd")
+            if st.button("Unlock", key="admin_unlock"):
+                if check_admin(admin_user, admin_pwd):
+                    st.session_state.admin_ok = True
+                    st.rerun()
+                else:
+                    st.error("❌ Wrong admin credentials")
+        else:
+            render_admin_panel()
 
 # ---------------------------
 # App header (post-login)
@@ -378,26 +461,39 @@ edited_dates = st.session_state.parsed_dates
 # Debug toggle (for URL warnings)
 # ---------------------------
 debug_flag = st.toggle("Debug logs", st.session_state.get("debug_flag", False), key="debug_flag")
+persistent_profile = st.toggle(
+    PERSISTENT_PROFILE_LABEL,
+    st.session_state.get("persistent_profile", bool(os.environ.get("RATECHECKER_PROFILE_DIR"))),
+    key="persistent_profile",
+    help=PERSISTENT_PROFILE_HELP,
+)
+archive_pages = st.toggle(
+    ARCHIVE_LABEL,
+    st.session_state.get("archive_pages", bool(os.environ.get("RATECHECKER_ARCHIVE_DIR"))),
+    key="archive_pages",
+    help=ARCHIVE_HELP,
+)
+profile_cells = st.toggle(TRACE_LABEL, st.session_state.get("profile_cells", False),
+                          key="profile_cells", help=TRACE_HELP)
 
 # ---------------------------
 # Hotel input (no preset rows)
 # ---------------------------
-BOOKING_URL_RE = re.compile(
-    r"^https?://[^/]*booking\.com/(?:[^/]+/)?hotel/[^/?#]+\.html(?:[?#].*)?$",
-    re.IGNORECASE
-)
-
-def _canon_booking_url(u: str) -> str:
-    if not u:
-        return ""
-    u = u.strip()
-    u = re.sub(r"^https?://m\.booking\.com", "https://www.booking.com", u, flags=re.I)
-    u = re.sub(r"^https?://[^/]*booking\.com", "https://www.booking.com", u, flags=re.I)
-    return u.split("#")[0].split("?")[0]
-
 st.subheader(HOTEL_INFO)
 
+uploaded_portfolio = st.file_uploader(
+    PORTFOLIO_UPLOAD,
+    type=["csv", "xlsx"],
+    help=PORTFOLIO_UPLOAD_HELP,
+    key="portfolio_upload",
+)
+
 default_hotels_df = pd.DataFrame(columns=["hotel", "booking_url"])
+if uploaded_portfolio is not None:
+    try:
+        default_hotels_df = read_portfolio(uploaded_portfolio)
+    except Exception as e:
+        st.error(f"Could not read portfolio file: {e}")
 
 hotels_df = st.data_editor(
     default_hotels_df,
@@ -417,16 +513,31 @@ hotels_df = st.data_editor(
     key="hotels_editor",
 )
 
-hotels_input = []
-for _, row in hotels_df.iterrows():
-    name = (row.get("hotel") or "").strip()
-    url = _canon_booking_url(row.get("booking_url") or "")
-    if url and not BOOKING_URL_RE.match(url) and debug_flag:
-        st.warning(
-            f"‘{name}’ has a URL that doesn’t look like a Booking property link. "
-            "I’ll still try, but consider pasting the full property page URL."
-        )
-    hotels_input.append({"name": name, "url": url})
+portfolio = prepare_portfolio(hotels_df)
+hotels_input = portfolio[["name", "url"]].to_dict("records")
+hotels_unique, hotel_aliases = unique_hotels(portfolio)
+
+bad_urls = portfolio.loc[(portfolio["url"] != "") & ~portfolio["url_valid"], "name"].tolist()
+if bad_urls and debug_flag:
+    st.warning(
+        f"{len(bad_urls)} row(s) have a URL that doesn’t look like a Booking property link "
+        f"({', '.join(bad_urls[:10])}{', …' if len(bad_urls) > 10 else ''}). "
+        "I’ll still try, but consider pasting the full property page URL."
+    )
+if len(hotels_unique) < len(hotels_input):
+    st.caption(
+        f"{len(hotels_input)} rows, {len(hotels_unique)} unique properties — "
+        "duplicate links are scraped once and copied to every row."
+    )
+
+# One fair-share user per browser session (the app has a single shared password)
+scheduler_user = st.session_state.setdefault("scheduler_user", uuid.uuid4().hex[:8])
+
+# While the rows are still being edited, resolve new/changed properties in the background
+prefetch_rows = tuple((h["name"], h["url"]) for h in hotels_unique if h["name"])
+if prefetch_rows and st.session_state.get("prefetch_rows") != prefetch_rows:
+    st.session_state["prefetch_rows"] = prefetch_rows
+    SCRAPE_LOOP.submit(prefetch_properties(hotels_unique, user=scheduler_user, warm=WARM_BROWSERS))
 
 # ---------------------------
 # Dates table preview
@@ -448,6 +559,22 @@ currency = st.selectbox(
 )
 selected_currency = currency or "EUR"
 
+destination = st.text_input(COMPSET_LABEL, st.session_state.get("destination", ""), key="destination",
+                            help=COMPSET_HELP).strip()
+
+# Offer to continue a crashed/dropped run of the same plan
+resumable = checkpoint.find_resumable(
+    CHECKPOINT_DIR, checkpoint.plan_fingerprint(hotels_unique, all_dates, selected_currency, destination or None)
+)
+resume_run = False
+if resumable is not None:
+    done_cells, total_cells = resumable.progress()
+    age_s = resumable.age_s()
+    started = "" if age_s is None else (
+        f", started {age_s / 60:.0f} min ago" if age_s < 5400 else f", started {age_s / 3600:.1f} h ago")
+    resume_run = st.toggle(f"Resume previous run ({done_cells} of {total_cells} cells done{started})", False,
+                           key="resume_run", help=RESUME_HELP)
+
 # ---------------------------
 # Start Web Scraping
 # ---------------------------
@@ -462,48 +589,143 @@ if st.button(GENERATE_BUTTON, type="primary"):
         st.error("No dates found. Generate or edit dates first, then click Start Web Scraping.")
         st.stop()
 
+    run_stats = {}
+    queue_bar = st.progress(0.0) if QUEUE_PATH else None
+    queue_progress = {}  # filled on the scrape loop, shown from this (the script) thread
+
     with st.spinner("Scraping Booking.com..."):
-        results = asyncio.run(
+        future = SCRAPE_LOOP.submit(
             scrape_hotels_for_dates(
-                hotels=hotels_input,
+                hotels=hotels_unique,
                 dates=dates,
                 selected_currency=selected_currency,
                 debug=debug_flag,
+                profile_dir=PROFILE_DIR if persistent_profile else None,
+                run_stats=run_stats,
+                archive_dir=ARCHIVE_DIR if archive_pages else None,
+                trace_dir=TRACE_DIR if profile_cells else None,
+                destination=destination or None,
+                checkpoint_dir=CHECKPOINT_DIR,
+                resume=resume_run,
+                queue_path=QUEUE_PATH,
+                on_progress=queue_progress.update if QUEUE_PATH else None,
+                warm=WARM_BROWSERS,
+                user=scheduler_user,
             )
         )
-
-        debug_rows = []
-        for (name, ymd), r in results.items():
-            status = r.get("status") if isinstance(r, dict) else "No rate found"
-            reason = r.get("reason") if isinstance(r, dict) else "unexpected_none_result"
-            debug_rows.append({"hotel": name, "date": ymd, "status": status, "reason": reason})
+        try:
+            while True:
+                try:
+                    results = future.result(timeout=0.5)
+                    break
+                except concurrent.futures.TimeoutError:
+                    if queue_bar is not None and queue_progress:
+                        p = dict(queue_progress)
+                        queue_bar.progress(p["done"] / max(p["total"], 1), text=QUEUE_PROGRESS.format(**p))
+        except BaseException:
+            future.cancel()  # session stopped or rerun: don't leave the run going on the shared loop
+            raise
+        results = fan_out_results(results, hotel_aliases)
+
+        frame = results_to_frame(results)
         st.caption("Debug (temporary)")
-        st.dataframe(pd.DataFrame(debug_rows), use_container_width=True)
-
-    out_rows = []
-    for d in dates:
-        row = {"Date": ddmmyyyy(d)}
-        for h in hotels_input:
-            key = (h["name"], d.strftime("%Y-%m-%d"))
-            r = results.get(key)
-            if not r or r.get("status") != "OK" or r.get("value") is None:
-                row[h["name"]] = "No rate found"
-            else:
-                row[h["name"]] = f"{r['value']:.2f}"
-        out_rows.append(row)
-
-    out_df = pd.DataFrame(out_rows)
-    st.dataframe(out_df, use_container_width=True)
-
-    st.download_button(
-        "Download CSV",
-        out_df.to_csv(index=False).encode("utf-8"),
-        file_name=f"booking_rates_{selected_currency}.csv",
-        mime="text/csv",
+        st.dataframe(frame[["hotel", "date", "status", "reason", "stage", "strategy", "cache_hit_ratio"]], use_container_width=True)
+        mem = run_stats.get("memory") or {}
+        if mem.get("samples"):
+            st.caption(
+                "Memory (MB, peak / avg) — "
+                f"Python {mem['python_rss_peak_mb']} / {mem['python_rss_avg_mb']}, "
+                f"browsers {mem['browsers_rss_peak_mb']} / {mem['browsers_rss_avg_mb']}, "
+                f"host {mem['host_used_peak_mb']} / {mem['host_used_avg_mb']} of {mem['host_limit_mb']}; "
+                f"browsers launched {run_stats.get('browsers_launched', 0)} "
+                f"(+{run_stats.get('warm_browsers_used', 0)} warm), "
+                f"recycles {run_stats.get('recycled') or 0}, "
+                f"admission waits {run_stats.get('admission_waits', 0)}, "
+                f"coalesced duplicate cells {run_stats.get('coalesced', 0)}"
+            )
+        if run_stats.get("render_fallbacks"):
+            st.caption(f"{run_stats['render_fallbacks']} properties needed full page rendering "
+                       f"({run_stats['launch_profile']} browser profile)")
+        if run_stats.get("prefetched"):
+            st.caption(f"{run_stats['prefetched']} properties were already resolved in the background")
+        if run_stats.get("slot_waits"):
+            st.caption(
+                f"Shared with other runs ({run_stats['priority']} priority): waited {run_stats['slot_waits']} "
+                f"time(s), {run_stats['slot_wait_s']} s in total, for a free scraping slot"
+            )
+        queue_stats = run_stats.get("queue")
+        if queue_stats:
+            st.caption(
+                f"Queue run {queue_stats['run_id']}: {queue_stats['published']} cells published, "
+                f"up to {queue_stats['workers']} worker(s) at once"
+            )
+        if run_stats.get("resumed_cells"):
+            st.caption(f"Resumed run {run_stats['run_id']}: {run_stats['resumed_cells']} cells taken from its checkpoint")
+        compset = run_stats.get("compset")
+        if compset:
+            st.caption(
+                f"Comp-set search: {compset['matched']} cells priced from {compset['pages']} result page(s), "
+                f"{compset['fallback']} checked per property"
+            )
+        page_state = run_stats.get("page_state") or {}
+        checks = page_state.get("agree", 0) + page_state.get("disagree", 0)
+        if page_state.get("cells") or checks:
+            st.caption(
+                f"Page state: {page_state['cells']} cells priced from the embedded room table; "
+                f"agreed with DOM/GraphQL in {page_state['agree']} of {checks} checks"
+            )
+        if frame["cache_hit_ratio"].notna().any():
+            st.caption(f"Browser cache hit ratio: {frame['cache_hit_ratio'].mean():.0%} (avg per task)")
+
+    if run_stats.get("trace_dir"):
+        kept = run_stats["traces"]["kept"]
+        st.caption(
+            f"Profile: {len(kept)} trace(s) kept of {run_stats['traces']['cells']} cells — slowest: "
+            + (", ".join(f"{c['hotel']} {c['date']} {c['seconds']:.0f}s" for c in kept[:3]) or "none")
+        )
+        python_profile = run_stats["traces"].get("python_profile")
+        if python_profile == "skipped":
+            st.caption("No Python profile: other runs were using the scraper at the same time.")
+        elif python_profile == "shared":
+            st.caption("Python profile includes other runs that overlapped with this one.")
+        st.download_button(
+            "Download profile (.zip)",
+            tracing.bundle(run_stats["trace_dir"]),
+            file_name=f"{os.path.basename(run_stats['trace_dir'])}.zip",
+            mime="application/zip",
+            help="Open traces/*.zip with `playwright show-trace`; python.collapsed in speedscope.",
+        )
+
+    hotel_names = [h["name"] for h in hotels_input]
+    grid = pivot_rates(frame, hotel_names, dates)
+    st.dataframe(
+        grid,
+        use_container_width=True,
+        column_config={
+            "Date": st.column_config.DateColumn("Date", format="DD.MM.YYYY"),
+            **{n: st.column_config.NumberColumn(n, format="%.2f") for n in grid.columns},
+        },
     )
+    st.caption(f"Empty cells: {NO_RATE}")
+
+    col_csv, col_xlsx = st.columns(2)
+    with col_csv:
+        st.download_button(
+            "Download CSV",
+            write_rates_csv(grid),
+            file_name=f"booking_rates_{selected_currency}.csv",
+            mime="text/csv",
+        )
+    with col_xlsx:
+        st.download_button(
+            "Download Excel",
+            write_rates_xlsx(grid, frame, age=cache_age_grid(frame, hotel_names, dates)),
+            file_name=f"booking_rates_{selected_currency}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
 
     total_tasks = len(hotels_input) * len(dates)
-    ok_count = sum(1 for r in results.values() if r.get("status") == "OK")
+    ok_count = int((frame["status"] == "OK").sum())
     if ok_count == 0:
         st.error("No scraping possible. Giulio doesn’t get a beer :(")
     elif ok_count < total_tasks:
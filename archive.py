@@ -0,0 +1,201 @@
+# archive.py
+"""
+Record-and-replay archive of scraped pages.
+
+Recording (opt-in): every property page HTML (settled, or as loaded when its
+embedded page state priced the stay), destination search
+page (comp-set mode) and AvailabilityCalendar response is stored gzip-compressed under its SHA-256
+(objects/ab/cdef...gz, so identical snapshots are stored once) and indexed
+in index.jsonl together with the live cell results.
+
+Replay: the pure extraction functions in scraper.py are re-run over the
+archived snapshots in a process pool, without a browser, and compared to
+what was recorded live. Useful as a regression check after markup changes
+and to backfill new fields.
+
+    python archive.py replay <archive_dir> [--workers N] [--out replay.jsonl]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+INDEX_FILE = "index.jsonl"
+OBJECTS_DIR = "objects"
+
+
+class HtmlArchive:
+    """Content-addressed, gzip-compressed store of page snapshots plus a JSONL index."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, OBJECTS_DIR), exist_ok=True)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, OBJECTS_DIR, digest[:2], digest[2:] + ".gz")
+
+    def put_blob(self, data: bytes) -> str:
+        """Store `data` once under its SHA-256 and return the digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp, "wb", compresslevel=6) as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def load_blob(self, digest: str) -> bytes:
+        with gzip.open(self._object_path(digest), "rb") as f:
+            return f.read()
+
+    def _append(self, entry: Dict):
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock, open(os.path.join(self.root, INDEX_FILE), "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def record(self, kind: str, url: str, checkin: datetime, data: bytes, **meta):
+        """Store one snapshot (kind: "property_html", "search_html" or "graphql") and index it."""
+        try:
+            digest = self.put_blob(data)
+            self._append({"kind": kind, "url": url, "checkin": checkin.strftime("%Y-%m-%d"),
+                          "sha256": digest, "size": len(data), **meta})
+        except OSError as e:
+            print(f"[WARN] archive write failed: {e}")
+
+    def record_result(self, hotel: str, checkin: datetime, result: Dict):
+        """Index the live outcome of a cell so replays can be compared against it."""
+        try:
+            self._append({"kind": "cell_result", "hotel": hotel, "checkin": checkin.strftime("%Y-%m-%d"),
+                          "result": result})
+        except OSError as e:
+            print(f"[WARN] archive write failed: {e}")
+
+    def entries(self, kind: Optional[str] = None) -> Iterator[Dict]:
+        path = os.path.join(self.root, INDEX_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of an interrupted run
+                if kind is None or e.get("kind") == kind:
+                    yield e
+
+
+# ---------- Replay ----------
+def _replay_entry(args) -> Dict:
+    """Re-run extraction for one archived snapshot (runs in a worker process)."""
+    root, entry = args
+    import scraper
+
+    out = {k: entry.get(k) for k in ("kind", "url", "checkin", "sha256", "nights", "window_start", "span", "offset")}
+    try:
+        data = HtmlArchive(root).load_blob(entry["sha256"])
+    except OSError as e:
+        return {**out, "error": f"missing_blob {e}"}
+    checkin = datetime.strptime(entry["checkin"], "%Y-%m-%d")
+
+    if entry["kind"] == "property_html":
+        html = data.decode("utf-8", errors="replace")
+        nights = int(entry.get("nights") or 1)
+        cheapest = scraper.cheapest_from_html(html, nights)
+        out.update({
+            "tokens": scraper._extract_property_tokens_from_html(html),
+            "minstay": scraper.detect_minstay(html),
+            "dom_total": cheapest[0] if cheapest else None,
+            "dom_per_night": cheapest[1] if cheapest else None,
+            "page_state": scraper.price_from_page_state(html, nights),
+        })
+    elif entry["kind"] == "search_html":
+        out["cards"] = scraper.cards_from_html(data.decode("utf-8", errors="replace"))
+    elif entry["kind"] == "graphql":
+        try:
+            out["calendar"] = scraper.price_from_calendar(json.loads(data), checkin)
+        except ValueError:
+            out["calendar"] = {"error": "bad_json"}
+    return out
+
+
+def replay(root: str, workers: Optional[int] = None, kinds=("property_html", "search_html", "graphql")) -> List[Dict]:
+    """Re-extract every archived snapshot of `kinds` in parallel; returns one dict per snapshot."""
+    arch = HtmlArchive(root)
+    jobs = [(root, e) for e in arch.entries() if e.get("kind") in kinds]
+    if not jobs:
+        return []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_replay_entry, jobs, chunksize=max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4))))
+
+
+def compare_with_live(root: str, replayed: List[Dict]) -> Dict:
+    """
+    Compare replayed DOM prices with the live per-night values recorded for
+    the same property URL + check-in + nights, and the replayed page-state
+    prices with the replayed DOM ones. Returns counts and the mismatches.
+    """
+    import scraper
+
+    live = {}
+    for e in HtmlArchive(root).entries("cell_result"):
+        r = e.get("result") or {}
+        # GraphQL-won cells were not priced from the page, so they say nothing about DOM extraction
+        if r.get("status") == "OK" and r.get("property_url") and r.get("strategy") in (None, "dom"):
+            live[(r["property_url"], e["checkin"], int(r.get("nights_queried") or 1))] = r.get("value")
+
+    stats = {"compared": 0, "match": 0, "mismatch": [], "no_live": 0,
+             "page_state": {"compared": 0, "agree": 0}}
+    for r in replayed:
+        if r.get("kind") != "property_html" or r.get("dom_per_night") is None:
+            continue
+        page_state = r.get("page_state") or {}
+        if "per_night" in page_state:
+            agreement = scraper.page_state_agreement(page_state, {"per_night": r["dom_per_night"]})
+            stats["page_state"]["compared"] += 1
+            stats["page_state"]["agree"] += agreement == "agree"
+        key = ((r.get("url") or "").split("?")[0], r.get("checkin"), int(r.get("nights") or 1))
+        if key not in live:
+            stats["no_live"] += 1
+            continue
+        stats["compared"] += 1
+        if live[key] is not None and abs(live[key] - r["dom_per_night"]) < 0.01:
+            stats["match"] += 1
+        else:
+            stats["mismatch"].append({"url": key[0], "checkin": key[1], "live": live[key],
+                                      "replay": r["dom_per_night"], "sha256": r.get("sha256")})
+    return stats
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Replay archived Booking pages through the extractors.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("replay")
+    rp.add_argument("root")
+    rp.add_argument("--workers", type=int, default=None)
+    rp.add_argument("--out", default=None, help="write one JSON line per snapshot")
+    args = ap.parse_args(argv)
+
+    replayed = replay(args.root, workers=args.workers)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for r in replayed:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    stats = compare_with_live(args.root, replayed)
+    print(f"replayed {len(replayed)} snapshots; compared {stats['compared']}, "
+          f"match {stats['match']}, mismatch {len(stats['mismatch'])}, without live result {stats['no_live']}")
+    print(f"page state agreed with DOM on {stats['page_state']['agree']} of {stats['page_state']['compared']} pages")
+    for m in stats["mismatch"][:20]:
+        print(f"  MISMATCH {m['url']} {m['checkin']}: live={m['live']} replay={m['replay']} ({m['sha256'][:12]})")
+    return 1 if stats["mismatch"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
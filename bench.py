@@ -0,0 +1,368 @@
+# bench.py
+"""
+Offline micro-benchmarks of the pure hot-path functions (no browser, no network).
+
+Every case runs over fixed fixtures: generated from a seed (a multi-MB
+property page with room table, embedded page state and calendar tokens, a
+search result page, price strings, URLs and search card texts), or with
+--archive the largest property/search pages recorded by archive.HtmlArchive.
+Per case we report ops/sec (best of --repeat timing rounds) and, from a
+separate tracemalloc pass, the peak KiB allocated by one op.
+
+    python bench.py run [--save bench-baseline.json] [--archive DIR] [--only money,tokens]
+    python bench.py compare [bench-baseline.json] [--threshold 0.25]
+    python bench.py launch [--profiles full,lite] [--pages 10] [--url URL] [--out launch.json]
+
+`compare` re-runs the cases and exits 1 when one got slower or allocates
+more than the baseline by more than --threshold. Timings are only
+comparable on the machine (and fixtures) the baseline was taken on; both
+are recorded in the file and a mismatch is pointed out.
+
+`launch` compares the browser launch profiles (scraper.LAUNCH_PROFILES):
+startup time to a ready blank tab, and per loaded page the wall time,
+browser CPU seconds and peak browser RSS. By default the pages are the
+generated property page (plus images and CSS animations) from a local
+file, so this runs offline too; --url measures a live page instead.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+BENCH_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench-baseline.json")
+BENCH_SEED = 42
+# Size of the generated property page
+BENCH_PAGE_MB = 3.0
+BENCH_REPEAT = 5
+# Regressions below these are noise
+BENCH_THRESHOLD = 0.25
+BENCH_MIN_PEAK_KIB = 16
+BENCH_LAUNCH_PAGES = 10
+# Time given to each page after "load" (animations, lazy content)
+BENCH_LAUNCH_SETTLE_MS = 1500
+
+
+# ---------- Fixtures ----------
+def _property_page(rng: random.Random, size_mb: float) -> str:
+    """Booking-like property page: filler markup, room table, page state; tokens near the end (worst case)."""
+    words = ["Zimmer", "Frühstück", "inklusive", "Aussicht", "Doppelbett", "kostenlos", "Stornierung",
+             "Bewertung", "Lage", "Personal", "sauber", "komfortabel", "WLAN", "Parkplatz"]
+    rooms = []
+    for i in range(12):
+        blocks = []
+        for j in range(rng.randint(2, 6)):
+            price = round(rng.uniform(80, 900), 2)
+            blocks.append({"b_block_id": f"{i}_{j}", "b_max_persons": rng.choice([1, 2, 2, 3, 4]),
+                           "b_raw_price": str(price), "b_price": f"€ {price:,.2f}",
+                           "b_price_breakdown_simplified": {"b_headline_price_amount": price}})
+        rooms.append({"b_id": i, "b_name": f"Room {i}", "b_blocks": blocks})
+    table = "".join(
+        f'<tr class="hprt-table-row"><td>{" ".join(rng.choices(words, k=8))}</td>'
+        f'<td><span class="prco-valign-middle-helper">€ {b["b_raw_price"]}</span></td></tr>'
+        for room in rooms for b in room["b_blocks"]
+    )
+    head = ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>Hotel</title>'
+            '<script>var booking = {env: {b_site_type: "www"}};</script></head><body>')
+    tail = (f'<table class="hprt-table">{table}</table>'
+            f'<script>window.__state = {{b_rooms_available_and_soldout: {json.dumps(rooms)}}};</script>'
+            "<script>booking.env = {b_csrf_token: 'bench-csrf-token', hotelName: \"bench-hotel\", "
+            'hotelCountry: "de"};</script></body></html>')
+    filler, size, target = [], len(head) + len(tail), int(size_mb * 1024 * 1024)
+    while size < target:
+        chunk = (f'<div class="hp-description" data-i="{len(filler)}"><p>{" ".join(rng.choices(words, k=30))}</p>'
+                 f'<span class="review-score">{rng.uniform(6, 10):.1f}</span></div>\n')
+        filler.append(chunk)
+        size += len(chunk)
+    return head + "".join(filler) + tail
+
+
+def _search_page(rng: random.Random, cards: int = 25) -> str:
+    out = ['<html><body><div id="search_results_table">']
+    for i in range(cards):
+        out.append(
+            f'<div data-testid="property-card"><div data-testid="title">Hotel Bench {i}</div>'
+            f'<span data-testid="address">Frankfurt am Main, Straße {i}</span>'
+            f'<a data-testid="title-link" href="https://www.booking.com/hotel/de/bench-{i}.de.html?aid=1">x</a>'
+            f'<span data-testid="price-and-discounted-price">€ {rng.randint(80, 900)}</span></div>'
+        )
+    out.append("</div></body></html>")
+    return "".join(out)
+
+
+def build_fixtures(seed: int = BENCH_SEED, page_mb: float = BENCH_PAGE_MB, archive_dir: Optional[str] = None) -> Dict:
+    rng = random.Random(seed)
+    currencies = ["€ {}", "US${}", "{} €", "CHF {}", "{} zł", "£{}", "{} Kč", "Preis: {} – {}"]
+    money = []
+    for _ in range(200):
+        a, b = rng.uniform(10, 20000), rng.uniform(10, 20000)
+        fmt = rng.choice(currencies)
+        money.append(fmt.format(f"{a:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), f"{b:,.0f}"))
+    urls = [
+        f"https://www.booking.com/hotel/de/bench-{i}.{rng.choice(['de', 'en-gb', 'html'])}.html"
+        f"?aid={rng.randint(1, 10 ** 6)}&label=gen{i}&sid=abc{i}&checkin=2026-11-0{i % 9 + 1}#availability"
+        for i in range(200)
+    ]
+    cards = [(f"Hotel Bench {i}", f"Hotel Bench {rng.randint(0, 60)} Frankfurt", "Frankfurt am Main, Zentrum")
+             for i in range(50)]
+    fixtures = {"property_html": _property_page(rng, page_mb), "search_html": _search_page(rng),
+                "money": money, "urls": urls, "cards": cards, "source": f"seed {seed}"}
+    if archive_dir:
+        from archive import HtmlArchive
+        arch = HtmlArchive(archive_dir)
+        for kind in ("property_html", "search_html"):
+            recorded = max(arch.entries(kind), key=lambda e: e.get("size", 0), default=None)
+            if recorded is not None:
+                fixtures[kind] = arch.load_blob(recorded["sha256"]).decode("utf-8", errors="replace")
+        fixtures["source"] = f"archive {archive_dir}"
+    return fixtures
+
+
+def fixtures_digest(fixtures: Dict) -> str:
+    h = hashlib.sha256()
+    for key in sorted(k for k in fixtures if k != "source"):
+        h.update(json.dumps(fixtures[key], ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+# ---------- Cases ----------
+def build_cases(fx: Dict) -> Dict[str, Tuple[Callable[[], object], int]]:
+    """name -> (one op, items per op)."""
+    import scraper
+    import utils
+
+    html, search = fx["property_html"], fx["search_html"]
+    start = datetime(2026, 10, 19)
+    months = [utils.add_months(start, i) for i in range(24)]
+    return {
+        "money": (lambda: [scraper.parse_money_max(t) for t in fx["money"]], len(fx["money"])),
+        "canonical_url": (lambda: [scraper.canonicalize_booking_url(u) for u in fx["urls"]], len(fx["urls"])),
+        "score_candidate": (lambda: [scraper.score_candidate(q, "Frankfurt", n, a) for q, n, a in fx["cards"]],
+                            len(fx["cards"])),
+        "tokens": (lambda: scraper._extract_property_tokens_from_html(html), 1),
+        "minstay": (lambda: scraper.detect_minstay(html), 1),
+        "page_state": (lambda: scraper.price_from_page_state(html, 1), 1),
+        "price_cells": (lambda: scraper.price_cells_from_html(html), 1),
+        "search_cards": (lambda: scraper.cards_from_html(search), 1),
+        "pick_two_dates": (lambda: [utils.pick_two_dates_for_month(m) for m in months], len(months)),
+        "generate_dates": (lambda: utils.generate_dates_rule(start, 12), 1),
+    }
+
+
+def measure(op: Callable[[], object], repeat: int = BENCH_REPEAT) -> Dict:
+    timer = timeit.Timer(op)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    tracemalloc.start()
+    try:
+        op()
+        tracemalloc.clear_traces()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        op()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"ops_per_s": round(1 / best, 2), "us_per_op": round(best * 1e6, 1),
+            "peak_kib": round(max(peak - before, 0) / 1024, 1)}
+
+
+def run(only: Optional[List[str]] = None, archive_dir: Optional[str] = None, repeat: int = BENCH_REPEAT,
+        page_mb: float = BENCH_PAGE_MB) -> Dict:
+    fx = build_fixtures(page_mb=page_mb, archive_dir=archive_dir)
+    cases = build_cases(fx)
+    results = {}
+    for name, (op, items) in cases.items():
+        if only and name not in only:
+            continue
+        results[name] = {**measure(op, repeat), "items": items}
+        r = results[name]
+        print(f"{name:16} {r['ops_per_s']:>12,.1f} ops/s {r['us_per_op']:>12,.1f} µs/op "
+              f"{r['peak_kib']:>10,.1f} KiB peak  ({items} item(s)/op)")
+    return {
+        "created": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} {platform.node()}",
+        "fixtures": fixtures_digest(fx),
+        "fixtures_source": fx["source"],
+        "property_html_bytes": len(fx["property_html"].encode("utf-8")),
+        "cases": results,
+    }
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = BENCH_THRESHOLD) -> List[str]:
+    """Regressions of `current` against `baseline`, one line each."""
+    regressions = []
+    for name, now in current["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if base is None:
+            print(f"{name:16} new case (no baseline)")
+            continue
+        slower = base["ops_per_s"] / now["ops_per_s"] - 1 if now["ops_per_s"] else float("inf")
+        grown = now["peak_kib"] - base["peak_kib"]
+        flags = []
+        if slower > threshold:
+            flags.append(f"{slower:.0%} slower")
+        if grown > BENCH_MIN_PEAK_KIB and grown > threshold * base["peak_kib"]:
+            flags.append(f"peak +{grown:,.0f} KiB")
+        line = (f"{name:16} {now['ops_per_s']:>12,.1f} ops/s (baseline {base['ops_per_s']:,.1f}, "
+                f"{now['ops_per_s'] / base['ops_per_s'] - 1:+.0%}) "
+                f"{now['peak_kib']:>10,.1f} KiB (baseline {base['peak_kib']:,.1f})")
+        print(line + (f"  REGRESSION: {', '.join(flags)}" if flags else ""))
+        if flags:
+            regressions.append(f"{name}: {', '.join(flags)}")
+    return regressions
+
+
+# ---------- Browser launch profiles ----------
+def _render_page(html: str) -> str:
+    """The property page plus what the lite profile switches off: images and running CSS animations."""
+    img = ("data:image/svg+xml;utf8,<svg xmlns='http://www.w3.org/2000/svg' width='600' height='400'>"
+           "<rect width='600' height='400' fill='%23336'/></svg>")
+    extra = ("<style>@keyframes spin{to{transform:rotate(360deg)}}"
+             ".bench-anim{width:40px;height:40px;background:#c33;animation:spin 0.5s linear infinite}</style>"
+             + "".join(f'<img src="{img}" width="600" height="400" alt="">' for _ in range(20))
+             + '<div class="bench-anim"></div>' * 20)
+    return html.replace("<body>", "<body>" + extra, 1)
+
+
+async def _measure_launch(profile: str, url: str, pages: int, settle_ms: int) -> Dict:
+    import memwatch
+    import scraper
+    from playwright.async_api import async_playwright
+
+    marker = memwatch.new_marker()
+    async with async_playwright() as p:
+        t0 = time.perf_counter()
+        browser = await scraper.launch_browser(p, [marker], profile=profile)
+        try:
+            context = await scraper.prepare_context(
+                await browser.new_context(**scraper.context_options(profile)), profile)
+            page = await context.new_page()
+            await page.goto("about:blank")
+            startup = time.perf_counter() - t0
+            idle_rss = memwatch.browser_rss(marker) or 0
+            await page.close()
+            walls, cpus, peak = [], [], idle_rss
+            for _ in range(pages):
+                page = await context.new_page()
+                # Read CPU while the page's renderer is alive: an exited process takes its CPU time with it
+                before = memwatch.browser_cpu_seconds(marker)
+                t = time.perf_counter()
+                await page.goto(url, wait_until="load")
+                await page.wait_for_timeout(settle_ms)
+                walls.append(time.perf_counter() - t - settle_ms / 1000)
+                after = memwatch.browser_cpu_seconds(marker)
+                peak = max(peak, memwatch.browser_rss(marker) or 0)
+                if before is not None and after is not None:
+                    cpus.append(after - before)
+                await page.close()
+        finally:
+            await browser.close()
+    return {
+        "startup_s": round(startup, 3),
+        "load_s_per_page": round(sum(walls) / len(walls), 3) if walls else None,
+        "cpu_s_per_page": round(sum(cpus) / len(cpus), 3) if cpus else None,
+        "idle_rss_mb": round(idle_rss / 2**20, 1),
+        "peak_rss_mb": round(peak / 2**20, 1),
+        "headless_shell": profile == "lite" and scraper.headless_shell_path() is not None,
+    }
+
+
+def launch_compare(profiles: List[str], pages: int = BENCH_LAUNCH_PAGES, url: Optional[str] = None,
+                   settle_ms: int = BENCH_LAUNCH_SETTLE_MS) -> Dict:
+    tmp = None
+    if url is None:
+        with tempfile.NamedTemporaryFile("w", suffix=".html", delete=False, encoding="utf-8") as f:
+            f.write(_render_page(build_fixtures(page_mb=1.0)["property_html"]))
+            tmp = f.name
+        url = "file://" + tmp
+    try:
+        results = {profile: asyncio.run(_measure_launch(profile, url, pages, settle_ms)) for profile in profiles}
+    finally:
+        if tmp:
+            os.unlink(tmp)
+    base = results[profiles[0]]
+    for profile, r in results.items():
+        line = f"{profile:6} " + "  ".join(f"{k} {v}" for k, v in r.items() if k != "headless_shell")
+        if profile != profiles[0]:
+            deltas = [f"{k} {r[k] / base[k] - 1:+.0%}" for k in ("startup_s", "cpu_s_per_page", "peak_rss_mb")
+                      if r.get(k) is not None and base.get(k)]
+            line += f"  (vs {profiles[0]}: {', '.join(deltas)})"
+        if r["headless_shell"]:
+            line += "  [headless shell]"
+        print(line)
+    return {"created": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "machine": f"{platform.system()} {platform.machine()} {platform.node()}",
+            "url": "generated" if tmp else url, "pages": pages, "profiles": results}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline micro-benchmarks of the scraper's pure functions.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("run", "compare"):
+        p = sub.add_parser(name)
+        p.add_argument("--archive", default=None, help="take the property/search pages from an HtmlArchive dir")
+        p.add_argument("--only", default=None, help="comma-separated case names")
+        p.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+        p.add_argument("--page-mb", type=float, default=BENCH_PAGE_MB, help="size of the generated property page")
+    sub.choices["run"].add_argument("--save", nargs="?", const=BENCH_BASELINE, default=None,
+                                    help=f"write the results as baseline (default {BENCH_BASELINE})")
+    lp = sub.add_parser("launch")
+    lp.add_argument("--profiles", default="full,lite", help="comma-separated; the first is the reference")
+    lp.add_argument("--pages", type=int, default=BENCH_LAUNCH_PAGES)
+    lp.add_argument("--settle-ms", type=int, default=BENCH_LAUNCH_SETTLE_MS)
+    lp.add_argument("--url", default=None, help="measure this page instead of the generated one")
+    lp.add_argument("--out", default=None, help="write the measurements as JSON")
+    sub.choices["compare"].add_argument("baseline", nargs="?", default=BENCH_BASELINE)
+    sub.choices["compare"].add_argument("--threshold", type=float, default=BENCH_THRESHOLD,
+                                        help="allowed relative slowdown / peak growth")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "launch":
+        stats = launch_compare([s.strip() for s in args.profiles.split(",")], pages=args.pages, url=args.url,
+                               settle_ms=args.settle_ms)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(stats, f, indent=2)
+                f.write("\n")
+        return 0
+
+    only = [s.strip() for s in args.only.split(",")] if args.only else None
+
+    if args.cmd == "compare":
+        if not os.path.exists(args.baseline):
+            print(f"no baseline at {args.baseline} (create one with: python bench.py run --save)")
+            return 1
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    current = run(only, archive_dir=args.archive, repeat=args.repeat, page_mb=args.page_mb)
+
+    if args.cmd == "run":
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                json.dump(current, f, indent=2, ensure_ascii=False)
+                f.write("\n")
+            print(f"baseline written to {args.save}")
+        return 0
+
+    print()
+    for key in ("machine", "python", "fixtures"):
+        if baseline.get(key) != current[key]:
+            print(f"[WARN] {key} differs from the baseline ({baseline.get(key)} vs {current[key]}); "
+                  "numbers may not be comparable")
+    regressions = compare(baseline, current, threshold=args.threshold)
+    print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,177 @@
+# checkpoint.py
+"""
+Write-ahead checkpoint of a scrape run, so a crashed or dropped run can be
+resumed instead of starting over.
+
+One JSONL file per run under the checkpoint dir: a header line describing
+the plan, then one line per finished cell, flushed as soon as the cell
+completes (so it survives the process dying) and fsynced at most every
+CHECKPOINT_FSYNC_INTERVAL_S and when the run ends (sync). A run is identified by the fingerprint of its plan
+(hotels, dates, currency, destination); resuming picks the newest
+checkpoint with the same fingerprint and skips its finished cells.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Checkpoints older than this are deleted when a new run starts
+CHECKPOINT_MAX_AGE_DAYS = 7
+# Cells that failed for one of these reasons are scraped again on resume
+RETRY_REASONS = ("exception", "deadline_exceeded")
+# Cell lines are written on the scrape loop; fsync them in batches
+CHECKPOINT_FSYNC_INTERVAL_S = 2.0
+
+# path -> ((mtime_ns, size), (done, total, created)); the app asks on every rerun
+_SUMMARY_CACHE: Dict[str, Tuple[Tuple[int, int], Tuple[int, int, Optional[float]]]] = {}
+_SUMMARY_LOCK = threading.Lock()
+
+
+def plan_fingerprint(hotels: List[Dict], dates: Iterable[datetime], currency: str,
+                     destination: Optional[str] = None) -> str:
+    """Stable id of what a run scrapes (order of hotels/dates does not matter)."""
+    plan = {
+        "hotels": sorted([h.get("name") or "", h.get("url") or ""] for h in hotels),
+        "dates": sorted({d.strftime("%Y-%m-%d") for d in dates}),
+        "currency": (currency or "").upper(),
+        "destination": (destination or "").strip().casefold(),
+    }
+    return hashlib.sha256(json.dumps(plan, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def is_done(result: Dict) -> bool:
+    """Whether a checkpointed cell counts as finished (transient failures do not)."""
+    reason = result.get("reason") or ""
+    return result.get("status") == "OK" or not reason.startswith(RETRY_REASONS)
+
+
+class RunCheckpoint:
+    """Append-only JSONL log of one run's finished cells."""
+
+    def __init__(self, root: str, run_id: str):
+        self.root = root
+        self.run_id = run_id
+        self.path = os.path.join(root, f"{run_id}.jsonl")
+        self._lock = threading.Lock()
+        self._synced_at = 0.0
+
+    @classmethod
+    def create(cls, root: str, fingerprint: str, total_cells: int, **meta) -> "RunCheckpoint":
+        os.makedirs(root, exist_ok=True)
+        prune(root)
+        ckpt = cls(root, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{fingerprint}")
+        ckpt._append({"kind": "run", "run_id": ckpt.run_id, "fingerprint": fingerprint,
+                      "created": time.time(), "total_cells": total_cells, **meta}, sync=True)
+        return ckpt
+
+    def _append(self, entry: Dict, sync: bool = False):
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            if sync or time.monotonic() - self._synced_at >= CHECKPOINT_FSYNC_INTERVAL_S:
+                os.fsync(f.fileno())
+                self._synced_at = time.monotonic()
+
+    def sync(self):
+        """fsync whatever record() has written since the last batch."""
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                os.fsync(f.fileno())
+                self._synced_at = time.monotonic()
+        except OSError as e:
+            print(f"[WARN] checkpoint sync failed: {e}")
+
+    def record(self, hotel: str, ymd: str, result: Dict):
+        """Persist one finished cell before anything else happens to it."""
+        try:
+            self._append({"kind": "cell", "hotel": hotel, "date": ymd, "result": result})
+        except OSError as e:
+            print(f"[WARN] checkpoint write failed: {e}")
+
+    def header(self) -> Dict:
+        for e in self._entries():
+            if e.get("kind") == "run":
+                return e
+        return {}
+
+    def _summary(self) -> Tuple[int, int, Optional[float]]:
+        """(finished cells, planned cells, created); parsed once per file version."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return 0, 0, None
+        version = (st.st_mtime_ns, st.st_size)
+        with _SUMMARY_LOCK:
+            cached = _SUMMARY_CACHE.get(self.path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        header = self.header()
+        done = len(self.load())
+        summary = (done, header.get("total_cells") or done, header.get("created"))
+        with _SUMMARY_LOCK:
+            _SUMMARY_CACHE[self.path] = (version, summary)
+        return summary
+
+    def progress(self) -> Tuple[int, int]:
+        """(finished cells, planned cells)."""
+        done, total, _created = self._summary()
+        return done, total
+
+    def age_s(self) -> Optional[float]:
+        """Seconds since the run started (None for a checkpoint without header)."""
+        created = self._summary()[2]
+        return time.time() - created if created else None
+
+    def load(self, done_only: bool = True) -> Dict[Tuple[str, str], Dict]:
+        """(hotel, yyyy-mm-dd) -> last result recorded for it (finished cells only by default)."""
+        cells = {}
+        for e in self._entries():
+            if e.get("kind") == "cell":
+                cells[(e["hotel"], e["date"])] = e["result"]
+        if done_only:
+            cells = {k: r for k, r in cells.items() if is_done(r)}
+        return cells
+
+    def _entries(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # torn last line of a crashed run
+
+
+def find_resumable(root: str, fingerprint: str) -> Optional[RunCheckpoint]:
+    """
+    Newest checkpoint of the same plan that has finished cells, if it still
+    has unfinished ones too. A completed newest run means there is nothing
+    to resume (older, abandoned runs of the plan are not offered either).
+    """
+    if not os.path.isdir(root):
+        return None
+    for name in sorted(os.listdir(root), reverse=True):
+        if name.endswith(f"-{fingerprint}.jsonl"):
+            ckpt = RunCheckpoint(root, name[:-len(".jsonl")])
+            done, total = ckpt.progress()
+            if done:
+                return ckpt if done < total else None
+    return None
+
+
+def prune(root: str, max_age_days: float = CHECKPOINT_MAX_AGE_DAYS):
+    cutoff = time.time() - max_age_days * 86400
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if name.endswith(".jsonl") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                with _SUMMARY_LOCK:
+                    _SUMMARY_CACHE.pop(path, None)
+        except OSError:
+            pass
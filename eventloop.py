@@ -0,0 +1,45 @@
+# eventloop.py
+"""
+One long-lived asyncio loop per server process, running in a daemon thread.
+
+Streamlit reruns submit coroutines to it instead of calling asyncio.run(),
+so everything bound to the loop (the Playwright driver and the warm
+browsers of scraper.WarmBrowsers) survives from one run to the next.
+Results come back as concurrent.futures.Future; cancelling the future
+cancels the coroutine.
+"""
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine, Optional
+
+
+class BackgroundLoop:
+    def __init__(self, name: str = "ratechecker-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """Schedule `coro` on the loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Run `coro` on the loop and wait for its result (cancelled if the wait is interrupted)."""
+        fut = self.submit(coro)
+        try:
+            return fut.result(timeout)
+        except BaseException:
+            fut.cancel()
+            raise
+
+    def alive(self) -> bool:
+        return self._thread.is_alive() and self.loop.is_running()
+
+    def stop(self, timeout: float = 10.0):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
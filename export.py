@@ -0,0 +1,181 @@
+# export.py
+"""
+Result shaping and file export for scrape runs.
+
+Scrape results arrive as a rates.RateMatrix (or any {(hotel, yyyy-mm-dd):
+result_dict} mapping). They are turned
+into one typed long-format frame (one row per cell), pivoted to the
+Date x Hotel grid in a single step, and written to CSV/XLSX chunk by chunk
+into spooled temp files (no intermediate per-chunk strings pile up); the
+finished file is handed back as bytes for st.download_button.
+"""
+import tempfile
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from rates import RateMatrix
+
+NO_RATE = "No rate found"
+
+# Rows written per chunk when streaming CSV
+CSV_CHUNK_ROWS = 5000
+# Spooled exports stay in RAM up to this size, then move to disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+LONG_COLUMNS = {
+    "hotel": "string",
+    "date": "datetime64[ns]",
+    "status": "string",
+    "reason": "string",
+    "stage": "string",
+    "value": "float64",
+    "total_for_queried_nights": "float64",
+    "nights_queried": "Int64",
+    "minstay_applied": "boolean",
+    "currency": "string",
+    "strategy": "string",
+    "scraped_at": "datetime64[ns, UTC]",
+    "cache_hit_ratio": "float64",
+}
+
+
+def results_to_frame(results: Dict[Tuple[str, str], Dict]) -> pd.DataFrame:
+    """
+    Collect scrape results into a typed long-format frame.
+    Non-OK cells keep their status/reason but have NaN value/total.
+    A RateMatrix is converted column-wise straight from its arrays.
+    """
+    if isinstance(results, RateMatrix):
+        cols = results.columns()
+        frame = pd.DataFrame(cols)
+        frame["date"] = pd.to_datetime(frame["date"], format="%Y-%m-%d")
+        frame["scraped_at"] = pd.to_datetime(frame["scraped_at"], unit="s", utc=True)
+        return frame.astype(LONG_COLUMNS)
+
+    cols: Dict[str, list] = {c: [] for c in LONG_COLUMNS}
+    for (name, ymd), r in results.items():
+        r = r if isinstance(r, dict) else {"status": NO_RATE, "reason": "unexpected_none_result"}
+        ok = r.get("status") == "OK" and r.get("value") is not None
+        cols["hotel"].append(name)
+        cols["date"].append(ymd)
+        cols["status"].append(r.get("status") or NO_RATE)
+        cols["reason"].append(r.get("reason"))
+        cols["stage"].append(r.get("stage"))
+        cols["value"].append(r.get("value") if ok else None)
+        cols["total_for_queried_nights"].append(r.get("total_for_queried_nights") if ok else None)
+        cols["nights_queried"].append(r.get("nights_queried"))
+        cols["minstay_applied"].append(r.get("minstay_applied"))
+        cols["currency"].append(r.get("currency"))
+        cols["strategy"].append(r.get("strategy"))
+        cols["scraped_at"].append(r.get("scraped_at"))
+        cols["cache_hit_ratio"].append(r.get("cache_hit_ratio"))
+
+    frame = pd.DataFrame(cols)
+    frame["date"] = pd.to_datetime(frame["date"], format="%Y-%m-%d")
+    frame["scraped_at"] = pd.to_datetime(frame["scraped_at"], utc=True, format="ISO8601")
+    for c in ("value", "total_for_queried_nights", "cache_hit_ratio"):
+        frame[c] = pd.to_numeric(frame[c], errors="coerce")
+    return frame.astype(LONG_COLUMNS)
+
+
+def pivot_rates(frame: pd.DataFrame, hotel_names: Iterable[str], dates: List[datetime],
+                column: str = "value") -> pd.DataFrame:
+    """
+    Date x Hotel grid of `column` (float64, NaN = no rate), rows in `dates`
+    order and columns in `hotel_names` order (duplicates dropped).
+    """
+    names = list(dict.fromkeys(hotel_names))
+    grid = frame.pivot(index="date", columns="hotel", values=column)
+    grid = grid.reindex(index=pd.DatetimeIndex(dates).normalize(), columns=names).astype("float64")
+    grid.index.name = "Date"
+    grid.columns.name = None
+    return grid
+
+
+def cache_age_grid(frame: pd.DataFrame, hotel_names: Iterable[str], dates: List[datetime],
+                   now: Optional[datetime] = None) -> pd.DataFrame:
+    """Age in minutes of every cell's data at export time (NaN if unknown)."""
+    now = pd.Timestamp(now or datetime.now(timezone.utc))
+    aged = frame.assign(age_min=(now - frame["scraped_at"]).dt.total_seconds() / 60.0)
+    return pivot_rates(aged, hotel_names, dates, column="age_min").round(1)
+
+
+def _date_labels(index: pd.DatetimeIndex) -> np.ndarray:
+    return index.strftime("%d.%m.%Y").to_numpy()
+
+
+def write_rates_csv(grid: pd.DataFrame) -> bytes:
+    """
+    Stream the grid as CSV through a spooled temp file and return the bytes
+    (what st.download_button accepts). Prices keep two decimals; missing
+    cells read "No rate found".
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode="w+b")
+    labelled = grid.set_axis(_date_labels(grid.index), axis=0)
+    labelled.index.name = "Date"
+    for start in range(0, max(len(labelled), 1), CSV_CHUNK_ROWS):
+        chunk = labelled.iloc[start:start + CSV_CHUNK_ROWS]
+        out.write(chunk.to_csv(header=(start == 0), na_rep=NO_RATE, float_format="%.2f").encode("utf-8"))
+    out.seek(0)
+    with out:
+        return out.read()
+
+
+def _write_sheet(workbook, name: str, header: List[str], rows: Iterable[tuple], num_fmt=None):
+    """Write one sheet row by row (constant_memory mode requires row order)."""
+    ws = workbook.add_worksheet(name)
+    ws.write_row(0, 0, header)
+    for i, row in enumerate(rows, start=1):
+        for j, v in enumerate(row):
+            if v is None or (isinstance(v, float) and np.isnan(v)):
+                continue
+            if num_fmt is not None and isinstance(v, float):
+                ws.write_number(i, j, v, num_fmt)
+            else:
+                ws.write(i, j, v)
+    ws.freeze_panes(1, 1)
+    return ws
+
+
+def write_rates_xlsx(grid: pd.DataFrame, frame: pd.DataFrame,
+                     age: Optional[pd.DataFrame] = None) -> bytes:
+    """
+    Stream an XLSX workbook with xlsxwriter in constant-memory mode and
+    return its bytes:
+      - Rates:     Date x Hotel numeric grid (blank = no rate)
+      - Status:    one row per cell with status/reason and raw numbers
+      - Cache age: minutes since each cell was scraped
+    """
+    import xlsxwriter
+
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode="w+b")
+    wb = xlsxwriter.Workbook(out, {"constant_memory": True, "in_memory": False})
+    money = wb.add_format({"num_format": "0.00"})
+
+    labels = _date_labels(grid.index)
+    header = ["Date"] + [str(c) for c in grid.columns]
+    values = grid.to_numpy(dtype="float64")
+    _write_sheet(wb, "Rates", header,
+                 ((labels[i], *map(float, values[i])) for i in range(len(labels))), num_fmt=money)
+
+    status_cols = ["hotel", "date", "status", "reason", "stage", "value", "total_for_queried_nights",
+                   "nights_queried", "minstay_applied", "currency", "strategy", "scraped_at", "cache_hit_ratio"]
+    status = frame[status_cols].sort_values(["date", "hotel"], kind="stable")
+    status = status.assign(
+        date=status["date"].dt.strftime("%d.%m.%Y"),
+        scraped_at=status["scraped_at"].dt.strftime("%Y-%m-%d %H:%M:%S"),
+    ).astype(object).where(status.notna(), None)
+    _write_sheet(wb, "Status", status_cols, status.itertuples(index=False, name=None))
+
+    if age is not None:
+        age_values = age.to_numpy(dtype="float64")
+        _write_sheet(wb, "Cache age (min)", header,
+                     ((labels[i], *map(float, age_values[i])) for i in range(len(labels))))
+
+    wb.close()
+    out.seek(0)
+    with out:
+        return out.read()
@@ -0,0 +1,159 @@
+# fairshare.py
+"""
+Process-wide fair-share scheduler for scrape cells.
+
+Every cell holds one of `slots` while it is being scraped. When slots are
+contended, the next one goes to (in this order):
+  1. interactive jobs (few cells) before batch jobs, and both before
+     background jobs (speculative prefetching),
+  2. the user holding the fewest slots, then the one with the least recent
+     usage (slot-seconds, halving every USAGE_HALF_LIFE_S),
+  3. the job of that user holding the fewest slots,
+  4. the nearest check-in date, then first come first served.
+A batch worker that loses out simply waits between two cells with its lane
+intact, so small jobs preempt the queued cells of large ones without any
+progress being lost.
+
+Like singleflight, works across threads and event loops: waiters park on
+concurrent.futures.Future objects.
+"""
+import asyncio
+import concurrent.futures
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Jobs with at most this many cells count as interactive
+INTERACTIVE_MAX_CELLS = 60
+USAGE_HALF_LIFE_S = 600.0
+
+
+class Job:
+    """One run's handle on the scheduler; counters are for run stats."""
+
+    def __init__(self, scheduler: "FairScheduler", user: str, cells: int, interactive: bool,
+                 background: bool = False):
+        self.scheduler = scheduler
+        self.user = user
+        self.cells = cells
+        self.interactive = interactive
+        self.background = background
+        self.in_flight = 0
+        self.waits = 0
+        self.wait_s = 0.0
+
+    @property
+    def priority(self) -> str:
+        if self.background:
+            return "background"
+        return "interactive" if self.interactive else "batch"
+
+    def slot(self, checkin: Optional[datetime] = None):
+        return self.scheduler.slot(self, checkin)
+
+
+class _Waiter:
+    def __init__(self, job: Job, checkin: Optional[datetime], seq: int):
+        self.job = job
+        self.checkin = checkin
+        self.seq = seq
+        self.granted = False
+        self.fut: concurrent.futures.Future = concurrent.futures.Future()
+
+
+class FairScheduler:
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.busy = 0
+        self._lock = threading.Lock()
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._user_in_flight: Dict[str, int] = {}
+        self._usage: Dict[str, float] = {}      # decayed slot-seconds per user
+        self._usage_at: Dict[str, float] = {}
+
+    def job(self, user: str, cells: int, interactive: Optional[bool] = None, background: bool = False) -> Job:
+        """
+        Register a run of `cells` cells for `user` (interactive by size unless
+        given). `background` jobs only get slots nobody else is waiting for.
+        """
+        if interactive is None:
+            interactive = cells <= INTERACTIVE_MAX_CELLS and not background
+        return Job(self, user, cells, interactive, background)
+
+    def waiting(self) -> int:
+        with self._lock:
+            return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self, job: Job, checkin: Optional[datetime] = None):
+        await self.acquire(job, checkin)
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(job, time.monotonic() - t0)
+
+    async def acquire(self, job: Job, checkin: Optional[datetime] = None):
+        with self._lock:
+            if self.busy < self.slots and not self._waiters:
+                self._take(job)
+                return
+            waiter = _Waiter(job, checkin, next(self._seq))
+            self._waiters.append(waiter)
+            job.waits += 1
+        t0 = time.monotonic()
+        try:
+            await asyncio.wrap_future(waiter.fut)
+        except BaseException:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            if waiter.granted:  # the slot was handed over just as we were cancelled
+                self.release(job, 0.0)
+            raise
+        finally:
+            job.wait_s += time.monotonic() - t0
+
+    def release(self, job: Job, seconds: float):
+        with self._lock:
+            self.busy -= 1
+            job.in_flight -= 1
+            self._user_in_flight[job.user] -= 1
+            self._usage[job.user] = self._decayed(job.user) + seconds
+            self._usage_at[job.user] = time.monotonic()
+            self._grant()
+
+    def _take(self, job: Job):
+        self.busy += 1
+        job.in_flight += 1
+        self._user_in_flight[job.user] = self._user_in_flight.get(job.user, 0) + 1
+
+    def _decayed(self, user: str) -> float:
+        age = time.monotonic() - self._usage_at.get(user, time.monotonic())
+        return self._usage.get(user, 0.0) * 0.5 ** (age / USAGE_HALF_LIFE_S)
+
+    def _rank(self, w: _Waiter):
+        job = w.job
+        return (
+            2 if job.background else 0 if job.interactive else 1,
+            self._user_in_flight.get(job.user, 0),
+            self._decayed(job.user),
+            job.in_flight,
+            w.checkin or datetime.max,
+            w.seq,
+        )
+
+    def _grant(self):
+        """Hand free slots to the best-ranked waiters (caller holds the lock)."""
+        while self.busy < self.slots and self._waiters:
+            w = min(self._waiters, key=self._rank)
+            self._waiters.remove(w)
+            if not w.fut.set_running_or_notify_cancel():
+                continue  # cancelled meanwhile; its acquire() is cleaning up
+            w.granted = True
+            self._take(w.job)
+            w.fut.set_result(None)
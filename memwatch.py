@@ -0,0 +1,209 @@
+# memwatch.py
+"""
+Process and host memory readings for the scraper (Linux /proc + cgroups).
+
+Each Chromium launch carries a unique marker switch so its process tree
+(browser + renderers + GPU/utility) can be found and its RSS summed.
+On platforms without /proc every reading returns None and the scraper
+falls back to page-count based browser recycling only.
+"""
+import os
+import uuid
+from typing import Dict, List, Optional
+
+MARKER_SWITCH = "--ratechecker-worker"
+
+_PROC = "/proc"
+
+
+def available() -> bool:
+    return os.path.isdir(os.path.join(_PROC, "self"))
+
+
+def new_marker() -> str:
+    """Return a launch arg that tags one browser's process tree."""
+    return f"{MARKER_SWITCH}={uuid.uuid4().hex[:12]}"
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _read_bytes(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    status = _read(os.path.join(_PROC, str(pid), "status"))
+    if not status:
+        return None
+    for line in status.splitlines():
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1]) * 1024
+    return 0
+
+
+def _process_table() -> Dict[int, int]:
+    """pid -> ppid for all visible processes."""
+    table = {}
+    for name in os.listdir(_PROC):
+        if not name.isdigit():
+            continue
+        stat = _read(os.path.join(_PROC, name, "stat"))
+        if not stat:
+            continue
+        # comm may contain spaces/parens; fields after the last ')' are fixed
+        try:
+            table[int(name)] = int(stat.rsplit(")", 1)[1].split()[1])
+        except (IndexError, ValueError):
+            continue
+    return table
+
+
+def _descendants(root: int, table: Dict[int, int]) -> List[int]:
+    children: Dict[int, List[int]] = {}
+    for pid, ppid in table.items():
+        children.setdefault(ppid, []).append(pid)
+    out, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        out.append(pid)
+        stack.extend(children.get(pid, ()))
+    return out
+
+
+def _tree_rss(root: int, table: Dict[int, int]) -> int:
+    return sum(rss_bytes(pid) or 0 for pid in _descendants(root, table))
+
+
+def python_rss() -> Optional[int]:
+    return rss_bytes(os.getpid()) if available() else None
+
+
+def children_rss() -> Optional[int]:
+    """RSS of everything this process spawned (Playwright driver + all browsers)."""
+    if not available():
+        return None
+    table = _process_table()
+    me = os.getpid()
+    return sum(rss_bytes(pid) or 0 for pid in _descendants(me, table) if pid != me)
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time of one process."""
+    stat = _read(os.path.join(_PROC, str(pid), "stat"))
+    if not stat:
+        return None
+    try:
+        fields = stat.rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (IndexError, ValueError):
+        return None
+
+
+def _browser_root(marker: str, table: Dict[int, int]) -> Optional[int]:
+    needle = marker.encode()
+    for pid in table:
+        cmdline = _read_bytes(os.path.join(_PROC, str(pid), "cmdline"))
+        if cmdline and needle in cmdline.split(b"\0"):
+            # Renderers inherit switches too; the browser is the topmost match
+            parent = table.get(pid)
+            parent_cmd = _read_bytes(os.path.join(_PROC, str(parent), "cmdline")) or b""
+            if needle not in parent_cmd.split(b"\0"):
+                return pid
+    return None
+
+
+def browser_rss(marker: str) -> Optional[int]:
+    """RSS of the browser launched with `marker` and all of its child processes."""
+    if not available():
+        return None
+    table = _process_table()
+    root = _browser_root(marker, table)
+    return _tree_rss(root, table) if root is not None else None
+
+
+def browser_cpu_seconds(marker: str) -> Optional[float]:
+    """
+    CPU time used so far by the live processes of the browser launched with
+    `marker` (renderers that already exited are not counted).
+    """
+    if not available():
+        return None
+    table = _process_table()
+    root = _browser_root(marker, table)
+    if root is None:
+        return None
+    return sum(cpu_seconds(pid) or 0.0 for pid in _descendants(root, table))
+
+
+def host_memory() -> Optional[Dict[str, int]]:
+    """
+    {"used": bytes, "limit": bytes} for the container (cgroup v2/v1) if it
+    has a limit, else for the host (/proc/meminfo).
+    """
+    if not available():
+        return None
+    for cur_path, max_path in [
+        ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory.max"),
+        ("/sys/fs/cgroup/memory/memory.usage_in_bytes", "/sys/fs/cgroup/memory/memory.limit_in_bytes"),
+    ]:
+        cur, lim = _read(cur_path), _read(max_path)
+        if cur and lim and lim.strip().isdigit():
+            limit = int(lim)
+            # v1 reports "no limit" as a huge number
+            if limit < (1 << 60):
+                return {"used": int(cur), "limit": limit}
+
+    meminfo = _read(os.path.join(_PROC, "meminfo")) or ""
+    vals = {}
+    for line in meminfo.splitlines():
+        parts = line.split()
+        if len(parts) >= 2:
+            vals[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    if "MemTotal" not in vals:
+        return None
+    avail = vals.get("MemAvailable", vals.get("MemFree", 0))
+    return {"used": vals["MemTotal"] - avail, "limit": vals["MemTotal"]}
+
+
+def host_pressure() -> Optional[float]:
+    """Fraction of the memory budget in use (0..1), or None if unknown."""
+    m = host_memory()
+    if not m or not m["limit"]:
+        return None
+    return m["used"] / m["limit"]
+
+
+class MemorySampler:
+    """Collects periodic python/browser/host readings and summarizes peak and average."""
+
+    def __init__(self):
+        self.samples: List[Dict[str, Optional[int]]] = []
+
+    def sample(self):
+        host = host_memory()
+        self.samples.append({
+            "python_rss": python_rss(),
+            "browsers_rss": children_rss(),
+            "host_used": host["used"] if host else None,
+        })
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """Peak and average per reading, in MB."""
+        out: Dict[str, Optional[float]] = {"samples": len(self.samples)}
+        for key in ("python_rss", "browsers_rss", "host_used"):
+            vals = [s[key] for s in self.samples if s[key] is not None]
+            out[f"{key}_peak_mb"] = round(max(vals) / 2**20, 1) if vals else None
+            out[f"{key}_avg_mb"] = round(sum(vals) / len(vals) / 2**20, 1) if vals else None
+        host = host_memory()
+        out["host_limit_mb"] = round(host["limit"] / 2**20, 1) if host else None
+        return out
@@ -0,0 +1,307 @@
+# metrics.py
+"""
+Process-wide scraper metrics with OpenMetrics text export.
+
+Writers never take a lock: every thread updates its own shard (a plain
+dict held in a threading.local) and readers merge the shards when they
+render. Streamlit sessions, background loops and worker threads can all
+record into the same registry.
+
+Export (opt-in, see start_exporters):
+  RATECHECKER_METRICS_FILE  rewrite this file every METRICS_EXPORT_INTERVAL_S
+  RATECHECKER_METRICS_PORT  serve GET /metrics on this port
+  RATECHECKER_METRICS_HOST  address the port binds to (default 127.0.0.1;
+                            set 0.0.0.0 to expose the unauthenticated endpoint)
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+METRICS_PREFIX = "ratechecker_"
+METRICS_EXPORT_INTERVAL_S = 15
+# Snapshots kept for the admin charts (one per export interval)
+METRICS_HISTORY_LEN = 240
+# The /metrics endpoint has no auth, so it only listens locally unless told otherwise
+METRICS_DEFAULT_HOST = "127.0.0.1"
+
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 45, 60, 90, 120, 180)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = METRICS_PREFIX + name
+        self.help = help_text
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        REGISTRY[self.name] = self
+
+    def _shard(self) -> dict:
+        d = getattr(self._local, "d", None)
+        if d is None:
+            d = {}
+            self._local.d = d
+            self._shards.append(d)  # list.append is atomic
+        return d
+
+    def _shard_items(self):
+        for shard in list(self._shards):
+            while True:
+                try:
+                    yield from list(shard.items())
+                    break
+                except RuntimeError:  # resized by its owner thread mid-copy; retry
+                    continue
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+        d = self._shard()
+        k = _label_key(labels)
+        d[k] = d.get(k, 0) + value
+
+    def values(self) -> Dict[LabelKey, float]:
+        out: Dict[LabelKey, float] = {}
+        for k, v in self._shard_items():
+            out[k] = out.get(k, 0) + v
+        return out
+
+
+class Gauge(_Metric):
+    """Use either set() or inc()/dec() on a given gauge, not both."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._set: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels):
+        self._set[_label_key(labels)] = value  # single store, atomic
+
+    def inc(self, value: float = 1, **labels):
+        d = self._shard()
+        k = _label_key(labels)
+        d[k] = d.get(k, 0) + value
+
+    def dec(self, value: float = 1, **labels):
+        self.inc(-value, **labels)
+
+    def values(self) -> Dict[LabelKey, float]:
+        out = dict(self._set)
+        for k, v in self._shard_items():
+            out[k] = out.get(k, 0) + v
+        return out
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        d = self._shard()
+        k = _label_key(labels)
+        row = d.get(k)
+        if row is None:
+            row = [0] * (len(self.buckets) + 2)  # per-bucket counts, +Inf count, sum
+            d[k] = row
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                row[i] += 1
+                break
+        else:
+            row[len(self.buckets)] += 1
+        row[-1] += value
+
+    def values(self) -> Dict[LabelKey, List[float]]:
+        """labels -> [non-cumulative bucket counts..., +Inf count, sum]"""
+        out: Dict[LabelKey, List[float]] = {}
+        for k, row in self._shard_items():
+            acc = out.setdefault(k, [0] * len(row))
+            for i, v in enumerate(list(row)):
+                acc[i] += v
+        return out
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Upper bucket bound containing quantile q (merged over matching label sets)."""
+        want = set(_label_key(labels))
+        total = [0] * (len(self.buckets) + 2)
+        for k, row in self.values().items():
+            if want <= set(k):
+                total = [a + b for a, b in zip(total, row)]
+        count = sum(total[:-1])
+        if not count:
+            return None
+        seen = 0
+        for i, b in enumerate(self.buckets + (math.inf,)):
+            seen += total[i]
+            if seen >= q * count:
+                return b
+        return math.inf
+
+
+REGISTRY: Dict[str, _Metric] = {}
+
+
+# ---------- Scraper metrics ----------
+CELLS = Counter("cells", "Scrape cells finished, by status and reason")
+CELL_SECONDS = Histogram("cell_seconds", "Wall time of one hotel x date cell")
+PRICE_SECONDS = Histogram("price_seconds", "get_price_for_dates wall time, by winning strategy")
+RESOLVE = Counter("resolve", "resolve_property_url calls, by outcome")
+RESOLVE_SECONDS = Histogram("resolve_seconds", "resolve_property_url wall time")
+GRAPHQL = Counter("graphql_queries", "AvailabilityCalendar queries, by outcome")
+GRAPHQL_SECONDS = Histogram("graphql_seconds", "graphql_availability_price wall time")
+BROWSERS = Gauge("browsers_open", "Browser sessions currently open")
+QUEUE_DEPTH = Gauge("queue_depth", "Cells waiting to be scraped")
+IN_FLIGHT = Gauge("cells_in_flight", "Cells being scraped right now")
+COALESCED = Counter("coalesced", "Cells served from an identical in-flight scrape")
+PAGE_STATE = Counter("page_state", "Embedded page-state price parses, by outcome")
+PAGE_STATE_CHECKS = Counter("page_state_checks", "Page-state prices re-checked against DOM/GraphQL, by agreement")
+COMPSET = Counter("compset_cells", "Comp-set mode cells, by outcome (matched from search / fallback)")
+PREFETCH = Counter("prefetch", "Speculative property prefetches (property URLs), by outcome")
+
+
+def reason_label(reason: Optional[str]) -> str:
+    """Low-cardinality reason label ("exception Timeout 30000ms..." -> "exception")."""
+    if not reason:
+        return ""
+    return reason.split()[0][:40]
+
+
+# ---------- OpenMetrics text ----------
+def _fmt_labels(k: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(k) + list(extra)
+    if not pairs:
+        return ""
+    esc = [(n, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for n, v in pairs]
+    return "{" + ",".join(f'{n}="{v}"' for n, v in esc) + "}"
+
+
+def _fmt_num(v: float) -> str:
+    if isinstance(v, float) and math.isinf(v):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render_openmetrics() -> str:
+    lines = []
+    for name, m in sorted(REGISTRY.items()):
+        lines.append(f"# TYPE {name} {m.kind}")
+        lines.append(f"# HELP {name} {m.help}")
+        if isinstance(m, Histogram):
+            for k, row in sorted(m.values().items()):
+                cum = 0
+                for b, c in zip(m.buckets, row):
+                    cum += c
+                    lines.append(f"{name}_bucket{_fmt_labels(k, (('le', _fmt_num(float(b))),))} {cum}")
+                cum += row[len(m.buckets)]
+                lines.append(f"{name}_bucket{_fmt_labels(k, (('le', '+Inf'),))} {cum}")
+                lines.append(f"{name}_count{_fmt_labels(k)} {cum}")
+                lines.append(f"{name}_sum{_fmt_labels(k)} {_fmt_num(float(row[-1]))}")
+        else:
+            suffix = "_total" if isinstance(m, Counter) else ""
+            for k, v in sorted(m.values().items()):
+                lines.append(f"{name}{suffix}{_fmt_labels(k)} {_fmt_num(v)}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str):
+    """Atomically replace `path` with the current exposition."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_openmetrics())
+    os.replace(tmp, path)
+
+
+# ---------- History for the admin view ----------
+HISTORY: deque = deque(maxlen=METRICS_HISTORY_LEN)
+
+
+def take_snapshot() -> Dict[str, float]:
+    """Flat totals of the live metrics; the exporter thread alone appends them to HISTORY."""
+    cells = CELLS.values()
+    ok = sum(v for k, v in cells.items() if dict(k).get("status") == "OK")
+    total = sum(cells.values())
+    snap = {
+        "ts": time.time(),
+        "cells_total": total,
+        "cells_ok": ok,
+        "browsers_open": sum(BROWSERS.values().values()),
+        "queue_depth": sum(QUEUE_DEPTH.values().values()),
+        "cells_in_flight": sum(IN_FLIGHT.values().values()),
+    }
+    return snap
+
+
+# ---------- Exporters ----------
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_openmetrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters(path: Optional[str] = None, port: Optional[int] = None, host: Optional[str] = None) -> bool:
+    """
+    Start (once per process) the history sampler plus the optional file
+    writer and HTTP endpoint. Defaults come from RATECHECKER_METRICS_FILE /
+    RATECHECKER_METRICS_PORT / RATECHECKER_METRICS_HOST.
+    """
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return False
+        _exporters_started = True
+
+    path = path or os.environ.get("RATECHECKER_METRICS_FILE") or None
+    port = port or int(os.environ.get("RATECHECKER_METRICS_PORT") or 0) or None
+    host = host or os.environ.get("RATECHECKER_METRICS_HOST") or METRICS_DEFAULT_HOST
+
+    def _loop():
+        while True:
+            HISTORY.append(take_snapshot())
+            if path:
+                try:
+                    write_textfile(path)
+                except OSError as e:
+                    print(f"[WARN] metrics file write failed: {e}")
+            time.sleep(METRICS_EXPORT_INTERVAL_S)
+
+    threading.Thread(target=_loop, name="metrics-export", daemon=True).start()
+
+    if port:
+        try:
+            server = ThreadingHTTPServer((host, port), _Handler)
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        except OSError as e:
+            print(f"[WARN] metrics port {host}:{port} unavailable: {e}")
+    return True
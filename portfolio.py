@@ -0,0 +1,139 @@
+# portfolio.py
+"""
+Hotel portfolio handling: bulk CSV/XLSX import, vectorized URL
+canonicalization/validation, and duplicate-URL collapsing.
+
+Rows that point at the same property are scraped once; the results are
+then fanned back out to every alias row so the output grid keeps all names.
+"""
+import re
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from rates import RateMatrix
+
+BOOKING_URL_RE = re.compile(
+    r"^https?://[^/]*booking\.com/(?:[^/]+/)?hotel/[^/?#]+\.html(?:[?#].*)?$",
+    re.IGNORECASE
+)
+
+# Accepted header spellings for uploaded files (compared case-insensitively)
+NAME_COLUMNS = ["hotel", "hotel name", "name", "property", "property name"]
+URL_COLUMNS = ["booking_url", "booking url", "url", "link", "booking.com hotel link", "booking link"]
+
+
+def canonicalize_urls(urls: pd.Series) -> pd.Series:
+    """Vectorized scraper.canonicalize_booking_url over a Series (missing -> "")."""
+    s = urls.fillna("").astype(str).str.strip()
+    s = s.str.replace(r"^https?://m\.booking\.com", "https://www.booking.com", regex=True, case=False)
+    s = s.str.replace(r"^https?://[^/]*booking\.com", "https://www.booking.com", regex=True, case=False)
+    return s.str.replace(r"[?#].*$", "", regex=True)
+
+
+def _pick_column(df: pd.DataFrame, candidates: List[str]) -> str | None:
+    lower = {str(c).strip().lower(): c for c in df.columns}
+    for c in candidates:
+        if c in lower:
+            return lower[c]
+    return None
+
+
+def read_portfolio(uploaded) -> pd.DataFrame:
+    """
+    Read an uploaded CSV/XLSX into a frame with columns [hotel, booking_url].
+    Header names are matched loosely; a headerless two-column file is read as name, url.
+    """
+    name = getattr(uploaded, "name", "") or ""
+    if name.lower().endswith((".xlsx", ".xls")):
+        raw = pd.read_excel(uploaded, dtype=str)
+    else:
+        raw = pd.read_csv(uploaded, dtype=str, sep=None, engine="python", encoding="utf-8-sig")
+
+    name_col = _pick_column(raw, NAME_COLUMNS)
+    url_col = _pick_column(raw, URL_COLUMNS)
+    if name_col is None and url_col is None:
+        if raw.shape[1] < 1:
+            raise ValueError("Portfolio file has no columns.")
+        # No recognizable header: first row is data
+        raw = pd.concat([raw.columns.to_frame().T, raw], ignore_index=True)
+        name_col = raw.columns[0]
+        url_col = raw.columns[1] if raw.shape[1] > 1 else None
+
+    return pd.DataFrame({
+        "hotel": raw[name_col] if name_col is not None else "",
+        "booking_url": raw[url_col] if url_col is not None else "",
+    }).fillna("")
+
+
+def prepare_portfolio(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Canonicalize and validate a [hotel, booking_url] frame in bulk.
+
+    Returns columns:
+      name       stripped name (URL slug if the name was blank), unique per row
+      url        canonical Booking URL or ""
+      url_valid  URL looks like a Booking property link
+      key        de-duplication key (canonical URL, else case-folded name)
+      primary    first row for its key; only these are scraped
+    Rows with neither name nor URL are dropped.
+    """
+    names = df.get("hotel", pd.Series("", index=df.index)).fillna("").astype(str).str.strip()
+    urls = canonicalize_urls(df.get("booking_url", pd.Series("", index=df.index)))
+
+    slug = urls.str.extract(r"/hotel/(?:[^/]+/)?([^/?#]+?)(?:\.[a-z-]+)?\.html$", flags=re.I)[0].fillna("")
+    names = names.where(names != "", slug.str.replace("-", " ").str.title())
+
+    out = pd.DataFrame({"name": names, "url": urls})
+    out = out[(out["name"] != "") | (out["url"] != "")].reset_index(drop=True)
+
+    out["url_valid"] = out["url"].str.match(BOOKING_URL_RE.pattern, flags=re.I)
+    out["key"] = out["url"].where(out["url"] != "", "name:" + out["name"].str.casefold())
+    out["primary"] = ~out["key"].duplicated()
+
+    # Results are keyed by name, so different properties sharing a name get a
+    # suffix, counted up past any name already in the portfolio
+    pairs = out[["name", "key"]].drop_duplicates()
+    taken = set(pairs["name"])
+    renamed: Dict[Tuple[str, str], str] = {}
+    for (name, key), rank in zip(zip(pairs["name"], pairs["key"]), pairs.groupby("name").cumcount()):
+        if rank == 0:
+            continue
+        n = rank + 1
+        while f"{name} ({n})" in taken:
+            n += 1
+        renamed[(name, key)] = f"{name} ({n})"
+        taken.add(renamed[(name, key)])
+    out["name"] = [renamed.get((name, key), name) for name, key in zip(out["name"], out["key"])]
+    return out
+
+
+def unique_hotels(portfolio: pd.DataFrame) -> Tuple[List[Dict], Dict[str, List[str]]]:
+    """
+    Collapse a prepared portfolio to one hotel per key.
+    Returns (hotels to scrape as [{"name", "url"}], {scraped name: [alias names]}).
+    """
+    primary = portfolio[portfolio["primary"]]
+    hotels = [{"name": n, "url": u} for n, u in zip(primary["name"], primary["url"])]
+
+    rep = portfolio["key"].map(primary.set_index("key")["name"])
+    alias_rows = portfolio[~portfolio["primary"] & (portfolio["name"] != rep)]
+    aliases: Dict[str, List[str]] = {}
+    for r, n in zip(rep[alias_rows.index], alias_rows["name"]):
+        aliases.setdefault(r, [])
+        if n not in aliases[r]:
+            aliases[r].append(n)
+    return hotels, aliases
+
+
+def fan_out_results(results: Dict[Tuple[str, str], Dict], aliases: Dict[str, List[str]]) -> Dict[Tuple[str, str], Dict]:
+    """Copy every scraped cell to the alias names that share its property."""
+    if not aliases:
+        return results
+    if isinstance(results, RateMatrix):
+        return results.with_aliases(aliases)
+    out = dict(results)
+    for (name, ymd), r in results.items():
+        for alias in aliases.get(name, ()):
+            out[(alias, ymd)] = {**r, "hotel": alias, "alias_of": name}
+    return out
@@ -0,0 +1,104 @@
+# profiles.py
+"""
+Managed Chromium user-data dirs for the opt-in persistent-profile mode.
+
+Every scrape worker gets its own slot dir (Chromium locks a profile to one
+process), reused across tasks and runs so Booking's static JS/CSS bundles
+come from the disk cache. Cache folders are capped and pruned oldest-first.
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Per-slot HTTP cache cap (also passed to Chromium as --disk-cache-size)
+PROFILE_CACHE_MAX_MB = 256
+# Prune a slot at most this often (checked when the slot is acquired)
+PROFILE_PRUNE_INTERVAL_S = 600
+# Prune down to this fraction of the cap so we don't prune on every launch
+PROFILE_PRUNE_TARGET = 0.8
+
+# Sub-folders of a Chromium profile that hold cache data only (safe to delete)
+CACHE_SUBDIRS = [
+    os.path.join("Default", "Cache"),
+    os.path.join("Default", "Code Cache"),
+    os.path.join("Default", "GPUCache"),
+    "ShaderCache",
+    "GrShaderCache",
+]
+
+_lock = threading.Lock()
+_in_use: set = set()
+_last_pruned: Dict[str, float] = {}
+
+
+def _cache_files(slot_dir: str) -> List[Tuple[float, int, str]]:
+    files = []
+    for sub in CACHE_SUBDIRS:
+        for root, _dirs, names in os.walk(os.path.join(slot_dir, sub)):
+            for n in names:
+                path = os.path.join(root, n)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+    return files
+
+
+def cache_size_bytes(slot_dir: str) -> int:
+    return sum(size for _, size, _ in _cache_files(slot_dir))
+
+
+def prune_cache(slot_dir: str, max_bytes: int) -> int:
+    """
+    Delete the oldest cache files of an idle slot until it is below
+    PROFILE_PRUNE_TARGET * max_bytes. Returns the number of bytes freed.
+    """
+    files = _cache_files(slot_dir)
+    total = sum(size for _, size, _ in files)
+    if total <= max_bytes:
+        return 0
+    target = int(max_bytes * PROFILE_PRUNE_TARGET)
+    freed = 0
+    for _mtime, size, path in sorted(files):
+        if total - freed <= target:
+            break
+        try:
+            os.remove(path)
+            freed += size
+        except OSError:
+            pass
+    return freed
+
+
+def acquire_slot(root: str, max_slots: int = 64, exclude: Optional[set] = None) -> Optional[str]:
+    """
+    Reserve the lowest free slot dir under `root` for this process and prune
+    it if due. `exclude` skips slots that failed to launch (e.g. locked by
+    another process). Returns None when every slot is taken.
+    """
+    os.makedirs(root, exist_ok=True)
+    with _lock:
+        for i in range(max_slots):
+            slot_dir = os.path.join(root, f"slot-{i}")
+            if slot_dir not in _in_use and slot_dir not in (exclude or ()):
+                _in_use.add(slot_dir)
+                break
+        else:
+            return None
+
+    now = time.monotonic()
+    if now - _last_pruned.get(slot_dir, float("-inf")) >= PROFILE_PRUNE_INTERVAL_S:
+        _last_pruned[slot_dir] = now
+        freed = prune_cache(slot_dir, PROFILE_CACHE_MAX_MB * 1024 * 1024)
+        if freed:
+            print(f"[INFO] pruned {freed // 1024} KiB from {slot_dir}")
+    return slot_dir
+
+
+def release_slot(slot_dir: Optional[str]):
+    if not slot_dir:
+        return
+    with _lock:
+        _in_use.discard(slot_dir)
@@ -0,0 +1,345 @@
+# rates.py
+"""
+Compact, array-backed storage for scrape results.
+
+A run's cells live in one RateMatrix: a hotel index and a date index plus
+one numpy array per field (float64 prices, int8 status/reason/nights
+codes), instead of a dict of per-cell dicts. Rare per-cell extras (stage,
+property URL, alias info, ...) go into a sparse side table.
+
+RateMatrix also behaves like the old {(hotel, yyyy-mm-dd): result_dict}
+mapping, so existing callers keep working while new code can aggregate
+with the vectorized helpers (min/median per date, parity gaps).
+"""
+import warnings
+from collections.abc import MutableMapping
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+NO_RATE = "No rate found"
+
+# status codes (int8)
+EMPTY, NO_RATE_CODE, OK_CODE = -1, 0, 1
+_STATUS_TEXT = {NO_RATE_CODE: NO_RATE, OK_CODE: "OK"}
+# Vocabulary codes (reason, strategy) are int8; 0 means "none"
+_MAX_CODES = 127
+
+# Result keys stored in arrays; anything else goes to the sparse extras
+_ARRAY_KEYS = {"hotel", "date", "status", "reason", "value", "total_for_queried_nights", "nights_queried",
+               "minstay_applied", "currency", "strategy", "scraped_at", "cache_hit_ratio"}
+
+
+class RateResult:
+    """One cell, typed. Converts to/from the result dict used by the scraper."""
+
+    __slots__ = ("hotel", "date", "status", "reason", "stage", "value", "total", "nights",
+                 "minstay_applied", "currency", "strategy", "scraped_at", "cache_hit_ratio")
+
+    def __init__(self, hotel: str, date: str, status: str = NO_RATE, reason: Optional[str] = None,
+                 stage: Optional[str] = None, value: Optional[float] = None, total: Optional[float] = None,
+                 nights: Optional[int] = None, minstay_applied: Optional[bool] = None,
+                 currency: Optional[str] = None, strategy: Optional[str] = None,
+                 scraped_at: Optional[str] = None, cache_hit_ratio: Optional[float] = None):
+        self.hotel = hotel
+        self.date = date
+        self.status = status
+        self.reason = reason
+        self.stage = stage
+        self.value = value
+        self.total = total
+        self.nights = nights
+        self.minstay_applied = minstay_applied
+        self.currency = currency
+        self.strategy = strategy
+        self.scraped_at = scraped_at
+        self.cache_hit_ratio = cache_hit_ratio
+
+    @classmethod
+    def from_dict(cls, hotel: str, date: str, r: Dict) -> "RateResult":
+        return cls(
+            hotel, date, status=r.get("status") or NO_RATE, reason=r.get("reason"), stage=r.get("stage"),
+            value=r.get("value"), total=r.get("total_for_queried_nights"), nights=r.get("nights_queried"),
+            minstay_applied=r.get("minstay_applied"), currency=r.get("currency"), strategy=r.get("strategy"),
+            scraped_at=r.get("scraped_at"), cache_hit_ratio=r.get("cache_hit_ratio"),
+        )
+
+    def to_dict(self) -> Dict:
+        """The scraper's result dict; None fields are left out, as the scraper does."""
+        d = {"hotel": self.hotel, "date": self.date, "status": self.status, "reason": self.reason,
+             "stage": self.stage, "value": self.value, "total_for_queried_nights": self.total,
+             "nights_queried": self.nights, "minstay_applied": self.minstay_applied,
+             "currency": self.currency, "strategy": self.strategy, "scraped_at": self.scraped_at,
+             "cache_hit_ratio": self.cache_hit_ratio}
+        return {k: v for k, v in d.items() if v is not None}
+
+    def __repr__(self):
+        return f"RateResult({self.hotel!r}, {self.date}, {self.status}, value={self.value})"
+
+
+def _to_epoch(ts: Optional[str]) -> float:
+    if not ts:
+        return np.nan
+    try:
+        return datetime.fromisoformat(ts).timestamp()
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _from_epoch(x: float) -> Optional[str]:
+    if np.isnan(x):
+        return None
+    return datetime.fromtimestamp(float(x), timezone.utc).isoformat(timespec="seconds")
+
+
+def _nan_or(v: Optional[float]) -> float:
+    try:
+        return np.nan if v is None else float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class RateMatrix(MutableMapping):
+    """
+    Hotel x date result arrays. Mapping interface: keys are (hotel, yyyy-mm-dd),
+    values are result dicts (built on access); only filled cells are keys.
+    """
+
+    def __init__(self, hotels: Iterable[str] = (), dates: Iterable[str] = (), currency: Optional[str] = None):
+        self.hotels: List[str] = list(dict.fromkeys(hotels))
+        self.dates: List[str] = list(dict.fromkeys(dates))
+        self.currency = currency
+        self._h = {n: i for i, n in enumerate(self.hotels)}
+        self._d = {d: j for j, d in enumerate(self.dates)}
+        shape = (len(self.hotels), len(self.dates))
+        self.value = np.full(shape, np.nan)
+        self.total = np.full(shape, np.nan)
+        self.scraped_at = np.full(shape, np.nan)       # epoch seconds
+        self.cache_hit_ratio = np.full(shape, np.nan, dtype=np.float32)
+        self.status = np.full(shape, EMPTY, dtype=np.int8)
+        self.reason = np.zeros(shape, dtype=np.int8)
+        self.strategy = np.zeros(shape, dtype=np.int8)
+        self.nights = np.zeros(shape, dtype=np.int8)   # 0 = unknown
+        self.minstay = np.full(shape, -1, dtype=np.int8)  # -1 unknown, 0/1
+        self.reasons: List[Optional[str]] = [None]
+        self.strategies: List[Optional[str]] = [None]
+        # (i, j) -> rarely used fields (stage, property_url, overflow reason text, ...)
+        self.extras: Dict[Tuple[int, int], Dict] = {}
+
+    # ---------- Index management ----------
+    _ARRAYS = ("value", "total", "scraped_at", "cache_hit_ratio", "status", "reason", "strategy", "nights", "minstay")
+    _FILL = {"value": np.nan, "total": np.nan, "scraped_at": np.nan, "cache_hit_ratio": np.nan,
+             "status": EMPTY, "reason": 0, "strategy": 0, "nights": 0, "minstay": -1}
+
+    def _grow(self, axis: int, n: int):
+        for name in self._ARRAYS:
+            arr = getattr(self, name)
+            pad = [(0, 0), (0, 0)]
+            pad[axis] = (0, n)
+            setattr(self, name, np.pad(arr, pad, constant_values=self._FILL[name]))
+
+    def add_hotels(self, names: Iterable[str]):
+        new = [n for n in dict.fromkeys(names) if n not in self._h]
+        for n in new:
+            self._h[n] = len(self.hotels)
+            self.hotels.append(n)
+        if new:
+            self._grow(0, len(new))
+
+    def add_dates(self, dates: Iterable[str]):
+        new = [d for d in dict.fromkeys(dates) if d not in self._d]
+        for d in new:
+            self._d[d] = len(self.dates)
+            self.dates.append(d)
+        if new:
+            self._grow(1, len(new))
+
+    def _code(self, vocab: List[Optional[str]], text: Optional[str]) -> Optional[int]:
+        """Code for `text` in `vocab`, adding it if there is room; None if the vocabulary is full."""
+        if text is None:
+            return 0
+        try:
+            return vocab.index(text)
+        except ValueError:
+            if len(vocab) > _MAX_CODES:
+                return None
+            vocab.append(text)
+            return len(vocab) - 1
+
+    # ---------- Cell access ----------
+    def set_result(self, hotel: str, date: str, r: Dict):
+        if hotel not in self._h:
+            self.add_hotels([hotel])
+        if date not in self._d:
+            self.add_dates([date])
+        i, j = self._h[hotel], self._d[date]
+        r = r if isinstance(r, dict) else {"status": NO_RATE, "reason": "unexpected_none_result"}
+        ok = r.get("status") == "OK" and r.get("value") is not None
+        extra = {k: v for k, v in r.items() if k not in _ARRAY_KEYS and v is not None}
+
+        self.status[i, j] = OK_CODE if ok else NO_RATE_CODE
+        self.value[i, j] = _nan_or(r.get("value")) if ok else np.nan
+        self.total[i, j] = _nan_or(r.get("total_for_queried_nights")) if ok else np.nan
+        self.scraped_at[i, j] = _to_epoch(r.get("scraped_at"))
+        self.cache_hit_ratio[i, j] = _nan_or(r.get("cache_hit_ratio"))
+        nights = r.get("nights_queried")
+        self.nights[i, j] = nights if isinstance(nights, int) and 0 < nights <= _MAX_CODES else 0
+        if nights is not None and not self.nights[i, j]:
+            extra["nights_queried"] = nights
+        ms = r.get("minstay_applied")
+        self.minstay[i, j] = -1 if ms is None else int(bool(ms))
+        for arr, vocab, key in ((self.reason, self.reasons, "reason"), (self.strategy, self.strategies, "strategy")):
+            code = self._code(vocab, r.get(key))
+            arr[i, j] = code or 0
+            if code is None:
+                extra[key] = r[key]
+        if r.get("currency") not in (None, self.currency):
+            extra["currency"] = r["currency"]
+        if r.get("status") not in ("OK", NO_RATE, None):
+            extra["status"] = r["status"]
+        if extra:
+            self.extras[(i, j)] = extra
+        else:
+            self.extras.pop((i, j), None)
+
+    def result(self, hotel: str, date: str) -> Optional[RateResult]:
+        i, j = self._h.get(hotel), self._d.get(date)
+        if i is None or j is None or self.status[i, j] == EMPTY:
+            return None
+        extra = self.extras.get((i, j), {})
+        ok = self.status[i, j] == OK_CODE
+        nights, ms = int(self.nights[i, j]), int(self.minstay[i, j])
+        chr_ = float(self.cache_hit_ratio[i, j])
+        return RateResult(
+            hotel, date,
+            status=extra.get("status") or _STATUS_TEXT[int(self.status[i, j])],
+            reason=extra.get("reason") or self.reasons[self.reason[i, j]],
+            stage=extra.get("stage"),
+            value=float(self.value[i, j]) if ok else None,
+            total=float(self.total[i, j]) if ok else None,
+            nights=extra.get("nights_queried") or nights or None,
+            minstay_applied=None if ms < 0 else bool(ms),
+            currency=extra.get("currency") or (self.currency if ok else None),
+            strategy=extra.get("strategy") or self.strategies[self.strategy[i, j]],
+            scraped_at=_from_epoch(self.scraped_at[i, j]),
+            cache_hit_ratio=None if np.isnan(chr_) else round(chr_, 3),
+        )
+
+    # ---------- Dict adapter ----------
+    def __getitem__(self, key: Tuple[str, str]) -> Dict:
+        rr = self.result(*key)
+        if rr is None:
+            raise KeyError(key)
+        i, j = self._h[key[0]], self._d[key[1]]
+        return {**rr.to_dict(), **self.extras.get((i, j), {})}
+
+    def __setitem__(self, key: Tuple[str, str], r: Dict):
+        self.set_result(key[0], key[1], r)
+
+    def __delitem__(self, key: Tuple[str, str]):
+        i, j = self._h.get(key[0]), self._d.get(key[1])
+        if i is None or j is None or self.status[i, j] == EMPTY:
+            raise KeyError(key)
+        for name in self._ARRAYS:
+            getattr(self, name)[i, j] = self._FILL[name]
+        self.extras.pop((i, j), None)
+
+    def __contains__(self, key) -> bool:
+        i, j = self._h.get(key[0]), self._d.get(key[1])
+        return i is not None and j is not None and self.status[i, j] != EMPTY
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        for i, j in zip(*np.nonzero(self.status != EMPTY)):
+            yield self.hotels[i], self.dates[j]
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.status != EMPTY))
+
+    # ---------- Bulk operations ----------
+    def with_aliases(self, aliases: Dict[str, List[str]]) -> "RateMatrix":
+        """Copy each hotel's row to its alias names (vectorized row copies)."""
+        pairs = [(src, a) for src, names in aliases.items() if src in self._h for a in names]
+        self.add_hotels(a for _, a in pairs)
+        for src, alias in pairs:
+            i, k = self._h[src], self._h[alias]
+            for name in self._ARRAYS:
+                arr = getattr(self, name)
+                arr[k] = arr[i]
+            for (ei, j), extra in list(self.extras.items()):
+                if ei == i:
+                    self.extras[(k, j)] = {**extra, "alias_of": src}
+            for j in np.nonzero(self.status[k] != EMPTY)[0]:
+                self.extras.setdefault((k, int(j)), {"alias_of": src})
+        return self
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Filled cells as flat columns named like export.LONG_COLUMNS (raw values, None = missing)."""
+        ii, jj = np.nonzero(self.status != EMPTY)
+        extras = [self.extras.get((i, j), {}) for i, j in zip(ii.tolist(), jj.tolist())]
+        status = self.status[ii, jj]
+        ok = status == OK_CODE
+
+        def _opt(arr, mask, key):
+            out = arr.astype(object)
+            out[~mask] = None
+            for n, e in enumerate(extras):  # values that did not fit the arrays
+                if key in e:
+                    out[n] = e[key]
+            return out
+
+        nights = self.nights[ii, jj]
+        minstay = self.minstay[ii, jj]
+        reason, strategy = self.reason[ii, jj], self.strategy[ii, jj]
+        return {
+            "hotel": np.array(self.hotels, dtype=object)[ii],
+            "date": np.array(self.dates, dtype=object)[jj],
+            "status": _opt(np.where(ok, "OK", NO_RATE), np.ones_like(ok), "status"),
+            "reason": _opt(np.array(self.reasons, dtype=object)[reason], reason > 0, "reason"),
+            "stage": np.array([e.get("stage") for e in extras], dtype=object),
+            "value": self.value[ii, jj],
+            "total_for_queried_nights": self.total[ii, jj],
+            "nights_queried": _opt(nights, nights > 0, "nights_queried"),
+            "minstay_applied": _opt(minstay.astype(bool), minstay >= 0, "minstay_applied"),
+            "currency": _opt(np.full(len(ii), self.currency, dtype=object), ok & (self.currency is not None), "currency"),
+            "strategy": _opt(np.array(self.strategies, dtype=object)[strategy], strategy > 0, "strategy"),
+            "scraped_at": self.scraped_at[ii, jj],
+            "cache_hit_ratio": self.cache_hit_ratio[ii, jj].astype(np.float64).round(3),
+        }
+
+    # ---------- Vectorized aggregates ----------
+    def _rows(self, hotels: Optional[Iterable[str]]) -> np.ndarray:
+        if hotels is None:
+            return self.value
+        return self.value[[self._h[h] for h in hotels if h in self._h]]
+
+    def min_per_date(self, hotels: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Cheapest rate per date over `hotels` (default all), NaN where none has a rate."""
+        return self._reduce(np.nanmin, hotels)
+
+    def median_per_date(self, hotels: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Median rate per date over `hotels` (default all), NaN where none has a rate."""
+        return self._reduce(np.nanmedian, hotels)
+
+    def _reduce(self, fn, hotels: Optional[Iterable[str]]) -> np.ndarray:
+        rows = self._rows(hotels)
+        if not rows.shape[0]:
+            return np.full(len(self.dates), np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN dates
+            return fn(rows, axis=0)
+
+    def parity_gaps(self, own: str, against: str = "median",
+                    comp_set: Optional[Iterable[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Per date: `own` rate minus the comp set's min or median (default: all
+        other hotels), absolute and as a fraction of the comp value. NaN where
+        either side has no rate.
+        """
+        comp = [h for h in (comp_set if comp_set is not None else self.hotels) if h != own]
+        ref = self.min_per_date(comp) if against == "min" else self.median_per_date(comp)
+        mine = self.value[self._h[own]]
+        gap = mine - ref
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct = np.where(ref > 0, gap / ref, np.nan)
+        return gap, pct
@@ -1,16 +1,35 @@
 # scraper.py
+import glob
+import os
 import sys
 import re
 import json
 import asyncio
+import contextlib
 import random
-from datetime import datetime, timedelta
-from typing import Optional, Tuple, Dict, List
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional, Tuple, Dict, List
+from html.parser import HTMLParser
 from urllib.parse import quote_plus, urlparse
 
 from rapidfuzz import fuzz
 from playwright.async_api import async_playwright, Page
 
+import fairshare
+import memwatch
+import metrics
+import profiles
+import strategy_memo
+import taskqueue
+import tracing
+from checkpoint import RunCheckpoint, find_resumable, plan_fingerprint
+from archive import HtmlArchive
+from rates import RateMatrix
+from singleflight import SingleFlight
+
 # ---------- Windows Playwright event loop fix ----------
 if sys.platform.startswith("win"):
     try:
@@ -20,6 +39,17 @@ if sys.platform.startswith("win"):
 
 # ---------- Tuning ----------
 NUM_CONCURRENCY = 4
+# Replace a worker's browser after this many pages or above this RSS (browser + renderers)
+BROWSER_MAX_PAGES = 40
+BROWSER_MAX_RSS_MB = 700
+# Hold back new tasks while the container/host memory is this full...
+HOST_ADMISSION_HIGH_WATER = 0.85
+# ...but never longer than this per task
+HOST_ADMISSION_MAX_WAIT_S = 60
+MEMORY_SAMPLE_INTERVAL_S = 1.0
+# Total time budget of one hotel x date cell, shared by all of its stages
+CELL_DEADLINE_S = 90
+DEFAULT_TIMEOUT_MS = 30000
 
 def canonicalize_booking_url(u: Optional[str]) -> Optional[str]:
     if not u:
@@ -30,6 +60,57 @@ def canonicalize_booking_url(u: Optional[str]) -> Optional[str]:
     return u.split("#")[0].split("?")[0]
 
 
+# ---------- Deadlines ----------
+class DeadlineExceeded(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Total time budget of one cell. Each stage of the main path calls `enter`
+    (records the stage, raises once the budget is gone, and caps the page's
+    default timeout to what is left); explicit waits are clamped with `cap`.
+    Branches running concurrently with it (the GraphQL task) use `check`,
+    which leaves the stage and the page alone.
+    """
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        self.stage = "start"
+
+    def remaining_ms(self) -> int:
+        return max(0, int((self.expires_at - time.monotonic()) * 1000))
+
+    def expired(self) -> bool:
+        return self.remaining_ms() <= 0
+
+    def cap(self, timeout_ms: int) -> int:
+        return max(1, min(timeout_ms, self.remaining_ms()))
+
+    def check(self, stage: str):
+        """Raise once the budget is gone, without making `stage` the cell's current stage."""
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+    def enter(self, stage: str, page: Optional["Page"] = None):
+        self.stage = stage
+        if self.expired():
+            raise DeadlineExceeded(stage)
+        if page is not None:
+            page.set_default_timeout(self.cap(DEFAULT_TIMEOUT_MS))
+
+
+def _cap(deadline: Optional[Deadline], timeout_ms: int) -> int:
+    return deadline.cap(timeout_ms) if deadline else timeout_ms
+
+
+def _stage(deadline: Optional[Deadline], stage: str, page: Optional["Page"] = None):
+    if deadline:
+        deadline.enter(stage, page)
+
+
 # ---------- Date helpers ----------
 def ddmmyyyy(d: datetime) -> str:
     return d.strftime("%d.%m.%Y")
@@ -39,6 +120,10 @@ def iso(d: datetime) -> str:
     return d.strftime("%Y-%m-%d")
 
 
+def utc_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
 # ---------- Money parsing (robust) ----------
 _MONEY_RE = re.compile(
     r'(?<![A-Za-z0-9])(\d{1,3}(?:[.\s\u00A0]\d{3})*(?:[.,]\d{2})|\d+(?:[.,]\d{2})?)(?![\dA-Za-z])'
@@ -100,8 +185,10 @@ def score_candidate(hotel_query: str, city_hint: Optional[str], name_text: str,
     return base + city_bonus
 
 
-async def _wait_for_any(page: Page, selectors: List[str], timeout: int = 15000) -> bool:
+async def _wait_for_any(page: Page, selectors: List[str], timeout: int = 15000,
+                        deadline: Optional[Deadline] = None) -> bool:
     """Wait until any of the selectors becomes visible; return True/False."""
+    timeout = _cap(deadline, timeout)
     end = asyncio.get_event_loop().time() + timeout / 1000.0
     remaining = timeout
     for sel in selectors:
@@ -116,11 +203,26 @@ async def _wait_for_any(page: Page, selectors: List[str], timeout: int = 15000)
     return False
 
 
-async def resolve_property_url(page: Page, hotel_name: str, city: Optional[str], debug: bool = False) -> Optional[str]:
+async def resolve_property_url(page: Page, hotel_name: str, city: Optional[str], debug: bool = False,
+                               deadline: Optional[Deadline] = None) -> Optional[str]:
     """
     Open Booking search with (hotel + city), collect result cards,
     fuzzy-match by title/address, and return the property URL.
     """
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        url = await _resolve_property_url(page, hotel_name, city, debug=debug, deadline=deadline)
+        outcome = "found" if url else "not_found"
+        return url
+    finally:
+        metrics.RESOLVE.inc(outcome=outcome)
+        metrics.RESOLVE_SECONDS.observe(time.perf_counter() - t0)
+
+
+async def _resolve_property_url(page: Page, hotel_name: str, city: Optional[str], debug: bool = False,
+                                deadline: Optional[Deadline] = None) -> Optional[str]:
+    _stage(deadline, "resolve_url", page)
     query = f"{hotel_name} {city}" if city else hotel_name
     search_url = (
         "https://www.booking.com/searchresults.html"
@@ -146,7 +248,7 @@ async def resolve_property_url(page: Page, hotel_name: str, city: Optional[str],
         'div[data-testid^="property-card"]',
         'div[data-testid="sr_list"] article',
     ]
-    ok = await _wait_for_any(page, card_selectors, timeout=20000)
+    ok = await _wait_for_any(page, card_selectors, timeout=20000, deadline=deadline)
     if not ok:
         if debug:
             print("resolve_property_url: no card selector became visible")
@@ -214,6 +316,91 @@ def taxes_included_in(text: str) -> bool:
         or "includes taxes and charges" in t
     )
 
+# ---------- Pure HTML extraction (no browser; used by replay) ----------
+_MINSTAY_RES = [
+    re.compile(r"minimum[^0-9]{0,10}(\d+)[^0-9]{0,10}night"),
+    re.compile(r"mindestens\s*(\d+)\s*übernachtungen?"),
+]
+
+PRICE_CELL_TESTIDS = ("price-and-discounted-price",)
+PRICE_CELL_CLASSES = ("bui-price-display__value", "prco-ltr-right-align-helper", "prco-valign-middle-helper")
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+def detect_minstay(html: str) -> Optional[int]:
+    """Minimum-stay requirement announced on a property page, if any."""
+    page_text = (html or "").lower()
+    for rx in _MINSTAY_RES:
+        m = rx.search(page_text)
+        if m:
+            try:
+                return int(m.group(1))
+            except Exception:
+                return None
+    return None
+
+
+class _PriceCellParser(HTMLParser):
+    """
+    Offline twin of the phase-2 scan in strict_cheapest_per_night: collect the
+    text of price cells inside the availability container, skipping anything
+    under a calendar or dialog.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: List[Tuple[str, bool, bool, bool]] = []  # (tag, in_container, excluded, in_cell)
+        self.cells: List[str] = []
+        self._buf: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            return
+        a = dict(attrs)
+        in_container, excluded, in_cell = self.stack[-1][1:] if self.stack else (False, False, False)
+        testid = a.get("data-testid") or ""
+        classes = (a.get("class") or "").split()
+        in_container = in_container or a.get("id") == "hp_availability" \
+            or a.get("data-component") == "hotel/new-rooms-table"
+        excluded = excluded or "calendar" in testid or a.get("role") == "dialog"
+        is_cell = testid in PRICE_CELL_TESTIDS or "price-for" in testid \
+            or any(c in PRICE_CELL_CLASSES for c in classes)
+        if is_cell and not in_cell and in_container and not excluded:
+            self._buf = []
+            in_cell = True
+        self.stack.append((tag, in_container, excluded, in_cell))
+
+    def handle_endtag(self, tag):
+        while self.stack:
+            t, _, _, in_cell = self.stack.pop()
+            if in_cell and not (self.stack and self.stack[-1][3]):
+                self.cells.append("".join(self._buf).strip())
+            if t == tag:
+                break
+
+    def handle_data(self, data):
+        if self.stack and self.stack[-1][3]:
+            self._buf.append(data)
+
+
+def price_cells_from_html(html: str, limit: int = 60) -> List[float]:
+    """Parsed prices of the first `limit` price cells in the availability table."""
+    parser = _PriceCellParser()
+    parser.feed(html or "")
+    parser.close()
+    vals = [parse_money_max(t) for t in parser.cells[:limit]]
+    return [v for v in vals if v is not None]
+
+
+def cheapest_from_html(html: str, nights: int) -> Optional[Tuple[float, Optional[float]]]:
+    """(total_for_stay, per_night) from a page snapshot, like strict_cheapest_per_night."""
+    candidates = price_cells_from_html(html)
+    if not candidates:
+        return None
+    total = min(candidates)
+    return total, round(total / nights, 2) if nights else None
+
+
 # === ADD THIS HELPER somewhere above strict_cheapest_per_night ===
 async def _is_inside_calendar(el: Page.locator) -> bool:
     """
@@ -237,115 +424,124 @@ async def _is_inside_calendar(el: Page.locator) -> bool:
     return False
 
 
+# Phase-2 price cells, one extraction path each (see strategy_memo)
+PRICE_CELL_SELECTORS = {
+    "cells:testid": "[data-testid='price-and-discounted-price']",
+    "cells:price_for": "[data-testid*='price-for']",
+    "cells:bui": ".bui-price-display__value",
+    "cells:prco_ltr": ".prco-ltr-right-align-helper",
+    "cells:prco_valign": ".prco-valign-middle-helper",
+}
+DOM_PATHS = ["select_rows"] + list(PRICE_CELL_SELECTORS)
+
+
 # === REPLACE your strict_cheapest_per_night with this version ===
-async def strict_cheapest_per_night(page: Page, nights: int, debug: bool = False):
+async def strict_cheapest_per_night(page: Page, nights: int, debug: bool = False,
+                                    deadline: Optional[Deadline] = None, memo: Optional[Dict] = None):
     """
     Prefer prices that live in the room rows. If quantity <select> rows are not
     quickly available, fallback to scanning visible price cells within the
     availability container, while excluding calendars and dialogs.
-    Returns (total_for_stay, per_night) or None.
+    `memo` (strategy_memo.new_cell_memo) skips known-dead paths, tries the
+    proven selector first and stops at the first one that yields; every
+    path tried is reported back in it.
+    Returns (total_for_stay, per_night) or None; raises DeadlineExceeded
+    when `deadline` runs out mid-scan.
     """
     candidates: list[float] = []
+    paths = strategy_memo.ordered(DOM_PATHS, memo)
+    t_phase = time.perf_counter()
 
     # --- Phase 1: quick attempt using <select> based rows (max ~6-8s) ---
-    try:
-        await page.wait_for_selector("select", timeout=6000)
-        qty_selects = page.locator("select").filter(
-            has=page.locator("option[value='0'], option:has-text('0')")
-        )
-        cnt = await qty_selects.count()
-
-        for i in range(cnt):
-            sel = qty_selects.nth(i)
-            row = sel.locator(
-                "xpath=ancestor::*[self::tr or self::div]"
-                "[descendant::select]"
-                "[descendant::*["
-                "  @data-testid='price-and-discounted-price' or "
-                "  contains(@data-testid,'price-for') or "
-                "  contains(@class,'bui-price-display__value') or "
-                "  contains(@class,'prco-ltr-right-align-helper') or "
-                "  contains(@class,'prco-valign-middle-helper')"
-                "]]"
-            ).first
-
-            # Skip if inside calendar/dialog
-            if await row.locator(
-                "xpath=ancestor-or-self::*["
-                "  contains(@data-testid,'calendar') or "
-                "  @role='dialog'"
-                "]"
-            ).count():
-                if debug:
-                    print(f"[row {i}] skipped (calendar/dialog ancestor)")
-                continue
-
-            price_el = row.locator(
-                ":is([data-testid='price-and-discounted-price'], "
-                "[data-testid*='price-for'], "
-                ".bui-price-display__value, "
-                ".prco-ltr-right-align-helper, "
-                ".prco-valign-middle-helper)"
-            ).first
-
-            if await price_el.count() == 0:
-                continue
-
-            # Use text_content with a short timeout to avoid 30s hangs
-            try:
-                text = await price_el.text_content(timeout=2000)
-                text = (text or "").strip()
-            except Exception:
-                continue
-
-            val = parse_money_max(text)
-            if debug:
-                print(f"[row {i}] price cell: {text[:160]!r} -> {val}")
-            if val is not None:
-                candidates.append(val)
-    except Exception:
-        # No <select> in time -> fall back
-        pass
-
-    # --- Phase 2: fallback - scan visible price cells within availability container ---
-    if not candidates:
+    if "select_rows" in paths:
         try:
-            container = page.locator("#hp_availability, [data-component='hotel/new-rooms-table']")
-            # Common price cells; stay inside container; exclude calendars/dialogs via ancestor checks when possible
-            price_cells = container.locator(
-                ":is([data-testid='price-and-discounted-price'], "
-                "[data-testid*='price-for'], "
-                ".bui-price-display__value, "
-                ".prco-ltr-right-align-helper, "
-                ".prco-valign-middle-helper)"
+            await page.wait_for_selector("select", timeout=_cap(deadline, 6000))
+            qty_selects = page.locator("select").filter(
+                has=page.locator("option[value='0'], option:has-text('0')")
             )
-            n = await price_cells.count()
-            for i in range(min(n, 60)):
-                el = price_cells.nth(i)
-                # Skip invisible
-                if not await el.is_visible():
-                    continue
-                # Skip if nested under a calendar/dialog
-                if await el.locator(
+            cnt = await qty_selects.count()
+
+            for i in range(cnt):
+                if deadline and deadline.expired():
+                    raise DeadlineExceeded(deadline.stage)
+                sel = qty_selects.nth(i)
+                row = sel.locator(
+                    "xpath=ancestor::*[self::tr or self::div]"
+                    "[descendant::select]"
+                    "[descendant::*["
+                    "  @data-testid='price-and-discounted-price' or "
+                    "  contains(@data-testid,'price-for') or "
+                    "  contains(@class,'bui-price-display__value') or "
+                    "  contains(@class,'prco-ltr-right-align-helper') or "
+                    "  contains(@class,'prco-valign-middle-helper')"
+                    "]]"
+                ).first
+
+                # Skip if inside calendar/dialog
+                if await row.locator(
                     "xpath=ancestor-or-self::*["
                     "  contains(@data-testid,'calendar') or "
                     "  @role='dialog'"
                     "]"
                 ).count():
+                    if debug:
+                        print(f"[row {i}] skipped (calendar/dialog ancestor)")
+                    continue
+
+                price_el = row.locator(
+                    ":is([data-testid='price-and-discounted-price'], "
+                    "[data-testid*='price-for'], "
+                    ".bui-price-display__value, "
+                    ".prco-ltr-right-align-helper, "
+                    ".prco-valign-middle-helper)"
+                ).first
+
+                if await price_el.count() == 0:
                     continue
+
+                # Use text_content with a short timeout to avoid 30s hangs
                 try:
-                    text = await el.text_content(timeout=1500)
+                    text = await price_el.text_content(timeout=_cap(deadline, 2000))
                     text = (text or "").strip()
                 except Exception:
                     continue
+
                 val = parse_money_max(text)
-                if debug and val is not None:
-                    print(f"[fallback cell {i}] -> {val}")
+                if debug:
+                    print(f"[row {i}] price cell: {text[:160]!r} -> {val}")
                 if val is not None:
                     candidates.append(val)
+            strategy_memo.note(memo, "select_rows", bool(candidates), time.perf_counter() - t_phase)
+        except DeadlineExceeded:
+            raise
         except Exception:
-            pass
+            # No <select> in time -> fall back
+            strategy_memo.note(memo, "select_rows", False, time.perf_counter() - t_phase)
+    winner = "select_rows" if candidates else None
+
+    # --- Phase 2: fallback - scan visible price cells within availability container ---
+    # Without a memo (or when re-validating) all selectors are scanned in one
+    # pass and the cheapest wins; with one, selectors are tried in memo order
+    # and the first that yields is used.
+    if not candidates:
+        container = page.locator("#hp_availability, [data-component='hotel/new-rooms-table']")
+        cell_paths = [p for p in paths if p in PRICE_CELL_SELECTORS]
+        stop_at_first = bool(memo) and not memo["full"]
+        for group in ([[p] for p in cell_paths] if stop_at_first else [cell_paths]):
+            if deadline and deadline.expired():
+                raise DeadlineExceeded(deadline.stage)
+            t_phase = time.perf_counter()
+            found = await _scan_price_cells(container, group, debug)
+            for path in group:
+                strategy_memo.note(memo, path, bool(found[path]), time.perf_counter() - t_phase)
+                if found[path] and (not candidates or min(found[path]) < min(candidates)):
+                    winner = path
+                candidates.extend(found[path])
+            if candidates and stop_at_first:
+                break
 
+    if memo is not None:
+        memo["dom_winner"] = winner
     if not candidates:
         return None
 
@@ -353,6 +549,124 @@ async def strict_cheapest_per_night(page: Page, nights: int, debug: bool = False
     return total, round(total / nights, 2) if nights else None
 
 
+# Per matched cell: the selectors (paths) it matches, whether it is visible
+# and outside calendars/dialogs, and its text. One round trip per scan.
+_SCAN_CELLS_JS = """
+(els, [selectors, limit]) => els.slice(0, limit).map(el => ({
+    paths: Object.keys(selectors).filter(p => el.matches(selectors[p])),
+    visible: el.getClientRects().length > 0 && getComputedStyle(el).visibility !== "hidden",
+    excluded: !!el.closest("[data-testid*='calendar'], [role='dialog']"),
+    text: (el.textContent || "").trim(),
+}))
+"""
+
+
+async def _scan_price_cells(container, paths: List[str], debug: bool = False) -> Dict[str, List[float]]:
+    """
+    Parsed prices of the visible cells matching any of `paths` (keys of
+    PRICE_CELL_SELECTORS) under `container`, skipping calendars/dialogs,
+    grouped by the path(s) each cell matched.
+    """
+    found: Dict[str, List[float]] = {p: [] for p in paths}
+    selectors = {p: PRICE_CELL_SELECTORS[p] for p in paths}
+    try:
+        cells = await container.locator(":is(" + ", ".join(selectors.values()) + ")").evaluate_all(
+            _SCAN_CELLS_JS, [selectors, 60])
+    except Exception:
+        return found
+    for i, cell in enumerate(cells):
+        if not cell["visible"] or cell["excluded"]:
+            continue
+        val = parse_money_max(cell["text"])
+        if debug and val is not None:
+            print(f"[fallback cell {i}] {cell['paths']} -> {val}")
+        if val is not None:
+            for p in cell["paths"]:
+                found[p].append(val)
+    return found
+
+
+# ---------- Embedded page state ----------
+# The property page ships its room table as JSON in an inline script
+# (b_rooms_available_and_soldout: [{"b_blocks": [...]}, ...]). Parsing it
+# prices the stay right after navigation, before anything renders or
+# scrolls; DOM/GraphQL are the fallback and re-check the page-state price
+# on the first and every PAGE_STATE_VERIFY_EVERY-th priced date of a property.
+PAGE_STATE_KEYS = ("b_rooms_available_and_soldout", "rooms_available_and_soldout")
+PAGE_STATE_VERIFY_EVERY = 10
+# Page-state and DOM per-night prices this close (relative) agree
+PAGE_STATE_AGREE_TOLERANCE = 0.01
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _page_state_rooms(html: str) -> Optional[List]:
+    """The embedded room list, or None if the page has none (or it isn't JSON)."""
+    for key in PAGE_STATE_KEYS:
+        for m in re.finditer(rf"(?<![\w]){key}[\"']?\s*[:=]\s*", html):
+            try:
+                rooms, _end = _JSON_DECODER.raw_decode(html, m.end())
+            except ValueError:
+                continue
+            if isinstance(rooms, list):
+                return rooms
+    return None
+
+
+def _block_price(block: Dict) -> Optional[float]:
+    """Stay price of one rate block: raw amounts first, the formatted string as fallback."""
+    simplified = block.get("b_price_breakdown_simplified") or {}
+    for raw in (simplified.get("b_headline_price_amount"), block.get("b_raw_price")):
+        try:
+            val = float(raw)
+        except (TypeError, ValueError):
+            continue
+        if val > 0:
+            return val
+    return parse_money_max(str(block.get("b_price") or ""))
+
+
+def price_from_page_state(html: str, nights: int, adults: int = 2) -> Dict:
+    """
+    Cheapest bookable block for `adults` in the embedded room table, shaped
+    like the DOM/GraphQL results. Prices are the headline stay price (what
+    the room table shows), so they compare 1:1 with the DOM path.
+    """
+    rooms = _page_state_rooms(html)
+    if rooms is None:
+        return {"error": "no_page_state"}
+    prices: List[float] = []
+    for room in rooms:
+        if not isinstance(room, dict):
+            continue
+        for block in room.get("b_blocks") or []:
+            if not isinstance(block, dict):
+                continue
+            try:
+                if int(block.get("b_max_persons") or adults) < adults:
+                    continue
+            except (TypeError, ValueError):
+                pass
+            val = _block_price(block)
+            if val is not None:
+                prices.append(val)
+    if not prices:
+        return {"error": "page_state_no_rooms"}
+    total = round(min(prices), 2)
+    return {
+        "nights_queried": nights,
+        "minstay_applied": False,
+        "total_incl_taxes": total,
+        "per_night": round(total / nights, 2) if nights else None,
+    }
+
+
+def page_state_agreement(state_res: Dict, checked: Optional[Dict]) -> str:
+    """"agree" / "disagree" / "unchecked" (no DOM/GraphQL price to compare with)."""
+    if not checked or "error" in checked or not checked.get("per_night"):
+        return "unchecked"
+    a, b = state_res["per_night"], checked["per_night"]
+    return "agree" if abs(a - b) <= PAGE_STATE_AGREE_TOLERANCE * max(a, b) else "disagree"
+
 
 # ---------- GraphQL fallback ----------
 def _extract_property_tokens_from_html(html: str) -> dict:
@@ -398,6 +712,36 @@ def _extract_property_tokens_from_html(html: str) -> dict:
     return toks
 
 
+def price_from_calendar(data, checkin: datetime) -> Dict:
+    """Pick `checkin` out of an AvailabilityCalendar GraphQL response."""
+    if not isinstance(data, dict):
+        return {"error": "bad_json"}
+
+    days_data = (data.get("data") or {}).get("availabilityCalendar", {}).get("days", []) or []
+    target = next((d for d in days_data if d.get("checkin") == checkin.strftime("%Y-%m-%d")), None)
+    if not target:
+        return {"error": "date_not_in_calendar"}
+
+    if not target.get("available", 0):
+        return {"error": "sold_out"}
+
+    per_night = parse_money_max(target.get("avgPriceFormatted", "") or "")
+    if per_night is None:
+        return {"error": "price_not_found"}
+
+    minlos = int(target.get("minLengthOfStay") or 1)
+    total = round(per_night * minlos, 2)
+    return {
+        "nights_queried": minlos,
+        "minstay_applied": (minlos > 1),
+        "total_incl_taxes": total,
+        "per_night": round(total / minlos, 2),
+    }
+
+
+GQL_PATHS = ["gql:exact", "gql:month", "gql:wide"]
+
+
 def _pagename_from_url(url: str) -> Optional[str]:
     """
     Fallback to read pagename from /hotel/<cc>/<pagename>.html or ...de.html
@@ -412,50 +756,41 @@ def _pagename_from_url(url: str) -> Optional[str]:
     return None
 
 
-async def graphql_availability_price(page: Page, checkin: datetime, days: int = 31, debug: bool = False) -> Optional[dict]:
+async def graphql_availability_price(
+    page: Page,
+    checkin: datetime,
+    days: int = 31,
+    debug: bool = False,
+    token_cache: Optional[Dict[str, str]] = None,
+    deadline: Optional[Deadline] = None,
+    archive=None,
+    memo: Optional[Dict] = None,
+) -> Optional[dict]:
     """
     Query Booking's AvailabilityCalendar for the open property page.
     - Guards against bad/empty JSON (no more 'NoneType .get').
     - Tries multiple windows so 'date_not_in_calendar' occurs far less often.
+    - `token_cache` (per property) is filled on success and used when the
+      current page snapshot lacks tokens.
+    - `archive` (archive.HtmlArchive) stores every calendar response.
+    - `memo` (strategy_memo) puts the window that worked before first.
+    - `deadline` bounds the queries but is only checked, never entered: this
+      runs concurrently with get_price_for_dates' own stages.
     """
-    def _extract_property_tokens_from_html(html: str) -> dict:
-        toks: Dict[str, str] = {}
-        for pat in [r"b_csrf_token:\s*'([^']+)'", r'b_csrf_token:\s*"([^"]+)"', r'"b_csrf_token"\s*:\s*"([^"]+)"']:
-            m = re.search(pat, html)
-            if m:
-                toks["csrf"] = m.group(1)
-                break
-        for pat in [r'hotelName:\s*"([^"]+)"', r"hotelName:\s*'([^']+)'", r'"hotelName"\s*:\s*"([^"]+)"']:
-            m = re.search(pat, html)
-            if m:
-                toks["pagename"] = m.group(1)
-                break
-        for pat in [r'hotelCountry:\s*"([^"]+)"', r"hotelCountry:\s*'([^']+)'", r'"hotelCountry"\s*:\s*"([^"]+)"']:
-            m = re.search(pat, html)
-            if m:
-                toks["country"] = m.group(1)
-                break
-        return toks
-
-    def _pagename_from_url(url: str) -> Optional[str]:
-        try:
-            path = urlparse(url).path
-            if "/hotel/" in path and path.endswith(".html"):
-                return path.split("/")[-1].replace(".html", "")
-        except Exception:
-            pass
-        return None
+    t0 = time.perf_counter()
+    html = await page.content()
+    toks = _extract_property_tokens_from_html(html)
+    if "pagename" not in toks:
+        p = _pagename_from_url(page.url)
+        if p:
+            toks["pagename"] = p
+    if token_cache is not None:
+        for k, v in token_cache.items():
+            toks.setdefault(k, v)
+    if debug:
+        print("GQL tokens:", toks)
 
     async def _do_query(start_date: datetime, span_days: int) -> dict:
-        html = await page.content()
-        toks = _extract_property_tokens_from_html(html)
-        if "pagename" not in toks:
-            p = _pagename_from_url(page.url)
-            if p:
-                toks["pagename"] = p
-        if debug:
-            print("GQL tokens:", toks)
-
         if not {"pagename", "csrf"}.issubset(toks.keys()):
             return {"error": "tokens_not_found"}
 
@@ -497,6 +832,7 @@ async def graphql_availability_price(page: Page, checkin: datetime, days: int =
 
         resp = await page.context.request.post(
             "https://www.booking.com/dml/graphql?lang=de-de",
+            timeout=_cap(deadline, DEFAULT_TIMEOUT_MS),
             data=json.dumps(body, separators=(",", ":")),
             headers={
                 "content-type": "application/json",
@@ -513,49 +849,120 @@ async def graphql_availability_price(page: Page, checkin: datetime, days: int =
         except Exception:
             return {"error": "bad_json"}
 
-        if not isinstance(data, dict):
-            return {"error": "bad_json"}
-
-        days_data = data.get("data", {}).get("availabilityCalendar", {}).get("days", []) or []
-        target = next((d for d in days_data if d.get("checkin") == checkin.strftime("%Y-%m-%d")), None)
-        if not target:
-            return {"error": "date_not_in_calendar"}
-
-        if not target.get("available", 0):
-            return {"error": "sold_out"}
-
-        per_night = parse_money_max(target.get("avgPriceFormatted", "") or "")
-        if per_night is None:
-            return {"error": "price_not_found"}
-
-        minlos = int(target.get("minLengthOfStay") or 1)
-        total = round(per_night * minlos, 2)
-        return {
-            "nights_queried": minlos,
-            "minstay_applied": (minlos > 1),
-            "total_incl_taxes": total,
-            "per_night": round(total / minlos, 2),
-        }
+        if archive is not None:
+            archive.record("graphql", page.url, checkin,
+                           json.dumps(data, separators=(",", ":")).encode("utf-8"),
+                           window_start=iso(start_date), span=span_days)
+        return price_from_calendar(data, checkin)
 
     # Try 3 windows: exact window, month window, wider backshifted window
-    last = {"error": "unknown"}
-    for start, span in [
+    windows = dict(zip(GQL_PATHS, [
         (checkin, max(31, days)),
         (checkin.replace(day=1), 62),
         (checkin - timedelta(days=31), 93),
-    ]:
+    ]))
+    last = {"error": "unknown"}
+    for path in strategy_memo.ordered(list(windows), memo):
+        start, span = windows[path]
+        # Runs next to the DOM path on the same page: the stage and page timeout are that path's
+        if deadline is not None:
+            deadline.check("graphql")
+        t_window = time.perf_counter()
         res = await _do_query(start, span)
+        metrics.GRAPHQL.inc(outcome=res.get("error", "ok"))
+        # Missing tokens or a sold-out date say nothing about the window
+        if res.get("error") not in ("tokens_not_found", "sold_out"):
+            strategy_memo.note(memo, path, "error" not in res, time.perf_counter() - t_window)
         if "error" not in res:
+            if token_cache is not None:
+                token_cache.update(toks)
+            if memo is not None:
+                memo["gql_winner"] = path
+            metrics.GRAPHQL_SECONDS.observe(time.perf_counter() - t0)
             return res
         last = res
         if debug:
             print(f"GQL attempt start={start.date()} span={span}: {res}")
 
+    metrics.GRAPHQL_SECONDS.observe(time.perf_counter() - t0)
     return last
 
 
 
 
+# ---------- Hedged DOM / GraphQL pricing ----------
+# policy -> (preference order, seconds to wait for a preferred strategy once
+# a less preferred one already has a valid price)
+STRATEGY_POLICIES = {
+    "dom_first": (["dom", "graphql"], 10.0),
+    "graphql_first": (["graphql", "dom"], 10.0),
+    "first_valid": (["dom", "graphql"], 0.0),
+    "dom_only": (["dom"], 0.0),
+}
+PRICE_STRATEGY_POLICY = "dom_first"
+
+
+async def _race_strategies(dom_coro, gql_task: Optional[asyncio.Task], policy: str = PRICE_STRATEGY_POLICY,
+                           debug: bool = False) -> Optional[Dict]:
+    """
+    Run DOM extraction and the (already started) GraphQL query side by side.
+    Returns the winning price dict with "strategy" set, the GraphQL error
+    dict if neither produced a price, or None. Losers are cancelled.
+    A branch that ran out of the cell's budget raises its DeadlineExceeded
+    here when the other branch has no price either.
+    """
+    order, grace = STRATEGY_POLICIES.get(policy, STRATEGY_POLICIES[PRICE_STRATEGY_POLICY])
+    tasks = {"dom": asyncio.ensure_future(dom_coro)}
+    if gql_task is not None:
+        tasks["graphql"] = gql_task
+    names = {t: n for n, t in tasks.items()}
+    outcomes: Dict[str, Optional[Dict]] = {}
+    overrun: Optional[DeadlineExceeded] = None
+    valid_since: Optional[float] = None
+    pending = set(tasks.values())
+    loop = asyncio.get_running_loop()
+
+    def _valid(r) -> bool:
+        return isinstance(r, dict) and "error" not in r and r.get("per_night") is not None
+
+    try:
+        while True:
+            best = next((n for n in order if _valid(outcomes.get(n))), None)
+            if best is None:
+                best = next((n for n in tasks if _valid(outcomes.get(n))), None)
+            timeout = None
+            if best is not None:
+                waiting_on = [n for n in order[:order.index(best)] if n not in outcomes] if best in order else []
+                valid_since = valid_since if valid_since is not None else loop.time()
+                left = grace - (loop.time() - valid_since)
+                if not waiting_on or left <= 0:
+                    if debug:
+                        print(f"price strategy: {best} (policy {policy})")
+                    return {**outcomes[best], "strategy": best}
+                timeout = left
+            elif not pending:
+                if overrun is not None:
+                    raise overrun
+                gql = outcomes.get("graphql")
+                return gql if isinstance(gql, dict) and "error" in gql else None
+
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                try:
+                    outcomes[names[t]] = t.result()
+                except DeadlineExceeded as e:
+                    overrun = e
+                    outcomes[names[t]] = {"error": "deadline_exceeded", "stage": e.stage}
+                except Exception as e:
+                    outcomes[names[t]] = {"error": f"exception {e}"}
+                if debug:
+                    print(f"{names[t]} finished: {outcomes[names[t]]}")
+    finally:
+        for t in tasks.values():
+            if not t.done():
+                t.cancel()
+
+
 # ---------- Main price getter for a property & dates ----------
 async def get_price_for_dates(
     page: Page,
@@ -564,8 +971,39 @@ async def get_price_for_dates(
     nights: int,
     currency: str,
     debug: bool = False,
+    state: Optional[Dict] = None,
+    deadline: Optional[Deadline] = None,
+    policy: str = PRICE_STRATEGY_POLICY,
+    archive=None,
+    memo_store: Optional[strategy_memo.StrategyMemo] = None,
+    memo_profile: str = "full",
 ) -> Dict:
+    """
+    Price one stay on the property page. `state` is the per-property dict
+    kept by the scheduler across dates (GraphQL tokens live under "tokens").
+    Every stage draws its timeouts from `deadline` when given.
+    DOM extraction and the GraphQL calendar run concurrently; `policy`
+    (see STRATEGY_POLICIES) picks the winner, recorded as result["strategy"].
+    The embedded page state is tried first (see price_from_page_state);
+    when it prices the stay and no re-check is due, nothing else runs.
+    With `archive`, the settled HTML and calendar responses are recorded.
+    `memo_store` remembers per property which DOM selector / GraphQL window
+    produced the price, so later dates try that first and skip dead paths.
+    Entries are kept per launch profile (`memo_profile`): DOM paths that miss
+    on a "lite" page say nothing about fully rendered ones.
+    """
+    t0 = time.perf_counter()
+    state = {} if state is None else state
+    token_cache = state.setdefault("tokens", {})
     base_url = property_url.split("?")[0]
+    memo_key = property_key(base_url)
+    if memo_key and memo_profile != "full":
+        memo_key = f"{memo_key}@{memo_profile}"
+    memo = None
+    if memo_store is not None:
+        memo = strategy_memo.new_cell_memo(
+            memo_store.plan(memo_key, ["page_state"] + DOM_PATHS + GQL_PATHS, required=DOM_PATHS)
+        )
     params = (
         f"?checkin={iso(checkin)}"
         f"&checkout={(checkin + timedelta(days=nights)).strftime('%Y-%m-%d')}"
@@ -574,130 +1012,1626 @@ async def get_price_for_dates(
     )
     url = base_url + params
 
+    _stage(deadline, "navigate", page)
     resp = await page.goto(url, wait_until="domcontentloaded")
     if not resp or not resp.ok:
         raise RuntimeError(f"HTTP {resp.status if resp else 'no response'}")
 
-    await page.wait_for_load_state("domcontentloaded")
-    await page.wait_for_load_state("networkidle")
-    await accept_cookies_if_present(page)
-    await page_settle(page)
+    # Embedded room table: priced before anything renders
+    state_res, check_state = None, False
+    if policy != "dom_only" and not state.get("page_state_disagrees") \
+            and strategy_memo.ordered(["page_state"], memo):
+        _stage(deadline, "page_state", page)
+        t_state = time.perf_counter()
+        html = await page.content()
+        state_res = price_from_page_state(html, nights)
+        metrics.PAGE_STATE.inc(outcome=state_res.get("error", "ok"))
+        if "error" in state_res:
+            state_res = None
+        else:
+            state_res["strategy"] = "page_state"
+            state["page_state_hits"] = state.get("page_state_hits", 0) + 1
+            check_state = (state["page_state_hits"] - 1) % PAGE_STATE_VERIFY_EVERY == 0
+            if not check_state:
+                strategy_memo.note(memo, "page_state", True, time.perf_counter() - t_state)
+                if archive is not None:
+                    archive.record("property_html", page.url, checkin, html.encode("utf-8"), nights=nights)
+                metrics.PRICE_SECONDS.observe(time.perf_counter() - t0, strategy="page_state")
+                if memo is not None:
+                    memo["winner"] = "page_state"
+                    memo_store.record(memo_key, memo, time.perf_counter() - t0)
+                return state_res
+
+    # Calendar tokens are in the initial HTML: start GraphQL now, next to the DOM path
+    gql_task = None
+    gql_dead = memo is not None and not memo["full"] and set(GQL_PATHS) <= memo["skip"]
+    if policy != "dom_only" and not gql_dead:
+        gql_task = asyncio.create_task(graphql_availability_price(
+            page, checkin, days=max(7, nights + 3), debug=debug, token_cache=token_cache, deadline=deadline,
+            archive=archive, memo=memo,
+        ))
 
-    # 1) Detect min-stay constraints visible on page
-    page_text = (await page.content()).lower()
-    minstay = None
-    m = re.search(r"minimum[^0-9]{0,10}(\d+)[^0-9]{0,10}night", page_text)
-    if not m:
-        m = re.search(r"mindestens\s*(\d+)\s*übernachtungen?", page_text)
-    if m:
-        try:
-            minstay = int(m.group(1))
-        except Exception:
-            minstay = None
-
-    if minstay and minstay > nights:
-        # Requery with required length and present per-night (total / x)
-        params2 = (
-            f"?checkin={iso(checkin)}"
-            f"&checkout={(checkin + timedelta(days=minstay)).strftime('%Y-%m-%d')}"
-            f"&group_adults=2&no_rooms=1&group_children=0"
-            f"&selected_currency={currency}&lang=de-de"
-        )
-        await page.goto(base_url + params2, wait_until="domcontentloaded")
+    try:
+        _stage(deadline, "settle", page)
+        await page.wait_for_load_state("domcontentloaded")
+        await page.wait_for_load_state("networkidle")
         await accept_cookies_if_present(page)
         await page_settle(page)
 
-        dom_res = await strict_cheapest_per_night(page, nights=minstay, debug=debug)
-        if dom_res:
-            total_for_x, _ = dom_res
+        # 1) Detect min-stay constraints visible on page
+        html = await page.content()
+        if archive is not None:
+            archive.record("property_html", page.url, checkin, html.encode("utf-8"), nights=nights)
+        minstay = detect_minstay(html)
+
+        if minstay and minstay > nights:
+            # Requery with required length and present per-night (total / x)
+            params2 = (
+                f"?checkin={iso(checkin)}"
+                f"&checkout={(checkin + timedelta(days=minstay)).strftime('%Y-%m-%d')}"
+                f"&group_adults=2&no_rooms=1&group_children=0"
+                f"&selected_currency={currency}&lang=de-de"
+            )
+            _stage(deadline, "minstay_requery", page)
+            await page.goto(base_url + params2, wait_until="domcontentloaded")
+            await accept_cookies_if_present(page)
+            await page_settle(page)
+            if archive is not None:
+                archive.record("property_html", page.url, checkin, (await page.content()).encode("utf-8"),
+                               nights=minstay)
+            dom_nights, minstay_applied = minstay, True
+            no_rate = "No rate after min-stay requery."
+        else:
+            # 2) DOM for a 1-night stay
+            dom_nights, minstay_applied = nights, False
+            no_rate = "No rate found for 1 night."
+
+        async def _dom() -> Optional[Dict]:
+            dom_res = await strict_cheapest_per_night(page, nights=dom_nights, debug=debug, deadline=deadline,
+                                                      memo=memo)
+            if not dom_res:
+                return None
+            total, _ = dom_res
             return {
-                "nights_queried": minstay,
-                "minstay_applied": True,
-                "total_incl_taxes": total_for_x,
-                "per_night": round(total_for_x / minstay, 2),
+                "nights_queried": dom_nights,
+                "minstay_applied": minstay_applied,
+                "total_incl_taxes": total,
+                "per_night": round(total / dom_nights, 2) if dom_nights else None,
             }
 
-        # DOM failed → GraphQL
-        gql = await graphql_availability_price(page, checkin, days=max(7, minstay + 3), debug=debug)
-        if gql and "error" not in gql:
-            return gql
-        if gql:
-            return {"error": gql.get("error", "No rate after min-stay requery.")}
-
-        return {"error": "No rate after min-stay requery."}
-
-    # 2) Try DOM for a 1-night stay
-    dom_res = await strict_cheapest_per_night(page, nights=nights, debug=debug)
-    if dom_res:
-        total, pernight = dom_res
-        return {
-            "nights_queried": nights,
-            "minstay_applied": False,
-            "total_incl_taxes": total,
-            "per_night": pernight,
-        }
+        # 3) Take DOM or GraphQL according to the policy; cancel the loser
+        _stage(deadline, "dom_extract", page)
+        res = await _race_strategies(_dom(), gql_task, policy=policy, debug=debug)
+        gql_task = None
+    finally:
+        if gql_task is not None:
+            gql_task.cancel()
+
+    if state_res is not None:
+        # Re-check of the page-state price; a property that disagrees stays on the DOM for this run
+        agreement = page_state_agreement(state_res, res)
+        metrics.PAGE_STATE_CHECKS.inc(outcome=agreement)
+        if agreement != "unchecked":
+            strategy_memo.note(memo, "page_state", agreement == "agree", time.perf_counter() - t0)
+        if agreement == "disagree":
+            state["page_state_disagrees"] = True
+            if debug:
+                print(f"[page_state] {state_res['per_night']} vs {res['strategy']} {res['per_night']}")
+            res = {**res, "page_state_check": agreement}
+        else:
+            res = {**state_res, "page_state_check": agreement}
+
+    metrics.PRICE_SECONDS.observe(time.perf_counter() - t0, strategy=(res or {}).get("strategy") or "none")
+    if memo is not None and res and "error" not in res:
+        memo["winner"] = {"dom": memo.get("dom_winner"), "graphql": memo.get("gql_winner")}.get(
+            res["strategy"], res["strategy"])
+        memo_store.record(memo_key, memo, time.perf_counter() - t0)
+    if res:
+        return res
+    return {"error": no_rate}
+
+
+# ---------- Browser setup ----------
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36")
+
+
+LAUNCH_ARGS = ["--disable-blink-features=AutomationControlled"]
+
+# Every context (fresh or persistent) gets exactly these (plus the launch
+# profile's), so tabs never inherit a locale/UA from whatever created the browser
+CONTEXT_OPTIONS = {"locale": "de-DE", "user_agent": USER_AGENT}
+
+# Launch profiles. "full" is stock headless Chromium. "lite" drops the GPU
+# process, images and smooth scrolling, uses a shorter viewport and no CSS
+# animations/transitions, and runs a separate headless shell binary if one
+# is found (see headless_shell_path; with the pinned Playwright 1.46 only via
+# RATECHECKER_HEADLESS_SHELL, which already runs Chromium as --headless=old).
+# (Extensions, background networking and component updates are already off
+# in Playwright's default switches.) A property that doesn't price under
+# "lite" is retried once with "full" and stays there (see _scrape_lane_cell);
+# the strategy memo keeps separate entries per profile.
+LAUNCH_PROFILES = ("full", "lite")
+LAUNCH_PROFILE = os.environ.get("RATECHECKER_LAUNCH_PROFILE", "full")
+LITE_LAUNCH_ARGS = [
+    "--disable-gpu",
+    "--disable-software-rasterizer",
+    "--disable-smooth-scrolling",
+    "--disable-sync",
+    "--disable-notifications",
+    # Replaces Playwright's own --blink-settings (last one wins), so its pointer settings are repeated
+    "--blink-settings=imagesEnabled=false,primaryHoverType=2,availableHoverTypes=2,"
+    "primaryPointerType=4,availablePointerTypes=4",
+]
+# Same width as Playwright's default 1280x720, so Booking serves the same layout
+LITE_CONTEXT_OPTIONS = {"viewport": {"width": 1280, "height": 480}, "reduced_motion": "reduce",
+                        "device_scale_factor": 1}
+NO_ANIMATIONS_JS = """
+(() => {
+  const css = "*, *::before, *::after { animation: none !important; transition: none !important;"
+            + " scroll-behavior: auto !important; caret-color: transparent !important; }";
+  const add = () => {
+    const style = document.createElement("style");
+    style.textContent = css;
+    (document.head || document.documentElement).appendChild(style);
+  };
+  if (document.documentElement) add(); else document.addEventListener("DOMContentLoaded", add);
+})();
+"""
+HEADLESS_SHELL_GLOBS = [
+    os.path.join("chromium_headless_shell-*", "chrome-linux", "headless_shell"),
+    os.path.join("chromium_headless_shell-*", "chrome-win", "headless_shell.exe"),
+    os.path.join("chromium_headless_shell-*", "chrome-mac", "headless_shell"),
+]
+
+# Worker pages are packed into shared browsers: up to PAGES_PER_CONTEXT tabs
+# per context and CONTEXTS_PER_BROWSER contexts per browser (a persistent
+# profile is a single context). 1 / 1 gives every worker its own browser.
+CONTEXTS_PER_BROWSER = 2
+PAGES_PER_CONTEXT = 2
+# Browser RSS is re-read at most this often (it walks /proc)
+RSS_CHECK_INTERVAL_S = 2.0
+
+
+def check_launch_profile(profile: Optional[str]) -> str:
+    """`profile` if it is one of LAUNCH_PROFILES, else LAUNCH_PROFILE (None) or ValueError."""
+    profile = profile or LAUNCH_PROFILE
+    if profile not in LAUNCH_PROFILES:
+        raise ValueError(f"unknown launch profile {profile!r} (expected one of {', '.join(LAUNCH_PROFILES)})")
+    return profile
+
+
+def _revision(path: str) -> int:
+    """Numeric revision of a Playwright browser dir (".../chromium_headless_shell-1148/..." -> 1148)."""
+    m = re.search(r"-(\d+)[\\/]", path)
+    return int(m.group(1)) if m else -1
+
+
+def headless_shell_path() -> Optional[str]:
+    """
+    RATECHECKER_HEADLESS_SHELL, else the newest Playwright-installed headless
+    shell. Playwright only downloads chromium_headless_shell-* from 1.49 on,
+    so with the pinned 1.46 nothing is found here unless the variable is set
+    (e.g. to a chrome-headless-shell binary matching the driver's Chromium).
+    """
+    override = os.environ.get("RATECHECKER_HEADLESS_SHELL")
+    if override:
+        return override if os.path.exists(override) else None
+    root = os.environ.get("PLAYWRIGHT_BROWSERS_PATH") or os.path.join(os.path.expanduser("~"), ".cache",
+                                                                      "ms-playwright")
+    found = []
+    for pattern in HEADLESS_SHELL_GLOBS:
+        found.extend(glob.glob(os.path.join(root, pattern)))
+    return max(found, key=_revision) if found else None
+
+
+def launch_options(profile: str = "full", extra_args: Optional[List[str]] = None) -> Dict:
+    """Keyword arguments for chromium.launch / launch_persistent_context under a launch profile."""
+    args = LAUNCH_ARGS + (LITE_LAUNCH_ARGS if profile == "lite" else []) + (extra_args or [])
+    opts = {"headless": True, "args": args}
+    if profile == "lite":
+        shell = headless_shell_path()
+        if shell:
+            opts["executable_path"] = shell
+    return opts
+
+
+def context_options(profile: str = "full") -> Dict:
+    return {**CONTEXT_OPTIONS, **LITE_CONTEXT_OPTIONS} if profile == "lite" else dict(CONTEXT_OPTIONS)
+
+
+async def prepare_context(context, profile: str = "full"):
+    if profile == "lite":
+        await context.add_init_script(NO_ANIMATIONS_JS)
+    return context
+
+
+async def launch_browser(p, extra_args: Optional[List[str]] = None, profile: str = "full"):
+    return await p.chromium.launch(**launch_options(profile, extra_args))
+
+
+async def new_scrape_page(browser, profile: str = "full") -> Page:
+    context = await prepare_context(await browser.new_context(**context_options(profile)), profile)
+    page = await context.new_page()
+    page.set_default_timeout(DEFAULT_TIMEOUT_MS)
+    return page
+
+
+class _ContextSlot:
+    """One browser context inside a host and the tabs leased from it."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.tabs = 0
+        self.ready: Optional[asyncio.Task] = None  # resolves to the BrowserContext
+
+
+class BrowserHost:
+    """
+    One launched browser (or persistent context) shared by several worker
+    tabs. `marker` tags its process tree so the RSS can be measured; limits
+    (BROWSER_MAX_PAGES / BROWSER_MAX_RSS_MB) are per tab slot, so a packed
+    browser may serve proportionally more before it is recycled.
+    """
+
+    def __init__(self, tab_slots: int, profile: str = "full"):
+        self.tab_slots = tab_slots
+        self.profile = profile  # launch profile (see LAUNCH_PROFILES)
+        self.owner = None  # Browser, or BrowserContext for a persistent profile
+        self.persistent = False
+        self.spare_page: Optional[Page] = None  # the blank tab a persistent context opens with
+        self.slot_dir: Optional[str] = None
+        self.marker = memwatch.new_marker()
+        self.contexts: List[_ContextSlot] = []
+        self.ready: Optional[asyncio.Task] = None
+        self.sessions = 0
+        self.pages_served = 0
+        self.drain_reason: Optional[str] = None
+        self.on_disconnected: Optional[Callable] = None  # our listener on `owner`, removed on give-back
+        self._rss: Optional[int] = None
+        self._rss_at = float("-inf")
+
+    def rss_bytes(self) -> Optional[int]:
+        now = time.monotonic()
+        if now - self._rss_at >= RSS_CHECK_INTERVAL_S:
+            self._rss, self._rss_at = memwatch.browser_rss(self.marker), now
+        return self._rss
+
+    async def close(self):
+        if self.owner is None:
+            return
+        try:
+            await self.owner.close()
+        except Exception:
+            pass
+        self.owner = None
+        metrics.BROWSERS.dec()
+        profiles.release_slot(self.slot_dir)
+
+
+class BrowserSession:
+    """One worker's tab, leased from a BrowserPool."""
+
+    def __init__(self, pool: "BrowserPool", host: BrowserHost, slot: _ContextSlot, page: Page):
+        self.pool = pool
+        self.host = host
+        self.slot = slot
+        self.page = page
+        self.pages_served = 0
+        self.cache_stats: Optional[Dict] = None
+
+    @property
+    def profile(self) -> str:
+        return self.host.profile
+
+    def count_page(self):
+        self.pages_served += 1
+        self.host.pages_served += 1
+
+    def rss_bytes(self) -> Optional[int]:
+        return self.host.rss_bytes()
+
+    def recycle_reason(self) -> Optional[str]:
+        """Why this tab should move to a fresh browser before the next task, if at all."""
+        if self.page.is_closed():
+            return "page_closed"
+        host = self.host
+        if host.drain_reason:
+            return "draining"  # another tab already retired this browser
+        if BROWSER_MAX_PAGES and host.pages_served >= BROWSER_MAX_PAGES * host.tab_slots:
+            host.drain_reason = "max_pages"
+        else:
+            rss = host.rss_bytes()
+            if rss is not None and rss > BROWSER_MAX_RSS_MB * 2**20 * host.tab_slots:
+                host.drain_reason = "max_rss"
+        return host.drain_reason
+
+    async def close(self):
+        if self.host is None:
+            return
+        host, slot, self.host = self.host, self.slot, None
+        await self.pool._release(host, slot, self.page)
+
+
+class BrowserPool:
+    """
+    Leases worker tabs for one run, packing them into shared contexts and
+    browsers. Isolation: tabs only share a context when they have the same
+    `key` (currency), a context is closed as soon as its last tab is, so
+    cookies never outlive the tabs that set them, and persistent profiles
+    start with their cookies cleared (their HTTP cache is kept).
+    Browsers are launched with `launch_profile` unless a session asks for
+    another one; tabs only share browsers of their own profile.
+    """
+
+    def __init__(self, p, profile_dir: Optional[str] = None,
+                 contexts_per_browser: int = CONTEXTS_PER_BROWSER, pages_per_context: int = PAGES_PER_CONTEXT,
+                 warm: Optional["WarmBrowsers"] = None, launch_profile: str = "full"):
+        self.p = p
+        self.profile_dir = profile_dir
+        self.launch_profile = launch_profile
+        self.contexts_per_browser = max(1, contexts_per_browser)
+        self.pages_per_context = max(1, pages_per_context)
+        self.warm = warm
+        self.hosts: List[BrowserHost] = []
+        self.launched = 0
+        self.warm_used = 0
+
+    def _place(self, key: str, profile: str) -> Tuple[BrowserHost, _ContextSlot]:
+        """Reserve a tab (no awaits, so concurrent workers see each other's reservations)."""
+        for host in self.hosts:
+            if host.drain_reason or host.profile != profile:
+                continue
+            for slot in host.contexts:
+                if slot.key == key and slot.tabs < self.pages_per_context:
+                    slot.tabs += 1
+                    host.sessions += 1
+                    return host, slot
+            max_contexts = 1 if host.persistent or self.profile_dir else self.contexts_per_browser
+            if len(host.contexts) < max_contexts:
+                return host, self._add_context(host, key)
+
+        host = BrowserHost(self.contexts_per_browser * self.pages_per_context if not self.profile_dir
+                           else self.pages_per_context, profile=profile)
+        host.ready = asyncio.create_task(self._launch(host))
+        self.hosts.append(host)
+        self.launched += 1
+        return host, self._add_context(host, key)
+
+    def _add_context(self, host: BrowserHost, key: str) -> _ContextSlot:
+        slot = _ContextSlot(key)
+        slot.tabs = 1
+        slot.ready = asyncio.create_task(self._new_context(host))
+        host.contexts.append(slot)
+        host.sessions += 1
+        return slot
+
+    async def _launch(self, host: BrowserHost):
+        """Start the host's browser: a persistent context on a managed slot dir, else a fresh browser."""
+        if self.profile_dir:
+            failed: set = set()
+            while True:
+                slot_dir = profiles.acquire_slot(self.profile_dir, exclude=failed)
+                if slot_dir is None:
+                    # All slots busy/locked: degrade to a throwaway browser
+                    break
+                try:
+                    context = await self.p.chromium.launch_persistent_context(
+                        slot_dir,
+                        **launch_options(host.profile, [
+                            host.marker, f"--disk-cache-size={profiles.PROFILE_CACHE_MAX_MB * 1024 * 1024}"]),
+                        **context_options(host.profile),
+                    )
+                    await prepare_context(context, host.profile)
+                except Exception as e:
+                    print(f"[WARN] persistent profile {slot_dir} failed to launch: {e}")
+                    profiles.release_slot(slot_dir)
+                    failed.add(slot_dir)
+                    continue
+                await context.clear_cookies()
+                host.owner, host.persistent, host.slot_dir = context, True, slot_dir
+                host.spare_page = context.pages[0] if context.pages else None
+                metrics.BROWSERS.inc()
+                return
+        entry = await self.warm.take() if self.warm is not None and self.warm.profile == host.profile else None
+        if entry is not None:
+            host.owner, host.marker, host.pages_served = entry.owner, entry.marker, entry.pages_served
+            self.warm_used += 1
+        else:
+            host.owner = await launch_browser(self.p, [host.marker], profile=host.profile)
+            metrics.BROWSERS.inc()
 
-    # 3) DOM failed → GraphQL fallback
-    gql = await graphql_availability_price(page, checkin, days=max(7, nights + 3), debug=debug)
-    if gql and "error" not in gql:
-        return gql
-    if gql:
-        return {"error": gql.get("error", "No rate found for 1 night.")}
+        # A crashed browser is retired; its tabs move to a fresh one (see recycle_reason)
+        def _on_disconnected(_browser=None):
+            host.drain_reason = host.drain_reason or "crashed"
 
-    return {"error": "No rate found for 1 night."}
+        host.owner.on("disconnected", _on_disconnected)
+        host.on_disconnected = _on_disconnected
+
+    async def _new_context(self, host: BrowserHost):
+        await host.ready
+        if host.persistent:
+            return host.owner
+        return await prepare_context(await host.owner.new_context(**context_options(host.profile)), host.profile)
+
+    async def open_session(self, key: str = "", profile: Optional[str] = None) -> BrowserSession:
+        host, slot = self._place(key, profile or self.launch_profile)
+        try:
+            context = await slot.ready
+            page, host.spare_page = host.spare_page, None
+            if page is None:
+                page = await context.new_page()
+        except BaseException:
+            await self._release(host, slot, None)
+            if host.owner is None and host in self.hosts:
+                self.hosts.remove(host)  # launch failed; let the next caller retry
+            raise
+        page.set_default_timeout(DEFAULT_TIMEOUT_MS)
+        session = BrowserSession(self, host, slot, page)
+        session.cache_stats = await attach_cache_stats(page)
+        return session
+
+    async def _release(self, host: BrowserHost, slot: _ContextSlot, page: Optional[Page]):
+        slot.tabs -= 1
+        host.sessions -= 1
+        if page is not None:
+            try:
+                await page.close()
+            except Exception:
+                pass
+        if slot.tabs <= 0 and slot in host.contexts:
+            host.contexts.remove(slot)
+            if not host.persistent and slot.ready.done() and not slot.ready.cancelled() \
+                    and slot.ready.exception() is None:
+                try:
+                    await slot.ready.result().close()
+                except Exception:
+                    pass
+        # Idle browsers stay up for the next lease (e.g. after the comp-set
+        # phase) until the pool closes; only retired ones go now
+        if host.sessions <= 0 and (host.drain_reason or host.owner is None):
+            if host in self.hosts:
+                self.hosts.remove(host)
+            await host.close()
+
+    async def close(self):
+        """
+        Close whatever is still open; with `warm`, healthy idle browsers go
+        back to the warm set instead.
+        """
+        for host in list(self.hosts):
+            self.hosts.remove(host)
+            if self.warm is not None and not host.persistent and host.owner is not None \
+                    and host.sessions <= 0 and not host.drain_reason and host.profile == self.warm.profile \
+                    and self.warm.give_back(host.owner, host.marker, host.pages_served):
+                # Owned (and counted in BROWSERS) by the warm set now; the next pool adds its own listener
+                with contextlib.suppress(Exception):
+                    host.owner.remove_listener("disconnected", host.on_disconnected)
+                host.owner, host.on_disconnected = None, None
+                continue
+            await host.close()
+
+
+# ---------- Warm browsers ----------
+# On a long-lived event loop (eventloop.BackgroundLoop) the Playwright driver
+# and WARM_BROWSERS idle browsers outlive a run: pools take a warm browser
+# instead of launching one and hand healthy ones back when they close. Every
+# WARM_CHECK_INTERVAL_S idle browsers are probed, dead ones replaced and a
+# crashed driver restarted; after WARM_IDLE_CLOSE_S without runs they close.
+WARM_BROWSERS = 1
+WARM_CHECK_INTERVAL_S = 30.0
+WARM_PROBE_TIMEOUT_S = 10.0
+WARM_IDLE_CLOSE_S = 1800.0
+
+
+class _WarmEntry:
+    def __init__(self, owner, marker: str, pages_served: int = 0):
+        self.owner = owner
+        self.marker = marker
+        self.pages_served = pages_served
+
+
+class WarmBrowsers:
+    """Playwright driver plus idle browsers kept between runs. Use only from the loop that started it."""
+
+    def __init__(self, keep: int = WARM_BROWSERS, profile: str = LAUNCH_PROFILE):
+        self.keep = keep
+        self.profile = profile
+        self.p = None
+        self.idle: List[_WarmEntry] = []
+        self.restarts = 0
+        self.last_used = time.monotonic()
+        self._driver_lock: Optional[asyncio.Lock] = None
+        self._maintainer: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the driver, the idle browsers and the health checks (safe to call again)."""
+        await self.driver()
+        if self._maintainer is None or self._maintainer.done():
+            self._maintainer = asyncio.create_task(self._maintain())
+        await self._refill()
+
+    async def driver(self):
+        if self._driver_lock is None:
+            self._driver_lock = asyncio.Lock()
+        async with self._driver_lock:
+            if self.p is None:
+                self.p = await async_playwright().start()
+        return self.p
+
+    async def take(self) -> Optional[_WarmEntry]:
+        """An idle, connected browser for a pool (None if there is none)."""
+        self.last_used = time.monotonic()
+        while self.idle:
+            entry = self.idle.pop()
+            if entry.owner.is_connected():
+                return entry
+            await self._close(entry)
+        return None
+
+    async def new_context(self):
+        """
+        A context on an idle warm browser for background work; the browser
+        stays idle, so a pool may still take it. The caller closes the context.
+        """
+        self.last_used = time.monotonic()
+        if not self.idle:
+            await self._refill()
+        for entry in reversed(self.idle):
+            if entry.owner.is_connected():
+                return await prepare_context(await entry.owner.new_context(**context_options(self.profile)),
+                                             self.profile)
+        raise RuntimeError("no warm browser available")
+
+    def give_back(self, owner, marker: str, pages_served: int) -> bool:
+        """Keep a pool's idle browser warm if there is room; False means the caller closes it."""
+        self.last_used = time.monotonic()
+        if len(self.idle) >= self.keep or not owner.is_connected():
+            return False
+        self.idle.append(_WarmEntry(owner, marker, pages_served))
+        return True
+
+    async def check(self) -> Dict:
+        """Probe the idle browsers, replace dead ones (restarting the driver if it died) and report."""
+        unused = time.monotonic() - self.last_used > WARM_IDLE_CLOSE_S
+        for entry in list(self.idle):
+            if unused or not await self._healthy(entry):
+                if entry in self.idle:  # a pool may have taken it meanwhile
+                    self.idle.remove(entry)
+                    await self._close(entry)
+        await self._refill()
+        return self.status()
+
+    def status(self) -> Dict:
+        return {"driver": self.p is not None, "idle": len(self.idle), "restarts": self.restarts}
+
+    async def close(self):
+        if self._maintainer is not None:
+            self._maintainer.cancel()
+        while self.idle:
+            await self._close(self.idle.pop())
+        p, self.p = self.p, None
+        if p is not None:
+            try:
+                await p.stop()
+            except Exception:
+                pass
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(WARM_CHECK_INTERVAL_S)
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"[WARN] warm browser check failed: {e}")
+
+    async def _healthy(self, entry: _WarmEntry) -> bool:
+        if not entry.owner.is_connected():
+            return False
+        try:
+            context = await asyncio.wait_for(entry.owner.new_context(), WARM_PROBE_TIMEOUT_S)
+            await context.close()
+            return True
+        except Exception:
+            return False
+
+    async def _launch(self) -> _WarmEntry:
+        marker = memwatch.new_marker()
+        owner = await launch_browser(await self.driver(), [marker], profile=self.profile)
+        metrics.BROWSERS.inc()
+        return _WarmEntry(owner, marker)
+
+    async def _refill(self):
+        if time.monotonic() - self.last_used > WARM_IDLE_CLOSE_S:
+            return
+        while len(self.idle) < self.keep:
+            try:
+                entry = await self._launch()
+            except Exception as e:
+                # Launch failing with a live loop almost always means the driver died
+                print(f"[WARN] warm browser launch failed, restarting Playwright: {e}")
+                await self._restart_driver()
+                try:
+                    entry = await self._launch()
+                except Exception as e:
+                    print(f"[WARN] warm browser launch failed again: {e}")
+                    return
+            self.idle.append(entry)
+
+    async def _restart_driver(self):
+        self.restarts += 1
+        while self.idle:
+            await self._close(self.idle.pop())
+        p, self.p = self.p, None
+        if p is not None:
+            try:
+                await p.stop()
+            except Exception:
+                pass
+
+    async def _close(self, entry: _WarmEntry):
+        try:
+            await entry.owner.close()
+        except Exception:
+            pass
+        metrics.BROWSERS.dec()
+
+
+@contextlib.asynccontextmanager
+async def _playwright(warm: Optional[WarmBrowsers] = None):
+    """The warm driver when given (left running), else a driver for this run only."""
+    if warm is not None:
+        yield await warm.driver()
+    else:
+        async with async_playwright() as p:
+            yield p
+
+
+# ---------- HTTP cache accounting ----------
+async def attach_cache_stats(page: Page) -> Optional[Dict]:
+    """
+    Count responses and cache hits (memory, disk, prefetch, service worker)
+    through a CDP session. Returns a live counter dict, or None if CDP is
+    unavailable. Call `take_cache_stats` after each task for its delta.
+    """
+    try:
+        cdp = await page.context.new_cdp_session(page)
+        await cdp.send("Network.enable")
+    except Exception:
+        return None
+    stats = {"requests": 0, "hits": 0, "hit_ids": set()}
+
+    def _on_served(params):
+        stats["hit_ids"].add(params.get("requestId"))
+
+    def _on_response(params):
+        stats["requests"] += 1
+        resp = params.get("response") or {}
+        if resp.get("fromDiskCache") or resp.get("fromPrefetchCache") or resp.get("fromServiceWorker"):
+            stats["hit_ids"].add(params.get("requestId"))
+        if params.get("requestId") in stats["hit_ids"]:
+            stats["hits"] += 1
+
+    cdp.on("Network.requestServedFromCache", _on_served)
+    cdp.on("Network.responseReceived", _on_response)
+    return stats
+
+
+def take_cache_stats(stats: Optional[Dict]) -> Dict:
+    """Read and reset the counters; returns fields to merge into a cell result."""
+    if not stats:
+        return {}
+    requests, hits = stats["requests"], stats["hits"]
+    stats["requests"] = stats["hits"] = 0
+    stats["hit_ids"].clear()
+    return {
+        "cache_requests": requests,
+        "cache_hits": hits,
+        "cache_hit_ratio": round(hits / requests, 3) if requests else None,
+    }
 
 
 # ---------- One scrape task ----------
-async def scrape_one(hotel: Dict, checkin: datetime, selected_currency: str, debug=False) -> Dict:
+async def _release_page(page: Page):
+    """Stop whatever an abandoned stage left running so the page can take the next task."""
+    try:
+        await page.goto("about:blank", timeout=5000)
+    except Exception:
+        pass
+
+
+async def scrape_cell(
+    page: Page,
+    hotel: Dict,
+    checkin: datetime,
+    selected_currency: str,
+    state: Optional[Dict] = None,
+    debug: bool = False,
+    deadline_s: float = CELL_DEADLINE_S,
+    archive=None,
+    memo_store: Optional[strategy_memo.StrategyMemo] = None,
+    memo_profile: str = "full",
+) -> Dict:
+    """
+    Scrape one hotel x date on an already open page.
+    `state` is shared by all dates of the same property: the resolved URL is
+    looked up once (also when several of its lanes run at the same time)
+    and GraphQL tokens are reused.
+    The whole cell gets `deadline_s` seconds; when it runs out the work is
+    cancelled and the cell reports reason "deadline_exceeded" plus the stage.
+    `archive` (archive.HtmlArchive) records page snapshots and the outcome.
+    `memo_store` (strategy_memo.StrategyMemo) steers the price extraction;
+    `memo_profile` is the launch profile of `page` (memo entries are per profile).
+    """
+    state = {} if state is None else state
     hotel_name = hotel.get("name") or hotel.get("hotel") or ""
-    provided_url = canonicalize_booking_url(hotel.get("url"))
+    deadline = Deadline(deadline_s)
+    t0 = time.perf_counter()
+    metrics.IN_FLIGHT.inc()
+
+    async def _run() -> Dict:
+        if "url" not in state:
+            # A property's date-band lanes share `state` and may run at once: one resolves, the others wait
+            _stage(deadline, "resolve_url_wait", page)
+            async with state.setdefault("url_lock", asyncio.Lock()):
+                if "url" not in state:
+                    # If user pasted a Booking property link, use it.
+                    provided_url = canonicalize_booking_url(hotel.get("url"))
+                    # Fallback to resolver (no city anymore)
+                    state["url"] = provided_url or await resolve_property_url(
+                        page, hotel_name, city=None, debug=debug, deadline=deadline
+                    )
+        url = state["url"]
+
+        if not url:
+            return {"error": "no_url"}
+
+        return await get_price_for_dates(page, url, checkin, nights=1, currency=selected_currency,
+                                         debug=debug, state=state, deadline=deadline, archive=archive,
+                                         memo_store=memo_store, memo_profile=memo_profile)
 
+    try:
+        try:
+            result = await asyncio.wait_for(_run(), timeout=deadline_s)
+        except Exception:
+            if deadline.expired():
+                raise DeadlineExceeded(deadline.stage)
+            raise
+        # A miss found with the budget gone (e.g. extraction cut short) is not a real miss
+        if "error" in result and deadline.expired():
+            raise DeadlineExceeded(deadline.stage)
+    except (DeadlineExceeded, asyncio.TimeoutError):
+        await _release_page(page)
+        result = {"error": "deadline_exceeded", "stage": deadline.stage}
+    except Exception as e:
+        result = {"error": f"exception {e}"}
+    finally:
+        page.set_default_timeout(DEFAULT_TIMEOUT_MS)
+        metrics.IN_FLIGHT.dec()
+
+    if "error" in result:
+        out = {"hotel": hotel_name, "date": iso(checkin), "status": "No rate found", "reason": result["error"]}
+        if "stage" in result:
+            out["stage"] = result["stage"]
+    else:
+        out = {
+            "hotel": hotel_name,
+            "date": iso(checkin),
+            "status": "OK",
+            "value": result["per_night"],
+            "total_for_queried_nights": result["total_incl_taxes"],
+            "nights_queried": result["nights_queried"],
+            "minstay_applied": result["minstay_applied"],
+            "currency": selected_currency,
+            "strategy": result.get("strategy"),
+        }
+        if result.get("page_state_check"):
+            out["page_state_check"] = result["page_state_check"]
+    if state.get("url"):
+        out["property_url"] = state["url"]
+    if archive is not None:
+        archive.record_result(hotel_name, checkin, out)
+    metrics.CELLS.inc(status=out["status"], reason=metrics.reason_label(out.get("reason")))
+    metrics.CELL_SECONDS.observe(time.perf_counter() - t0)
+    return out
+
+
+async def scrape_one(hotel: Dict, checkin: datetime, selected_currency: str, debug=False,
+                     launch_profile: str = LAUNCH_PROFILE) -> Dict:
+    """
+    Standalone single-cell scrape with its own short-lived browser; a
+    "lite" miss is retried once with full rendering.
+    """
+    state: Dict = {}
     async with async_playwright() as p:
-        browser = await p.chromium.launch(
-            headless=True,
-            args=["--disable-blink-features=AutomationControlled"],
-        )
-        context = await browser.new_context(
-            locale="de-DE",
-            user_agent=("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                        "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36")
-        )
-        page = await context.new_page()
-        page.set_default_timeout(30000)
+        r = await _scrape_one_profile(p, hotel, checkin, selected_currency, state, launch_profile, debug)
+        if _full_render_probe_due(launch_profile, state, r):
+            r = await _scrape_one_profile(p, hotel, checkin, selected_currency, state, "full", debug)
+            r["render_fallback"] = True
+        return r
 
-        try:
-            # If user pasted a Booking property link, use it.
-            if provided_url:
-                url = provided_url
-            else:
-                # Fallback to resolver (no city anymore)
-                url = await resolve_property_url(page, hotel_name, city=None, debug=debug)
 
-            if not url:
+async def _scrape_one_profile(p, hotel: Dict, checkin: datetime, selected_currency: str, state: Dict,
+                              profile: str, debug: bool) -> Dict:
+    browser = await launch_browser(p, profile=profile)
+    try:
+        page = await new_scrape_page(browser, profile=profile)
+        return await scrape_cell(page, hotel, checkin, selected_currency, state=state, debug=debug,
+                                 memo_profile=profile)
+    finally:
+        await browser.close()
+
+
+# ---------- Single-flight de-duplication ----------
+# Shared by every run in this process (all Streamlit sessions)
+SCRAPE_FLIGHTS = SingleFlight()
+# Per-property extraction path memory, shared by every run in this process
+STRATEGY_MEMO = strategy_memo.StrategyMemo(strategy_memo.MEMO_PATH)
+# Cells scraped at once across all runs; contended slots go by fair share (see fairshare.py)
+CELL_SLOTS = NUM_CONCURRENCY + 2
+SCHEDULER = fairshare.FairScheduler(CELL_SLOTS)
+
+
+def hotel_ident(hotel: Dict) -> str:
+    """Identity of a hotel row: canonical URL, else its folded name."""
+    url = canonicalize_booking_url(hotel.get("url"))
+    return url or "name:" + (hotel.get("name") or hotel.get("hotel") or "").strip().casefold()
+
+
+def cell_key(hotel: Dict, checkin: datetime, nights: int, currency: str) -> Tuple[str, str, int, str]:
+    """Identity of a scrape cell: canonical URL (or folded name), date, nights, currency."""
+    return hotel_ident(hotel), iso(checkin), nights, (currency or "").upper()
+
+
+async def scrape_cell_shared(page: Page, hotel: Dict, checkin: datetime, selected_currency: str,
+                             **kwargs) -> Dict:
+    """
+    `scrape_cell` behind the process-wide single-flight: identical concurrent
+    cells (same property/date/nights/currency) are scraped once; waiters get
+    a copy labelled with their own hotel name and "coalesced": True.
+    """
+    key = cell_key(hotel, checkin, 1, selected_currency)
+    r, shared = await SCRAPE_FLIGHTS.do(
+        key, lambda: scrape_cell(page, hotel, checkin, selected_currency, **kwargs)
+    )
+    if not shared:
+        return r
+    metrics.COALESCED.inc()
+    return {**r, "hotel": hotel.get("name") or hotel.get("hotel") or "", "coalesced": True}
+
+
+# ---------- Speculative prefetch ----------
+# While hotel rows are still being edited, the app hands them to
+# prefetch_properties: name-only rows get their property URL resolved, one
+# tab at a time and at background priority. Runs seed every property's state
+# from PREFETCH (and store the URLs they resolved themselves), so a prefetched
+# property's first date skips the search. Only URLs are kept: GraphQL tokens
+# belong to the context (cookies) that read them and are bootstrapped per run.
+PREFETCH_TTL_S = 6 * 3600
+# A failed prefetch is not retried before this
+PREFETCH_RETRY_S = 600
+# Wait this long after an edit; a newer edit (or a run) of the same user supersedes
+PREFETCH_DELAY_S = 2.0
+
+
+class PropertyPrefetch:
+    """Resolved property URLs by hotel_ident, shared by the process."""
+
+    def __init__(self, ttl_s: float = PREFETCH_TTL_S):
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        self._pending: set = set()
+        self._generation: Dict[str, int] = {}
+
+    def _fresh(self, entry: Optional[Dict]) -> bool:
+        if not entry:
+            return False
+        return time.time() - entry["at"] < (self.ttl_s if entry["url"] else PREFETCH_RETRY_S)
+
+    def seed(self, hotel: Dict) -> Dict:
+        """Initial lane state for `hotel`: its URL when known (else empty)."""
+        with self._lock:
+            entry = self._entries.get(hotel_ident(hotel))
+            if not self._fresh(entry) or not entry["url"]:
+                return {}
+            return {"url": entry["url"]}
+
+    def store(self, hotel: Dict, url: Optional[str]):
+        with self._lock:
+            self._entries[hotel_ident(hotel)] = {"url": url, "at": time.time()}
+
+    def learn(self, hotel: Dict, state: Dict):
+        """Keep the URL a run resolved for `hotel` (from its lane state)."""
+        if state.get("url"):
+            self.store(hotel, state["url"])
+
+    def begin(self, user: str) -> int:
+        """Supersede `user`'s running prefetch; returns the new generation."""
+        with self._lock:
+            self._generation[user] = self._generation.get(user, 0) + 1
+            return self._generation[user]
+
+    def superseded(self, user: str, generation: int) -> bool:
+        with self._lock:
+            return self._generation.get(user, 0) != generation
+
+    def claim(self, hotels: List[Dict]) -> List[Dict]:
+        """The hotels that are neither known nor being prefetched, now marked pending."""
+        todo = []
+        with self._lock:
+            for h in hotels:
+                ident = hotel_ident(h)
+                if ident == "name:" or ident in self._pending or self._fresh(self._entries.get(ident)):
+                    continue
+                self._pending.add(ident)
+                todo.append(h)
+        return todo
+
+    def release(self, hotels: List[Dict]):
+        with self._lock:
+            for h in hotels:
+                self._pending.discard(hotel_ident(h))
+
+    def status(self) -> Dict:
+        with self._lock:
+            known = [e for e in self._entries.values() if self._fresh(e)]
+            return {"resolved": sum(1 for e in known if e["url"]), "failed": sum(1 for e in known if not e["url"]),
+                    "pending": len(self._pending)}
+
+
+PREFETCH = PropertyPrefetch()
+
+
+@contextlib.asynccontextmanager
+async def _prefetch_page(warm: Optional[WarmBrowsers] = None):
+    """A tab in its own context: on an idle warm browser when given, else on a browser of its own."""
+    if warm is not None:
+        context = await warm.new_context()
+        try:
+            page = await context.new_page()
+            page.set_default_timeout(DEFAULT_TIMEOUT_MS)
+            yield page
+        finally:
+            with contextlib.suppress(Exception):
+                await context.close()
+    else:
+        async with async_playwright() as p:
+            browser = await launch_browser(p, profile=LAUNCH_PROFILE)
+            try:
+                yield await new_scrape_page(browser, profile=LAUNCH_PROFILE)
+            finally:
                 await browser.close()
-                return {"hotel": hotel_name, "date": iso(checkin), "status": "No rate found", "reason": "no_url"}
 
-            result = await get_price_for_dates(page, url, checkin, nights=1, currency=selected_currency, debug=debug)
+
+async def _prefetch_one(page: Page, hotel: Dict, debug: bool = False) -> Optional[str]:
+    """Resolve `hotel`'s property URL (None when not found)."""
+    if hotel.get("url"):
+        url = canonicalize_booking_url(hotel["url"])
+        if url:
+            metrics.PREFETCH.inc(outcome="ok")
+            return url
+    deadline = Deadline(CELL_DEADLINE_S)
+    try:
+        url = await asyncio.wait_for(
+            resolve_property_url(page, hotel.get("name") or hotel.get("hotel") or "", city=None,
+                                 debug=debug, deadline=deadline),
+            timeout=CELL_DEADLINE_S,
+        )
+        metrics.PREFETCH.inc(outcome="ok" if url else "no_url")
+        return url
+    except Exception as e:
+        metrics.PREFETCH.inc(outcome="error")
+        if debug:
+            print(f"[WARN] prefetch of {hotel.get('name')!r} failed: {e}")
+        return None
+    finally:
+        page.set_default_timeout(DEFAULT_TIMEOUT_MS)
+
+
+async def prefetch_properties(hotels: List[Dict], user: str = "default", warm: Optional[WarmBrowsers] = None,
+                              debug: bool = False) -> int:
+    """
+    Resolve the property URLs of the `hotels` PREFETCH does not know yet, one tab
+    at background priority. Starts after PREFETCH_DELAY_S and stops between
+    hotels once `user` edits again or starts a run (unfinished hotels are
+    left to the next call). Returns the number of hotels prefetched.
+    """
+    generation = PREFETCH.begin(user)
+    await asyncio.sleep(PREFETCH_DELAY_S)
+    if PREFETCH.superseded(user, generation):
+        return 0
+    todo = PREFETCH.claim(hotels)
+    if not todo:
+        return 0
+    job = SCHEDULER.job(user, len(todo), background=True)
+    done = 0
+    tracing.OCCUPANCY.enter()
+    try:
+        async with _prefetch_page(warm) as page:
+            for h in todo:
+                if PREFETCH.superseded(user, generation):
+                    break
+                async with job.slot():
+                    url = await _prefetch_one(page, h, debug=debug)
+                PREFETCH.store(h, url)
+                done += 1
+    except Exception as e:
+        print(f"[WARN] prefetch stopped: {e}")
+    finally:
+        tracing.OCCUPANCY.leave()
+        PREFETCH.release(todo)
+    return done
+
+
+# ---------- Comp-set destination mode ----------
+# One dated destination search prices dozens of hotels per date. Cards are
+# matched to the portfolio by property URL, else by a unique fuzzy name
+# match; everything else falls back to the per-property scrape. Card prices
+# are Booking's pick for 2 adults / 1 night, incl. the "+ taxes" line.
+COMPSET_PAGE_SIZE = 25
+COMPSET_MAX_PAGES = 10
+COMPSET_MATCH_MIN_SCORE = 85
+# Two cards scoring this close for one hotel make its name match ambiguous
+COMPSET_MATCH_MARGIN = 3
+
+CARD_TESTID = "property-card"
+_CARD_FIELDS = {"title": "name", "address": "address", "price-and-discounted-price": "price",
+                "taxes-and-charges": "taxes"}
+_PROPERTY_KEY_RE = re.compile(r"/hotel/([a-z]{2})/([^/?#.]+)")
+
+
+def property_key(url: Optional[str]) -> Optional[str]:
+    """"de/steigenberger-frankfurter-hof" for any language/query variant of a property URL."""
+    m = _PROPERTY_KEY_RE.search(url or "")
+    return f"{m.group(1)}/{m.group(2)}" if m else None
+
+
+class _CardParser(HTMLParser):
+    """Collect name/address/price/taxes text and the property link of every search-result card."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: List[Tuple[str, bool]] = []  # (tag, opened a field)
+        self.cards: List[Dict[str, str]] = []
+        self._card_depth: Optional[int] = None
+        self._field: Optional[str] = None
+        self._buf: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            return
+        a = dict(attrs)
+        testid = a.get("data-testid") or ""
+        if self._card_depth is None and testid == CARD_TESTID:
+            self._card_depth = len(self.stack)
+            self.cards.append({})
+        opened = False
+        if self._card_depth is not None:
+            card = self.cards[-1]
+            if tag == "a" and "url" not in card and "/hotel/" in (a.get("href") or ""):
+                card["url"] = a["href"]
+            name = _CARD_FIELDS.get(testid)
+            if name and self._field is None and name not in card:
+                self._field, self._buf, opened = name, [], True
+        self.stack.append((tag, opened))
+
+    def handle_endtag(self, tag):
+        while self.stack:
+            t, opened = self.stack.pop()
+            if opened:
+                self.cards[-1][self._field] = " ".join("".join(self._buf).split())
+                self._field = None
+            if self._card_depth is not None and len(self.stack) == self._card_depth:
+                self._card_depth = None
+            if t == tag:
+                break
+
+    def handle_data(self, data):
+        if self._field is not None:
+            self._buf.append(data)
+
+
+def cards_from_html(html: str) -> List[Dict]:
+    """
+    Search-result cards as {"name", "address", "url", "key", "price"}; price
+    is the card price plus any separately listed taxes (None if unpriced).
+    """
+    parser = _CardParser()
+    parser.feed(html or "")
+    parser.close()
+    out = []
+    for c in parser.cards:
+        href = c.get("url") or ""
+        url = ("https://www.booking.com" + href if href.startswith("/") else href).split("?")[0]
+        key = property_key(url)
+        if not c.get("name") or not key:
+            continue
+        price = parse_money_max(c.get("price", ""))
+        taxes = c.get("taxes", "")
+        if price is not None and "+" in taxes:
+            price += parse_money_max(taxes) or 0.0
+        out.append({"name": c["name"], "address": c.get("address", ""), "url": url, "key": key,
+                    "price": round(price, 2) if price is not None else None})
+    return out
+
+
+def match_cards(hotels: List[Dict], cards: List[Dict]) -> Dict[str, Dict]:
+    """
+    hotel name -> card. Hotels with a property URL match only that property;
+    the rest need a fuzzy name score >= COMPSET_MATCH_MIN_SCORE with no
+    runner-up within COMPSET_MATCH_MARGIN, and each card goes to one hotel.
+    """
+    by_key = {c["key"]: c for c in cards}
+    matched: Dict[str, Dict] = {}
+    taken = set()
+    for h in hotels:
+        key = property_key(canonicalize_booking_url(h.get("url")))
+        if key and key in by_key:
+            matched[h["name"]] = by_key[key]
+            taken.add(key)
+
+    pairs = []
+    for h in hotels:
+        if h["name"] in matched or property_key(canonicalize_booking_url(h.get("url"))):
+            continue
+        scored = sorted(((score_candidate(h["name"], None, c["name"], c["address"]), c["key"])
+                         for c in cards if c["key"] not in taken), reverse=True)
+        if not scored or scored[0][0] < COMPSET_MATCH_MIN_SCORE:
+            continue
+        if len(scored) > 1 and scored[0][0] - scored[1][0] < COMPSET_MATCH_MARGIN:
+            continue
+        pairs.append((scored[0][0], h["name"], scored[0][1]))
+    for _score, name, key in sorted(pairs, reverse=True):
+        if key not in taken:
+            matched[name] = by_key[key]
+            taken.add(key)
+    return matched
+
+
+def destination_search_url(destination: str, checkin: datetime, currency: str, offset: int = 0,
+                           nights: int = 1) -> str:
+    return (
+        "https://www.booking.com/searchresults.html"
+        f"?ss={quote_plus(destination)}"
+        f"&checkin={iso(checkin)}&checkout={iso(checkin + timedelta(days=nights))}"
+        "&group_adults=2&no_rooms=1&group_children=0"
+        f"&selected_currency={currency}&lang=de-de&offset={offset}"
+    )
+
+
+async def search_destination_date(page: Page, destination: str, checkin: datetime, hotels: List[Dict],
+                                  selected_currency: str, debug: bool = False, archive=None,
+                                  deadline_s: float = CELL_DEADLINE_S) -> Tuple[Dict[str, Dict], int]:
+    """
+    Page through the dated destination search until every hotel is matched
+    or results run out. Returns ({hotel name: cell result} for matched,
+    priced cards, pages loaded). Each page gets `deadline_s`; a failing page
+    ends the search and whatever was matched so far stands.
+    """
+    cards: Dict[str, Dict] = {}
+    pages = 0
+
+    async def _load(offset: int) -> List[Dict]:
+        resp = await page.goto(destination_search_url(destination, checkin, selected_currency, offset),
+                               wait_until="domcontentloaded")
+        if not resp or not resp.ok or "/hotel/" in page.url:
+            return []  # error, or Booking jumped straight to a single property
+        await accept_cookies_if_present(page)
+        if not await _wait_for_any(page, [f'[data-testid="{CARD_TESTID}"]'], timeout=20000):
+            return []
+        await page_settle(page)
+        html = await page.content()
+        if archive is not None:
+            archive.record("search_html", page.url, checkin, html.encode("utf-8"), offset=offset)
+        return cards_from_html(html)
+
+    for n in range(COMPSET_MAX_PAGES):
+        try:
+            found = await asyncio.wait_for(_load(n * COMPSET_PAGE_SIZE), timeout=deadline_s)
         except Exception as e:
-            await browser.close()
-            return {"hotel": hotel_name, "date": iso(checkin), "status": "No rate found", "reason": f"exception {e}"}
+            if debug:
+                print(f"destination search {destination} {iso(checkin)} page {n}: {e!r}")
+            await _release_page(page)
+            break
+        pages += 1
+        new = [c for c in found if c["key"] not in cards]
+        cards.update((c["key"], c) for c in new)
+        if not new or len(match_cards(hotels, list(cards.values()))) == len(hotels):
+            break
 
-        await browser.close()
+    out = {}
+    for name, c in match_cards(hotels, list(cards.values())).items():
+        if c["price"] is None:
+            continue  # sold out / no price shown: let the property page decide
+        out[name] = {
+            "hotel": name,
+            "date": iso(checkin),
+            "status": "OK",
+            "value": c["price"],
+            "total_for_queried_nights": c["price"],
+            "nights_queried": 1,
+            "minstay_applied": False,
+            "currency": selected_currency,
+            "strategy": "search",
+            "property_url": c["url"],
+        }
+    if debug:
+        print(f"destination search {destination} {iso(checkin)}: {len(cards)} cards, "
+              f"{len(out)}/{len(hotels)} hotels priced, {pages} page(s)")
+    return out, pages
+
+
+async def _destination_phase(pool: "BrowserPool", destination: str, hotels: List[Dict], dates: List[datetime],
+                             on_result, selected_currency: str, run: Dict, debug: bool = False,
+                             skip: Optional[set] = None) -> set:
+    """
+    Run the destination search for every date on pool tabs; returns the
+    (name, iso) cells it priced. Cells in `skip` are not searched for.
+    Each search takes a slot of run["job"] and passes memory admission,
+    like a lane cell.
+    """
+    skip = skip or set()
+    wanted = {d: [h for h in hotels if (h["name"], iso(d)) not in skip] for d in sorted(set(dates))}
+    todo = deque(d for d, hs in wanted.items() if hs)
+    done: set = set()
+    by_name = {h["name"]: h for h in hotels}
+
+    async def _worker():
+        session = await pool.open_session(selected_currency)
+        try:
+            while todo:
+                d = todo.popleft()
+                await asyncio.sleep(random.uniform(0.25, 0.8))
+                await _admit(run)
+                job = run.get("job")
+                async with job.slot(d) if job is not None else contextlib.nullcontext():
+                    run["in_flight"] += 1
+                    try:
+                        priced, pages = await search_destination_date(
+                            session.page, destination, d, wanted[d], selected_currency, debug=debug,
+                            archive=run.get("archive"))
+                    finally:
+                        run["in_flight"] -= 1
+                run["compset"]["pages"] += pages
+                for name, r in priced.items():
+                    done.add((name, iso(d)))
+                    on_result(by_name[name], d, r)
+                metrics.COMPSET.inc(len(priced), outcome="matched")
+                metrics.COMPSET.inc(len(wanted[d]) - len(priced), outcome="fallback")
+        finally:
+            await session.close()
+
+    await asyncio.gather(*[_worker() for _ in range(min(NUM_CONCURRENCY, len(todo)))])
+    run["compset"]["matched"] = len(done)
+    run["compset"]["fallback"] = sum(map(len, wanted.values())) - len(done)
+    return done
+
+
+# ---------- Locality-aware scheduling ----------
+class PropertyLane:
+    """
+    Remaining dates of one property, consumed in date order by a single
+    worker on one warm page. `state` is shared with lanes stolen from it.
+    """
+
+    def __init__(self, hotel: Dict, dates: List[datetime], state: Optional[Dict] = None):
+        self.hotel = hotel
+        self.dates = deque(sorted(dates))
+        self.state = {} if state is None else state
+
+    def steal_half(self) -> Optional["PropertyLane"]:
+        """Split off the later half of the remaining dates (None if < 2 remain)."""
+        n = len(self.dates) // 2
+        if n < 1:
+            return None
+        stolen = [self.dates.pop() for _ in range(n)]
+        return PropertyLane(self.hotel, stolen, state=self.state)
+
+
+# Check-in horizons (days from today) that are queued one after the other,
+# so next weekend is priced for every property before next year
+DATE_BANDS_DAYS = (14, 60)
+
+
+def _date_band(d: datetime, today) -> int:
+    days = (d.date() - today).days
+    return next((i for i, limit in enumerate(DATE_BANDS_DAYS) if days <= limit), len(DATE_BANDS_DAYS))
+
+
+def build_lanes(hotels: List[Dict], dates: List[datetime], skip: Optional[set] = None,
+                today: Optional[datetime] = None, seed: Optional[Callable[[Dict], Dict]] = None) -> deque:
+    """
+    One lane per property and date band (DATE_BANDS_DAYS), nearest band
+    first; properties with the same name share lanes, and a property's
+    lanes share its state (initially `seed(hotel)`, e.g. PREFETCH.seed).
+    Cells in `skip` ((name, yyyy-mm-dd), already priced) are left out.
+    """
+    today = (today or datetime.now()).date()
+    bands: Dict[int, List[PropertyLane]] = {}
+    seen = set()
+    for h in hotels:
+        if h["name"] in seen:
+            continue
+        seen.add(h["name"])
+        todo = [d for d in dates if (h["name"], iso(d)) not in skip] if skip else dates
+        by_band: Dict[int, List[datetime]] = {}
+        for d in todo:
+            by_band.setdefault(_date_band(d, today), []).append(d)
+        state: Dict = seed(h) if seed else {}
+        for band, band_dates in by_band.items():
+            bands.setdefault(band, []).append(PropertyLane(h, band_dates, state=state))
+    return deque(lane for band in sorted(bands) for lane in bands[band])
+
+
+def _next_lane(pending: deque, active: List[PropertyLane]) -> Optional[PropertyLane]:
+    """Take the next untouched property, or steal from the busiest running lane."""
+    if pending:
+        return pending.popleft()
+    victims = [lane for lane in active if len(lane.dates) >= 2]
+    if not victims:
+        return None
+    return max(victims, key=lambda lane: len(lane.dates)).steal_half()
+
+
+async def _admit(run: Dict):
+    """
+    Wait while host memory is above the high-water mark, as long as some
+    other worker is mid-task (its finish may free memory) and we have not
+    waited HOST_ADMISSION_MAX_WAIT_S.
+    """
+    waited = 0.0
+    while waited < HOST_ADMISSION_MAX_WAIT_S and run["in_flight"] > 0:
+        pressure = memwatch.host_pressure()
+        if pressure is None or pressure < HOST_ADMISSION_HIGH_WATER:
+            break
+        if waited == 0.0:
+            run["admission_waits"] += 1
+        await asyncio.sleep(0.5)
+        waited += 0.5
+
+
+async def _lane_worker(pool: BrowserPool, pending: deque, active: List[PropertyLane], on_result,
+                       selected_currency: str, run: Dict, debug: bool = False):
+    """One tab leased from `pool`; runs whole properties back to back until no work is left."""
+    session = await pool.open_session(selected_currency)
+    try:
+        while True:
+            lane = _next_lane(pending, active)
+            if lane is None:
+                break
+            active.append(lane)
+            try:
+                while lane.dates:
+                    d = lane.dates.popleft()
+                    metrics.QUEUE_DEPTH.dec()
+                    await asyncio.sleep(random.uniform(0.25, 0.8))
+                    session, r = await _scrape_lane_cell(pool, session, lane, d, selected_currency, run, debug=debug)
+                    on_result(lane.hotel, d, r)
+            finally:
+                active.remove(lane)
+                # Dates left on an aborted lane are no longer queued
+                metrics.QUEUE_DEPTH.dec(len(lane.dates))
+    finally:
+        await session.close()
+
+
+def _full_render_probe_due(profile: str, state: Dict, r: Dict) -> bool:
+    """
+    A "lite" miss on a property not probed yet: the DOM/GraphQL paths found
+    no rate, which may mean the page needs full rendering. Worth one retry.
+    """
+    return profile == "lite" and "full_render" not in state and r.get("status") != "OK" \
+        and not r.get("coalesced") and (r.get("reason") or "").startswith("No rate")
 
-        if "error" in result:
-            return {"hotel": hotel_name, "date": iso(checkin), "status": "No rate found", "reason": result["error"]}
+
+async def _scrape_lane_cell(pool: BrowserPool, session: BrowserSession, lane: PropertyLane, d: datetime,
+                            selected_currency: str, run: Dict, debug: bool = False) -> Tuple[BrowserSession, Dict]:
+    """
+    Scrape one date of `lane` on `session`, recycling the tab first if due;
+    returns the (new) session. Under a "lite" pool the first miss of a
+    property is retried on a "full" tab; if that prices it, the property's
+    state gets "full_render" and its later dates are scraped "full" too.
+    """
+    probing = False
+    while True:
+        profile = "full" if probing or lane.state.get("full_render") else pool.launch_profile
+        reason = session.recycle_reason()
+        if reason or session.profile != profile:
+            if reason:
+                if debug:
+                    print(f"recycling tab after {session.pages_served} pages "
+                          f"(browser {session.host.pages_served}, {reason})")
+                run["recycled"][reason] = run["recycled"].get(reason, 0) + 1
+            await session.close()
+            session = await pool.open_session(selected_currency, profile=profile)
+        job = run.get("job")
+        # Admit first: a run waiting out memory pressure must not sit on a slot others queue for
+        await _admit(run)
+        # Waiting for a slot keeps the lane as it is: nothing is lost when other runs go first
+        async with job.slot(d) if job is not None else contextlib.nullcontext():
+            take_cache_stats(session.cache_stats)
+            tracer = run.get("tracer")
+            traced = tracer is not None and await tracer.begin_cell(session.page.context)
+            run["in_flight"] += 1
+            t0 = time.perf_counter()
+            try:
+                r = await scrape_cell_shared(session.page, lane.hotel, d, selected_currency,
+                                             state=lane.state, debug=debug, archive=run.get("archive"),
+                                             memo_store=run.get("memo_store"), memo_profile=session.profile)
+            finally:
+                run["in_flight"] -= 1
+        if traced:
+            await tracer.end_cell(session.page.context, lane.hotel["name"], d,
+                                  time.perf_counter() - t0, r)
+        if r.get("coalesced"):
+            run["coalesced"] += 1
         else:
-            return {
-                "hotel": hotel_name,
-                "date": iso(checkin),
-                "status": "OK",
-                "value": result["per_night"],
-                "total_for_queried_nights": result["total_incl_taxes"],
-                "nights_queried": result["nights_queried"],
-                "minstay_applied": result["minstay_applied"],
-                "currency": selected_currency,
-            }
+            session.count_page()
+        r.update(take_cache_stats(session.cache_stats))
+        if probing:
+            lane.state["full_render"] = r.get("status") == "OK"
+            run["full_render"] = run.get("full_render", 0) + lane.state["full_render"]
+            r["render_fallback"] = True
+            return session, r
+        if not _full_render_probe_due(session.profile, lane.state, r):
+            return session, r
+        if debug:
+            print(f"{lane.hotel['name']} {iso(d)}: no rate with the lite profile, retrying with full rendering")
+        probing = True
+
+
+async def _sample_memory(sampler: memwatch.MemorySampler):
+    while True:
+        await asyncio.to_thread(sampler.sample)
+        await asyncio.sleep(MEMORY_SAMPLE_INTERVAL_S)
+
+
+# ---------- Distributed workers ----------
+# Instead of the in-process lanes, a run can publish its cells to a shared
+# taskqueue.TaskQueue: this process and any number of `python taskqueue.py
+# work` processes claim property batches under leases and write results
+# back; the run collects them as they finish.
+QUEUE_POLL_S = 2.0
+QUEUE_HEARTBEAT_S = 30.0
+
+
+async def _queue_heartbeat(queue: taskqueue.TaskQueue, worker_id: str):
+    while True:
+        try:
+            await asyncio.to_thread(queue.heartbeat, worker_id)
+        except Exception as e:
+            print(f"[WARN] queue heartbeat failed: {e}")
+        await asyncio.sleep(QUEUE_HEARTBEAT_S)
+
 
+async def _queue_lane_worker(pool: BrowserPool, queue: taskqueue.TaskQueue, worker_id: str, run: Dict,
+                             run_id: Optional[str] = None, exit_when_idle: bool = False,
+                             debug: bool = False) -> int:
+    """
+    One tab that claims property batches from `queue` (of `run_id` only,
+    when given) and writes every cell back. Stops once `run_id` has no open
+    cells left, or with `exit_when_idle` as soon as nothing is claimable.
+    Returns the number of cells scraped.
+    """
+    session, currency, served = None, None, 0
+    try:
+        while True:
+            claim = await asyncio.to_thread(queue.claim, worker_id, run_id)
+            if claim is None:
+                if exit_when_idle or (run_id and (await asyncio.to_thread(queue.progress, run_id))["open"] == 0):
+                    break
+                await asyncio.sleep(QUEUE_POLL_S)
+                continue
+            if session is None or currency != claim["currency"]:
+                if session is not None:
+                    await session.close()
+                currency = claim["currency"]
+                session = await pool.open_session(currency)
+            lane = PropertyLane(claim["hotel"], [datetime.strptime(d, "%Y-%m-%d") for d in claim["dates"]],
+                                state=PREFETCH.seed(claim["hotel"]))
+            try:
+                while lane.dates:
+                    d = lane.dates[0]
+                    await asyncio.sleep(random.uniform(0.25, 0.8))
+                    session, r = await _scrape_lane_cell(pool, session, lane, d, currency, run, debug=debug)
+                    r["scraped_at"] = utc_now_iso()
+                    await asyncio.to_thread(queue.complete, worker_id, claim["run_id"], lane.hotel["name"], iso(d), r)
+                    lane.dates.popleft()
+                    served += 1
+            finally:
+                PREFETCH.learn(lane.hotel, lane.state)
+                # Hand unscraped dates back instead of letting their lease run out
+                if lane.dates:
+                    await asyncio.to_thread(queue.release, worker_id, claim["run_id"], lane.hotel["name"],
+                                            [iso(d) for d in lane.dates])
+    finally:
+        if session is not None:
+            await session.close()
+    return served
+
+
+async def run_queue_worker(queue_path: str, concurrency: int = NUM_CONCURRENCY, profile_dir: Optional[str] = None,
+                           exit_when_idle: bool = False, debug: bool = False,
+                           launch_profile: Optional[str] = None) -> int:
+    """
+    Worker process main loop (see `python taskqueue.py work`): `concurrency`
+    tabs claim cells of any run from the queue at `queue_path`. Browsers
+    are only launched once there is work. Returns the number of cells scraped.
+    """
+    queue = taskqueue.TaskQueue(queue_path)
+    worker_id = taskqueue.new_worker_id()
+    run = {"in_flight": 0, "admission_waits": 0, "recycled": {}, "coalesced": 0, "memo_store": STRATEGY_MEMO}
+    beat = asyncio.create_task(_queue_heartbeat(queue, worker_id))
+    served = []
+    try:
+        async with async_playwright() as p:
+            pool = BrowserPool(p, profile_dir, launch_profile=check_launch_profile(launch_profile))
+            try:
+                served = await asyncio.gather(*[
+                    _queue_lane_worker(pool, queue, worker_id, run, exit_when_idle=exit_when_idle, debug=debug)
+                    for _ in range(concurrency)
+                ])
+            finally:
+                await pool.close()
+    finally:
+        beat.cancel()
+        STRATEGY_MEMO.save()
+        queue.close()
+    return sum(served)
+
+
+async def _queue_phase(pool: BrowserPool, queue_path: str, run_id: str, hotels: List[Dict], dates: List[datetime],
+                       skip: set, on_result, selected_currency: str, run: Dict,
+                       on_progress: Optional[Callable[[Dict], None]] = None,
+                       local_workers: int = NUM_CONCURRENCY, debug: bool = False):
+    """
+    Publish the cells not in `skip` as queue run `run_id`, scrape them with
+    `local_workers` tabs next to whatever remote workers are running, and
+    hand every finished cell to `on_result`. `on_progress` gets the queue
+    progress (see TaskQueue.progress) after every poll. An aborted run is
+    cancelled in the queue; publishing it again (resume) re-opens it.
+    """
+    queue = taskqueue.TaskQueue(queue_path)
+    worker_id = taskqueue.new_worker_id("app")
+    by_name = {h["name"]: h for h in hotels}
+    await asyncio.to_thread(queue.prune)
+    opened = await asyncio.to_thread(queue.publish, run_id, hotels, [iso(d) for d in dates], selected_currency,
+                                     skip=skip)
+    run["queue"] = {"run_id": run_id, "published": opened, "workers": 0}
+    beat = asyncio.create_task(_queue_heartbeat(queue, worker_id))
+    workers = [
+        asyncio.create_task(_queue_lane_worker(pool, queue, worker_id, run, run_id=run_id, debug=debug))
+        for _ in range(min(local_workers, opened))
+    ]
+    seq, finished = 0, False
+    try:
+        while True:
+            # Progress first: when it shows nothing open, the results read next are complete
+            progress = await asyncio.to_thread(queue.progress, run_id)
+            rows, seq = await asyncio.to_thread(queue.results_since, run_id, seq)
+            for name, ymd, r in rows:
+                if name in by_name:
+                    on_result(by_name[name], datetime.strptime(ymd, "%Y-%m-%d"), r)
+            run["queue"]["workers"] = max(run["queue"]["workers"], progress["workers"])
+            if on_progress is not None:
+                on_progress(progress)
+            if progress["open"] == 0:
+                finished = True
+                break
+            failed = [t for t in workers if t.done() and not t.cancelled() and t.exception()]
+            if failed:
+                raise failed[0].exception()
+            await asyncio.sleep(QUEUE_POLL_S)
+        await asyncio.gather(*workers)
+    finally:
+        for t in workers:
+            t.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        beat.cancel()
+        if not finished:
+            await asyncio.to_thread(queue.cancel, run_id)
+        queue.close()
 
 
 # ---------- Orchestrator ----------
@@ -706,15 +2640,193 @@ async def scrape_hotels_for_dates(
     dates: List[datetime],
     selected_currency: str = "EUR",
     debug: bool = False,
-) -> Dict:
-    sem = asyncio.Semaphore(NUM_CONCURRENCY)
-    results: Dict[Tuple[str, str], Dict] = {}
-
-    async def _task(h, d):
-        async with sem:
-            await asyncio.sleep(random.uniform(0.25, 0.8))
-            r = await scrape_one(h, d, selected_currency=selected_currency, debug=debug)
-            results[(h["name"], iso(d))] = r
+    profile_dir: Optional[str] = None,
+    run_stats: Optional[Dict] = None,
+    archive_dir: Optional[str] = None,
+    trace_dir: Optional[str] = None,
+    contexts_per_browser: int = CONTEXTS_PER_BROWSER,
+    pages_per_context: int = PAGES_PER_CONTEXT,
+    destination: Optional[str] = None,
+    checkpoint_dir: Optional[str] = None,
+    resume: bool = False,
+    queue_path: Optional[str] = None,
+    on_progress: Optional[Callable[[Dict], None]] = None,
+    local_workers: int = NUM_CONCURRENCY,
+    warm: Optional[WarmBrowsers] = None,
+    user: Optional[str] = None,
+    interactive: Optional[bool] = None,
+    launch_profile: Optional[str] = None,
+) -> RateMatrix:
+    """
+    Scrape every hotel x date. Each of NUM_CONCURRENCY workers takes a
+    property's dates of one horizon band (nearest band first, see
+    build_lanes) and walks them in order on one page; idle workers steal
+    the later half of the busiest lane's remaining dates.
+    Every cell needs one of the process-wide SCHEDULER slots: runs of other
+    `user`s share them fairly and small (`interactive`, by default decided
+    by size) runs go first; run_stats["priority"] / ["slot_waits"] report it.
+    Worker pages are tabs packed `pages_per_context` per context and
+    `contexts_per_browser` per browser (see BrowserPool);
+    run_stats["browsers_launched"] reports how many browsers that took.
+    `profile_dir` opts into persistent per-worker profiles (shared disk cache).
+    Browsers are recycled by page count/RSS and new tasks wait while host
+    memory is nearly exhausted; pass a `run_stats` dict to receive the
+    memory summary (peak/avg MB), recycle counts and admission waits.
+    `archive_dir` records page HTML, calendar responses and results for
+    offline replay (see archive.py).
+    Identical cells in flight anywhere in the process are scraped once
+    (SCRAPE_FLIGHTS); run_stats["coalesced"] counts the shared ones.
+    `trace_dir` turns on sampled profiling (see tracing.py): Playwright
+    traces of the slowest/sampled cells and a cProfile + stack-sample capture
+    of the loop thread go to a new run dir, returned as run_stats["trace_dir"].
+    The Python capture is skipped when other runs or prefetches are in
+    progress and flagged when one starts meanwhile (run_stats["traces"]
+    ["python_profile"]: "exclusive", "shared" or "skipped").
+    Traces are per context, so tracing runs one tab per context.
+    `destination` (e.g. "Frankfurt am Main") turns on comp-set mode: one
+    dated search per date prices every hotel it can match first, and only
+    the rest are scraped per property (run_stats["compset"] has the counts).
+    `checkpoint_dir` writes every finished cell to a per-run JSONL file as
+    it completes (see checkpoint.py); with `resume`, the newest checkpoint
+    of the same plan is continued and only its unfinished cells are
+    scraped. run_stats["run_id"] / ["resumed_cells"] report what happened.
+    `queue_path` (a taskqueue.TaskQueue file) distributes the cells instead:
+    they are published there and scraped by `local_workers` tabs of this
+    process plus any `python taskqueue.py work` processes; `on_progress`
+    receives the queue progress across all workers while the run collects
+    results (run_stats["queue"]).
+    `warm` (WarmBrowsers, on the loop running this coroutine) skips driver
+    and browser startup: its driver and idle browsers are used and healthy
+    browsers are handed back afterwards (run_stats["warm_browsers_used"]).
+    Properties already resolved by prefetch_properties (or an earlier run)
+    start with their URL (run_stats["prefetched"]); starting the
+    run stops `user`'s speculative prefetch.
+    `launch_profile` ("full"/"lite", default LAUNCH_PROFILE) picks how
+    browsers are launched; under "lite", properties that only price with
+    full rendering fall back to it (run_stats["render_fallbacks"]).
+    Results come back as a RateMatrix (usable as {(hotel, yyyy-mm-dd): dict}).
+    """
+    results = RateMatrix([h["name"] for h in hotels], [iso(d) for d in sorted(dates)], currency=selected_currency)
+    if not hotels or not dates:
+        return results
+    launch_profile = check_launch_profile(launch_profile)
+    pending: deque = deque()
+    active: List[PropertyLane] = []
+
+    ckpt, resumed = None, {}
+    if checkpoint_dir:
+        fingerprint = plan_fingerprint(hotels, dates, selected_currency, destination)
+        ckpt = find_resumable(checkpoint_dir, fingerprint) if resume else None
+        if ckpt is not None:
+            resumed = ckpt.load()
+            for key, r in resumed.items():
+                if key[0] in results.hotels and key[1] in results.dates:
+                    results[key] = r
+        else:
+            ckpt = RunCheckpoint.create(checkpoint_dir, fingerprint,
+                                        total_cells=len(results.hotels) * len(results.dates),
+                                        currency=selected_currency, destination=destination)
+
+    def _on_result(h, d, r):
+        r.setdefault("scraped_at", utc_now_iso())
+        if ckpt is not None:
+            ckpt.record(h["name"], iso(d), r)
+        if r.get("strategy") == "page_state":
+            run["page_state"]["cells"] += 1
+        if r.get("page_state_check") in ("agree", "disagree"):
+            run["page_state"][r["page_state_check"]] += 1
+        results[(h["name"], iso(d))] = r
+
+    run = {"in_flight": 0, "admission_waits": 0, "recycled": {}, "coalesced": 0,
+           "archive": HtmlArchive(archive_dir) if archive_dir else None,
+           "memo_store": STRATEGY_MEMO,
+           "page_state": {"cells": 0, "agree": 0, "disagree": 0},
+           "compset": {"pages": 0, "matched": 0, "fallback": 0}}
+    profiler = None
+    tracing.OCCUPANCY.enter()
+    if trace_dir:
+        run_dir = tracing.new_run_dir(trace_dir)
+        run["tracer"] = tracing.TraceSampler(run_dir)
+        profiler = tracing.PythonProfiler(run_dir)
+        if tracing.OCCUPANCY.watch(profiler):
+            profiler.start()
+        else:
+            print("[WARN] other runs share the event loop; skipping the Python profile of this run")
+    sampler = memwatch.MemorySampler()
+    sampling = asyncio.create_task(_sample_memory(sampler))
+    # This run resolves the rest itself; stop the user's speculative prefetch
+    PREFETCH.begin(user or "default")
 
-    await asyncio.gather(*[_task(h, d) for h in hotels for d in dates])
+    pool = None
+    try:
+        async with _playwright(warm) as p:
+            pool = BrowserPool(p, profile_dir, contexts_per_browser=contexts_per_browser,
+                               pages_per_context=1 if trace_dir else pages_per_context, warm=warm,
+                               launch_profile=launch_profile)
+            try:
+                skip = set(resumed)
+                # Comp-set searches count against the same job as the cells
+                run["job"] = SCHEDULER.job(user or "default", len(hotels) * len(dates) - len(skip),
+                                           interactive=interactive)
+                if destination:
+                    skip |= await _destination_phase(pool, destination, hotels, dates, _on_result,
+                                                     selected_currency, run, debug=debug, skip=skip)
+                if queue_path:
+                    run_id = ckpt.run_id if ckpt is not None else \
+                        f"{datetime.now():%Y%m%d-%H%M%S}-{plan_fingerprint(hotels, dates, selected_currency, destination)}"
+                    await _queue_phase(pool, queue_path, run_id, hotels, dates, skip, _on_result, selected_currency,
+                                       run, on_progress=on_progress, local_workers=local_workers, debug=debug)
+                else:
+                    pending.extend(build_lanes(hotels, dates, skip=skip, seed=PREFETCH.seed))
+                    run["lane_states"] = list({id(lane.state): (lane.hotel, lane.state) for lane in pending}.values())
+                    run["prefetched"] = sum(1 for _, state in run["lane_states"] if state)
+                    queued = sum(len(lane.dates) for lane in pending)
+                    metrics.QUEUE_DEPTH.inc(queued)
+                    await asyncio.gather(*[
+                        _lane_worker(pool, pending, active, _on_result, selected_currency, run, debug=debug)
+                        for _ in range(min(NUM_CONCURRENCY, queued))
+                    ])
+            finally:
+                await pool.close()
+    finally:
+        sampling.cancel()
+        STRATEGY_MEMO.save()
+        if ckpt is not None:
+            await asyncio.to_thread(ckpt.sync)
+        for hotel, state in run.get("lane_states", []):
+            PREFETCH.learn(hotel, state)
+        tracing.OCCUPANCY.leave()
+        if profiler is not None:
+            tracing.OCCUPANCY.unwatch(profiler)
+            profiler.stop()
+            run["trace_summary"] = dict(run["tracer"].summary(), python_profile=profiler.status)
+            tracing.write_summary(profiler.run_dir, run["trace_summary"])
+        # Drop the lanes an aborted run never started (started ones are dropped by their worker)
+        metrics.QUEUE_DEPTH.dec(sum(len(lane.dates) for lane in pending))
+        pending.clear()
+        if run_stats is not None:
+            run_stats["memory"] = sampler.summary()
+            run_stats["recycled"] = run["recycled"]
+            run_stats["admission_waits"] = run["admission_waits"]
+            run_stats["coalesced"] = run["coalesced"]
+            run_stats["browsers_launched"] = pool.launched - pool.warm_used if pool else 0
+            run_stats["warm_browsers_used"] = pool.warm_used if pool else 0
+            run_stats["page_state"] = run["page_state"]
+            run_stats["prefetched"] = run.get("prefetched", 0)
+            run_stats["launch_profile"] = launch_profile
+            run_stats["render_fallbacks"] = run.get("full_render", 0)
+            if ckpt is not None:
+                run_stats["run_id"] = ckpt.run_id
+                run_stats["resumed_cells"] = len(resumed)
+            if destination:
+                run_stats["compset"] = run["compset"]
+            if "queue" in run:
+                run_stats["queue"] = run["queue"]
+            if "job" in run:
+                run_stats["priority"] = run["job"].priority
+                run_stats["slot_waits"] = run["job"].waits
+                run_stats["slot_wait_s"] = round(run["job"].wait_s, 1)
+            if profiler is not None:
+                run_stats["trace_dir"] = profiler.run_dir
+                run_stats["traces"] = run["trace_summary"]
     return results
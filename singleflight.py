@@ -0,0 +1,60 @@
+# singleflight.py
+"""
+Process-wide single-flight: concurrent calls with the same key share one
+in-flight execution and all receive its result.
+
+Works across threads and event loops (Streamlit runs each session in its
+own thread with its own asyncio.run), because the shared slot is a
+concurrent.futures.Future that any loop can await.
+"""
+import asyncio
+import concurrent.futures
+import threading
+from typing import Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, concurrent.futures.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._inflight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """
+        Run `fn()` unless an identical call is already running; returns
+        (result, shared) where shared is True if another caller did the work.
+        Exceptions of the leader propagate to every waiter.
+        """
+        with self._lock:
+            self.calls += 1
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = concurrent.futures.Future()
+                self._inflight[key] = fut
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            # shield: a cancelled waiter must not cancel the leader's shared future
+            return await asyncio.shield(asyncio.wrap_future(fut)), True
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            if not fut.done():
+                fut.set_exception(e if isinstance(e, Exception) else RuntimeError(f"leader aborted: {e!r}"))
+            raise
+        else:
+            if not fut.done():
+                fut.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is fut:
+                    del self._inflight[key]
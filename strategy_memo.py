@@ -0,0 +1,161 @@
+# strategy_memo.py
+"""
+Per-property memory of which extraction path produced the price.
+
+Paths are the DOM phases of strict_cheapest_per_night ("select_rows" and
+one "cells:<name>" per price-cell selector) and the GraphQL calendar
+windows ("gql:<window>"). For every property we keep hits, misses, the
+current miss streak and the average time per path. Later scrapes try the
+proven path first and skip paths that missed MEMO_DEAD_AFTER times in a
+row; every MEMO_REVALIDATE_EVERY-th scrape (or after MEMO_REVALIDATE_DAYS)
+runs the full sequence again so a markup change is picked up.
+
+The memo is a JSON file shared by all runs in the process (and merged with
+other processes on save).
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+MEMO_DEAD_AFTER = 3
+MEMO_REVALIDATE_EVERY = 20
+MEMO_REVALIDATE_DAYS = 7
+# Write the file after this many updates (and at the end of every run)
+MEMO_SAVE_EVERY = 25
+MEMO_PATH = os.environ.get("RATECHECKER_STRATEGY_MEMO") or os.path.join(
+    tempfile.gettempdir(), "ratechecker-strategy-memo.json"
+)
+
+
+def new_cell_memo(plan: Optional[Dict] = None) -> Dict:
+    """
+    Per-cell dict handed to the extractors: they read "skip"/"order" and
+    write "outcomes" (path -> produced candidates), "seconds" and "winner".
+    """
+    plan = plan or {}
+    return {"full": plan.get("full", True), "skip": set(plan.get("skip", ())), "order": list(plan.get("order", ())),
+            "outcomes": {}, "seconds": {}, "winner": None}
+
+
+def ordered(paths: List[str], cell_memo: Optional[Dict]) -> List[str]:
+    """`paths` with known-dead ones removed and proven ones first (unchanged without a memo)."""
+    if not cell_memo or cell_memo["full"]:
+        return list(paths)
+    rank = {p: i for i, p in enumerate(cell_memo["order"])}
+    live = [p for p in paths if p not in cell_memo["skip"]]
+    return sorted(live, key=lambda p: rank.get(p, len(rank)))
+
+
+def note(cell_memo: Optional[Dict], path: str, ok: bool, seconds: float):
+    if cell_memo is not None:
+        cell_memo["outcomes"][path] = ok
+        cell_memo["seconds"][path] = round(seconds, 3)
+
+
+class StrategyMemo:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict] = {}
+        self._dirty = 0
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            self._data = {}
+
+    def plan(self, key: Optional[str], paths: List[str], required: Iterable[str] = ()) -> Dict:
+        """
+        What to try for property `key` among `paths`: the full sequence when
+        unknown, due for re-validation, or when every `required` path is dead.
+        """
+        if not key:
+            return {"full": True}
+        with self._lock:
+            self._load()
+            entry = self._data.get(key)
+            if not entry:
+                return {"full": True}
+            stats = entry.get("paths", {})
+            due = entry.get("uses", 0) % MEMO_REVALIDATE_EVERY == 0 \
+                or time.time() - entry.get("validated", 0) > MEMO_REVALIDATE_DAYS * 86400
+            skip = {p for p in paths if stats.get(p, {}).get("streak_miss", 0) >= MEMO_DEAD_AFTER}
+            required = set(required) or set(paths)
+            if due or required <= skip:
+                return {"full": True}
+
+            def _score(p):
+                s = stats.get(p, {})
+                return -s.get("won", 0), s.get("avg_s", float("inf"))
+
+            return {"full": False, "skip": skip, "order": sorted(paths, key=_score)}
+
+    def record(self, key: Optional[str], cell_memo: Dict, seconds: float):
+        """
+        Fold one cell's outcomes into the property's entry. Only call this for
+        priced cells: on a sold-out date every path misses without being dead.
+        """
+        if not key or not cell_memo["outcomes"]:
+            return
+        with self._lock:
+            self._load()
+            entry = self._data.setdefault(key, {"uses": 0, "validated": 0, "paths": {}})
+            entry["uses"] += 1
+            entry["last_seconds"] = round(seconds, 2)
+            if cell_memo["full"]:
+                entry["validated"] = time.time()
+            for path, ok in cell_memo["outcomes"].items():
+                s = entry["paths"].setdefault(path, {"hits": 0, "misses": 0, "won": 0, "streak_miss": 0})
+                took = cell_memo["seconds"].get(path)
+                if ok:
+                    s["hits"] += 1
+                    s["streak_miss"] = 0
+                    if took is not None:
+                        s["avg_s"] = round(took if "avg_s" not in s else 0.8 * s["avg_s"] + 0.2 * took, 3)
+                else:
+                    s["misses"] += 1
+                    s["streak_miss"] += 1
+                if path == cell_memo["winner"]:
+                    s["won"] += 1
+            self._dirty += 1
+            if self._dirty >= MEMO_SAVE_EVERY:
+                self._save_locked()
+
+    def save(self):
+        with self._lock:
+            if self._dirty:
+                self._save_locked()
+
+    def _save_locked(self):
+        # Merge entries another process saved meanwhile (the more used one wins)
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                theirs = json.load(f)
+        except (OSError, ValueError):
+            theirs = {}
+        for key, entry in theirs.items():
+            if entry.get("uses", 0) > self._data.get(key, {}).get("uses", 0):
+                self._data[key] = entry
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+            self._dirty = 0
+        except OSError as e:
+            print(f"[WARN] strategy memo not saved: {e}")
+
+    def entry(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            self._load()
+            return self._data.get(key)
@@ -0,0 +1,267 @@
+# taskqueue.py
+"""
+Lease-based queue of hotel x date cells in a SQLite file, so any number of
+worker processes can scrape one run together.
+
+The publisher (scrape_hotels_for_dates with `queue_path`) adds a run and
+its cells. Workers claim up to QUEUE_CLAIM_CELLS dates of one property at a
+time under a lease of QUEUE_LEASE_S, extend their leases with heartbeats
+while they work and write every result back. A lease that runs out
+(crashed or stuck worker) is claimed again by anyone, up to
+QUEUE_MAX_ATTEMPTS claims; then the cell is finished as "lease_expired".
+Finished cells get an increasing sequence number, so the publisher
+collects them incrementally in completion order.
+
+One box: point every process at the same file. Several nodes: the file
+must live on a disk with working POSIX locks (SQLite over NFS/SMB is not).
+
+    python taskqueue.py work <queue.db> [--concurrency N] [--exit-when-idle]
+    python taskqueue.py status <queue.db> [run_id]
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+QUEUE_LEASE_S = 180
+QUEUE_CLAIM_CELLS = 8
+QUEUE_MAX_ATTEMPTS = 3
+# Workers not seen for this long no longer count as active
+QUEUE_WORKER_STALE_S = 90
+QUEUE_MAX_AGE_DAYS = 7
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY, created REAL, currency TEXT, total INTEGER,
+    meta TEXT, cancelled INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS cells (
+    run_id TEXT NOT NULL, hotel TEXT NOT NULL, date TEXT NOT NULL, hotel_json TEXT,
+    state TEXT NOT NULL DEFAULT 'pending', owner TEXT, lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0, result TEXT, seq INTEGER,
+    PRIMARY KEY (run_id, hotel, date)
+);
+CREATE INDEX IF NOT EXISTS cells_open ON cells (state, lease_until);
+CREATE INDEX IF NOT EXISTS cells_seq ON cells (run_id, seq);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY, host TEXT, pid INTEGER, started REAL, last_seen REAL,
+    cells_done INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# A cell is claimable when nobody holds it or its holder's lease ran out
+_CLAIMABLE = "(c.state = 'pending' OR (c.state = 'leased' AND c.lease_until < :now))"
+
+
+def new_worker_id(role: str = "worker") -> str:
+    return f"{role}-{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class TaskQueue:
+    """One connection per instance; safe to share between threads (calls are serialized)."""
+
+    def __init__(self, path: str, lease_s: float = QUEUE_LEASE_S):
+        self.path = path
+        self.lease_s = lease_s
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _tx(self):
+        """Write transaction; BEGIN IMMEDIATE takes the write lock up front so claims never race."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # ----- publisher -----
+    def publish(self, run_id: str, hotels: List[Dict], dates: Iterable[str], currency: str,
+                skip: Optional[set] = None, **meta) -> int:
+        """
+        Add a run and its (hotel name, yyyy-mm-dd) cells, except `skip`.
+        Publishing the same run again (resume) keeps cells already finished.
+        Returns the number of cells still open.
+        """
+        skip = skip or set()
+        dates = sorted(set(dates))
+        rows = [(run_id, h["name"], d, json.dumps({"name": h["name"], "url": h.get("url")}))
+                for h in hotels for d in dates if (h["name"], d) not in skip]
+        with self._tx() as db:
+            db.execute("INSERT OR IGNORE INTO runs (run_id, created, currency, total, meta) VALUES (?, ?, ?, ?, ?)",
+                       (run_id, time.time(), currency, len(rows), json.dumps(meta)))
+            db.execute("UPDATE runs SET cancelled = 0 WHERE run_id = ?", (run_id,))
+            db.executemany("INSERT OR IGNORE INTO cells (run_id, hotel, date, hotel_json) VALUES (?, ?, ?, ?)", rows)
+        return self.progress(run_id)["open"]
+
+    def cancel(self, run_id: str):
+        """Stop handing out cells of `run_id` (cells being scraped still report back)."""
+        with self._tx() as db:
+            db.execute("UPDATE runs SET cancelled = 1 WHERE run_id = ?", (run_id,))
+
+    def progress(self, run_id: str) -> Dict:
+        """Cell counts by state plus the workers currently holding leases of the run."""
+        now = time.time()
+        with self._lock:
+            counts = dict(self._db.execute(
+                "SELECT state, COUNT(*) FROM cells WHERE run_id = ? GROUP BY state", (run_id,)).fetchall())
+            workers = self._db.execute(
+                "SELECT COUNT(DISTINCT c.owner) FROM cells c JOIN workers w ON w.worker_id = c.owner "
+                "WHERE c.run_id = ? AND c.state = 'leased' AND w.last_seen > ?",
+                (run_id, now - QUEUE_WORKER_STALE_S)).fetchone()[0]
+        done, pending, leased = counts.get("done", 0), counts.get("pending", 0), counts.get("leased", 0)
+        return {"total": done + pending + leased, "done": done, "pending": pending, "leased": leased,
+                "open": pending + leased, "workers": workers}
+
+    def results_since(self, run_id: str, after_seq: int = 0) -> Tuple[List[Tuple[str, str, Dict]], int]:
+        """Cells of `run_id` finished after `after_seq`: ([(hotel, date, result)], last seq seen)."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT hotel, date, result, seq FROM cells WHERE run_id = ? AND state = 'done' AND seq > ? "
+                "ORDER BY seq", (run_id, after_seq)).fetchall()
+        if not rows:
+            return [], after_seq
+        return [(r["hotel"], r["date"], json.loads(r["result"])) for r in rows], rows[-1]["seq"]
+
+    # ----- workers -----
+    def heartbeat(self, worker_id: str) -> int:
+        """Mark `worker_id` alive and extend all of its leases; returns how many it holds."""
+        now = time.time()
+        with self._tx() as db:
+            db.execute(
+                "INSERT INTO workers (worker_id, host, pid, started, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET last_seen = excluded.last_seen",
+                (worker_id, socket.gethostname(), os.getpid(), now, now))
+            return db.execute(
+                "UPDATE cells SET lease_until = ? WHERE owner = ? AND state = 'leased'",
+                (now + self.lease_s, worker_id)).rowcount
+
+    def claim(self, worker_id: str, run_id: Optional[str] = None,
+              max_cells: int = QUEUE_CLAIM_CELLS) -> Optional[Dict]:
+        """
+        Lease up to `max_cells` open dates of one property (oldest run and
+        earliest date first; only `run_id` when given). Returns
+        {"run_id", "hotel": {"name", "url"}, "currency", "dates": [yyyy-mm-dd]} or None.
+        """
+        now = time.time()
+        with self._tx() as db:
+            self._expire_exhausted(db, now)
+            args = {"now": now, "run_id": run_id}
+            row = db.execute(
+                f"SELECT c.run_id, c.hotel, c.hotel_json, r.currency FROM cells c JOIN runs r USING (run_id) "
+                f"WHERE r.cancelled = 0 AND {_CLAIMABLE} AND (:run_id IS NULL OR c.run_id = :run_id) "
+                f"ORDER BY r.created, c.date LIMIT 1", args).fetchone()
+            if row is None:
+                return None
+            dates = [r["date"] for r in db.execute(
+                f"SELECT c.date FROM cells c WHERE c.run_id = :run_id AND c.hotel = :hotel AND {_CLAIMABLE} "
+                f"ORDER BY c.date LIMIT :n", {"now": now, "run_id": row["run_id"], "hotel": row["hotel"],
+                                              "n": max_cells}).fetchall()]
+            db.executemany(
+                "UPDATE cells SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE run_id = ? AND hotel = ? AND date = ?",
+                [(worker_id, now + self.lease_s, row["run_id"], row["hotel"], d) for d in dates])
+        return {"run_id": row["run_id"], "hotel": json.loads(row["hotel_json"]), "currency": row["currency"],
+                "dates": dates}
+
+    def complete(self, worker_id: str, run_id: str, hotel: str, date: str, result: Dict) -> bool:
+        """Store a cell's result (first result wins, even from a worker whose lease ran out)."""
+        with self._tx() as db:
+            stored = self._finish(db, run_id, hotel, date, result)
+            if stored:
+                db.execute("UPDATE workers SET cells_done = cells_done + 1, last_seen = ? WHERE worker_id = ?",
+                           (time.time(), worker_id))
+        return stored
+
+    def release(self, worker_id: str, run_id: str, hotel: str, dates: Iterable[str]):
+        """Hand back leased cells that will not be scraped (worker shutting down)."""
+        with self._tx() as db:
+            db.executemany(
+                "UPDATE cells SET state = 'pending', owner = NULL, lease_until = NULL, attempts = attempts - 1 "
+                "WHERE run_id = ? AND hotel = ? AND date = ? AND owner = ? AND state = 'leased'",
+                [(run_id, hotel, d, worker_id) for d in dates])
+
+    def _finish(self, db, run_id: str, hotel: str, date: str, result: Dict) -> bool:
+        seq = db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM cells WHERE run_id = ?", (run_id,)).fetchone()[0]
+        return db.execute(
+            "UPDATE cells SET state = 'done', owner = NULL, lease_until = NULL, result = ?, seq = ? "
+            "WHERE run_id = ? AND hotel = ? AND date = ? AND state != 'done'",
+            (json.dumps(result, ensure_ascii=False), seq, run_id, hotel, date)).rowcount > 0
+
+    def _expire_exhausted(self, db, now: float):
+        rows = db.execute(
+            "SELECT run_id, hotel, date, attempts FROM cells WHERE state = 'leased' AND lease_until < ? "
+            "AND attempts >= ?", (now, QUEUE_MAX_ATTEMPTS)).fetchall()
+        for r in rows:
+            self._finish(db, r["run_id"], r["hotel"], r["date"], {
+                "hotel": r["hotel"], "date": r["date"], "status": "No rate found",
+                "reason": f"lease_expired after {r['attempts']} attempts",
+            })
+
+    def prune(self, max_age_days: float = QUEUE_MAX_AGE_DAYS):
+        cutoff = time.time() - max_age_days * 86400
+        with self._tx() as db:
+            old = [r[0] for r in db.execute("SELECT run_id FROM runs WHERE created < ?", (cutoff,)).fetchall()]
+            db.executemany("DELETE FROM cells WHERE run_id = ?", [(r,) for r in old])
+            db.executemany("DELETE FROM runs WHERE run_id = ?", [(r,) for r in old])
+            db.execute("DELETE FROM workers WHERE last_seen < ?", (cutoff,))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Scrape cells from a shared ratechecker queue.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    wp = sub.add_parser("work")
+    wp.add_argument("queue")
+    wp.add_argument("--concurrency", type=int, default=None, help="tabs per worker (default NUM_CONCURRENCY)")
+    wp.add_argument("--profile-dir", default=None)
+    wp.add_argument("--exit-when-idle", action="store_true", help="stop once no cell is left to claim")
+    wp.add_argument("--launch-profile", default=None, choices=("full", "lite"),
+                    help="browser launch profile (default RATECHECKER_LAUNCH_PROFILE or full)")
+    sp = sub.add_parser("status")
+    sp.add_argument("queue")
+    sp.add_argument("run_id", nargs="?")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "status":
+        if not os.path.exists(args.queue):
+            print(f"no queue at {args.queue}")
+            return 1
+        queue = TaskQueue(args.queue)
+        with queue._lock:
+            runs = [r[0] for r in queue._db.execute("SELECT run_id FROM runs ORDER BY created").fetchall()]
+        for run_id in ([args.run_id] if args.run_id else runs):
+            p = queue.progress(run_id)
+            print(f"{run_id}: {p['done']}/{p['total']} done, {p['leased']} leased, {p['pending']} pending, "
+                  f"{p['workers']} worker(s) active")
+        return 0
+
+    import asyncio
+    import scraper
+
+    done = asyncio.run(scraper.run_queue_worker(
+        args.queue, concurrency=args.concurrency or scraper.NUM_CONCURRENCY,
+        profile_dir=args.profile_dir, exit_when_idle=args.exit_when_idle, launch_profile=args.launch_profile))
+    print(f"worker finished after {done} cells")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,231 @@
+# tracing.py
+"""
+Opt-in sampled profiling of a scrape run, to see where slow cells spend
+their time.
+
+Browser side: every cell runs inside its own Playwright trace chunk
+(screenshots, DOM snapshots, network). Chunks of the TRACE_KEEP_SLOWEST
+slowest cells plus a TRACE_SAMPLE_RATE random sample are kept, the rest
+are deleted as soon as they are outranked. Open them with
+`playwright show-trace <file>.zip` or https://trace.playwright.dev.
+
+Python side: the orchestrator runs under cProfile (python.prof, plus
+python_stats.txt) and a stack sampler writes python.collapsed, which
+speedscope or flamegraph.pl render as a flame graph. Both see every
+coroutine on the loop thread, so they only start when no other run or
+prefetch is in progress (OCCUPANCY); if one starts meanwhile, the profile
+is marked shared (summary.json "python_profile", python_stats.txt header).
+
+Layout of one run dir:
+    summary.json  traces/<secs>s_<hotel>_<date>.zip  python.prof  python_stats.txt  python.collapsed
+"""
+import cProfile
+import heapq
+import io
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import zipfile
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+TRACE_KEEP_SLOWEST = 5
+TRACE_SAMPLE_RATE = 0.05
+STACK_SAMPLE_INTERVAL_S = 0.01
+STATS_TOP_N = 60
+
+
+def new_run_dir(root: str) -> str:
+    path = os.path.join(root, datetime.now().strftime("run-%Y%m%d-%H%M%S-") + f"{os.getpid()}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "-", text).strip("-")[:40] or "cell"
+
+
+class TraceSampler:
+    """Per-cell Playwright trace chunks; keeps the slowest N and a random sample."""
+
+    def __init__(self, run_dir: str, keep_slowest: int = TRACE_KEEP_SLOWEST,
+                 sample_rate: float = TRACE_SAMPLE_RATE):
+        self.run_dir = run_dir
+        self.keep_slowest = keep_slowest
+        self.sample_rate = sample_rate
+        self._slowest: List[Tuple[float, str]] = []  # min-heap of (seconds, path)
+        self.kept: Dict[str, Dict] = {}               # path -> cell info
+        self.cells = 0
+        self._tracing: set = set()  # contexts with tracing started (lives as long as the run)
+        os.makedirs(os.path.join(run_dir, "traces"), exist_ok=True)
+
+    async def begin_cell(self, context) -> bool:
+        """Start a trace chunk on `context` (starting tracing on first use). False if unavailable."""
+        try:
+            if context not in self._tracing:
+                await context.tracing.start(screenshots=True, snapshots=True, sources=False)
+                self._tracing.add(context)
+            await context.tracing.start_chunk()
+            return True
+        except Exception as e:
+            print(f"[WARN] tracing unavailable: {e}")
+            return False
+
+    async def end_cell(self, context, hotel: str, checkin: datetime, seconds: float, result: Dict):
+        """Stop the chunk and keep it if it is among the slowest or sampled; coalesced cells are dropped."""
+        self.cells += 1
+        sampled = random.random() < self.sample_rate
+        slow = len(self._slowest) < self.keep_slowest or (self._slowest and seconds > self._slowest[0][0])
+        if result.get("coalesced") or not (sampled or slow):
+            await self._stop(context, None)
+            return
+
+        name = f"{seconds:06.1f}s_{_slug(hotel)}_{checkin.strftime('%Y-%m-%d')}_{self.cells}.zip"
+        path = os.path.join(self.run_dir, "traces", name)
+        if not await self._stop(context, path):
+            return
+        self.kept[path] = {
+            "trace": os.path.relpath(path, self.run_dir), "hotel": hotel,
+            "date": checkin.strftime("%Y-%m-%d"), "seconds": round(seconds, 2),
+            "status": result.get("status"), "reason": result.get("reason"), "stage": result.get("stage"),
+            "strategy": result.get("strategy"), "sampled": sampled,
+        }
+        if slow:
+            heapq.heappush(self._slowest, (seconds, path))
+            if len(self._slowest) > self.keep_slowest:
+                _s, evicted = heapq.heappop(self._slowest)
+                if not self.kept[evicted]["sampled"]:
+                    self.kept.pop(evicted)
+                    try:
+                        os.remove(evicted)
+                    except OSError:
+                        pass
+
+    async def _stop(self, context, path: Optional[str]) -> bool:
+        try:
+            await context.tracing.stop_chunk(path=path)
+            return True
+        except Exception as e:
+            print(f"[WARN] trace chunk not saved: {e}")
+            return False
+
+    def summary(self) -> Dict:
+        kept = sorted(self.kept.values(), key=lambda c: c["seconds"], reverse=True)
+        return {"cells": self.cells, "kept": kept}
+
+
+class LoopOccupancy:
+    """Scrape runs and prefetches in progress in the process, and the PythonProfilers they affect."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self._profilers: set = set()
+
+    def enter(self):
+        with self._lock:
+            self.active += 1
+            for profiler in self._profilers:
+                profiler.shared = True
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+
+    def watch(self, profiler: "PythonProfiler") -> bool:
+        """Register `profiler` if its run (already entered) is the only work in progress."""
+        with self._lock:
+            if self.active > 1:
+                return False
+            self._profilers.add(profiler)
+            return True
+
+    def unwatch(self, profiler: "PythonProfiler"):
+        with self._lock:
+            self._profilers.discard(profiler)
+
+
+OCCUPANCY = LoopOccupancy()
+
+
+class PythonProfiler:
+    """cProfile plus a stack sampler (collapsed stacks) for the calling thread."""
+
+    def __init__(self, run_dir: str, interval_s: float = STACK_SAMPLE_INTERVAL_S):
+        self.run_dir = run_dir
+        self.interval_s = interval_s
+        # Set by OCCUPANCY when other work ran on the loop while profiling
+        self.shared = False
+        self._profile: Optional[cProfile.Profile] = cProfile.Profile()
+        self._stacks: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self, target: int):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+
+    @property
+    def status(self) -> str:
+        """"skipped" (never started), "shared" or "exclusive" (had the loop to itself)."""
+        if self._thread is None:
+            return "skipped"
+        return "shared" if self.shared else "exclusive"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, args=(threading.get_ident(),),
+                                        name="stack-sampler", daemon=True)
+        self._thread.start()
+        try:
+            self._profile.enable()
+        except ValueError as e:  # another profiler/debugger owns the hook; keep the stack samples
+            print(f"[WARN] cProfile unavailable: {e}")
+            self._profile = None
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        with open(os.path.join(self.run_dir, "python.collapsed"), "w", encoding="utf-8") as f:
+            for stack, n in sorted(self._stacks.items()):
+                f.write(f"{stack} {n}\n")
+        if self._profile is None:
+            return
+        self._profile.disable()
+        self._profile.dump_stats(os.path.join(self.run_dir, "python.prof"))
+        buf = io.StringIO()
+        if self.shared:
+            buf.write("NOTE: other runs/prefetches shared the loop while profiling; figures include their work.\n\n")
+        pstats.Stats(self._profile, stream=buf).sort_stats("cumulative").print_stats(STATS_TOP_N)
+        with open(os.path.join(self.run_dir, "python_stats.txt"), "w", encoding="utf-8") as f:
+            f.write(buf.getvalue())
+
+
+def write_summary(run_dir: str, summary: Dict):
+    with open(os.path.join(run_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+def bundle(run_dir: str) -> bytes:
+    """Zip a run dir for download (trace zips are stored, not recompressed)."""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for root, _dirs, names in os.walk(run_dir):
+            for n in sorted(names):
+                path = os.path.join(root, n)
+                kind = zipfile.ZIP_STORED if n.endswith(".zip") else zipfile.ZIP_DEFLATED
+                zf.write(path, os.path.relpath(path, run_dir), compress_type=kind)
+    return buf.getvalue()
@@ -1 +1,110 @@
-# Date Generator Placeholder
+# utils.py
+"""
+Date generator: month helpers, dd.mm.yyyy parsing and the two-dates-per-month
+rule behind the app's date list. Pure functions, so bench.py can time them
+without starting Streamlit.
+"""
+import random
+from calendar import monthrange
+from datetime import datetime, timedelta
+
+
+def first_of_month(d: datetime) -> datetime:
+    return d.replace(day=1)
+
+
+def add_months(d: datetime, n: int) -> datetime:
+    y = d.year + (d.month - 1 + n) // 12
+    m = (d.month - 1 + n) % 12 + 1
+    return datetime(y, m, 1)
+
+
+def month_end(d: datetime) -> datetime:
+    _, last = monthrange(d.year, d.month)
+    return d.replace(day=last)
+
+
+def normalize_date_text(text: str):
+    """Parse dd.mm.yyyy lines, drop invalid/duplicates, return (dates_list, normalized_sorted_text)."""
+    dates = []
+    seen = set()
+    for line in (text or "").splitlines():
+        s = line.strip()
+        if not s:
+            continue
+        try:
+            d = datetime.strptime(s, "%d.%m.%Y")
+            key = d.strftime("%Y-%m-%d")
+            if key not in seen:
+                dates.append(d)
+                seen.add(key)
+        except Exception:
+            pass
+    dates_sorted = sorted(dates)
+    normalized = "\n".join([d.strftime("%d.%m.%Y") for d in dates_sorted])
+    return dates_sorted, normalized
+
+
+def pick_two_dates_for_month(month_start: datetime, after_dt: datetime | None = None):
+    """
+    Pick 2 dates in the month:
+      - one weekday (Sun–Thu = 6,0,1,2,3)
+      - one weekend (Fri/Sat = 4,5)
+    If one bucket is empty, fall back to any remaining days to still return 2 unique dates.
+    `after_dt`: if provided, only consider days strictly > after_dt.
+    """
+    ms = month_start
+    me = month_end(month_start)
+    all_days = [ms + timedelta(days=i) for i in range((me - ms).days + 1)]
+    if after_dt is not None:
+        all_days = [d for d in all_days if d > after_dt]
+
+    weekdays = [d for d in all_days if d.weekday() in [6, 0, 1, 2, 3]]
+    weekends = [d for d in all_days if d.weekday() in [4, 5]]
+
+    seed = int(ms.strftime("%Y%m"))
+    rng = random.Random(seed)
+
+    chosen = []
+    if weekdays:
+        chosen.append(rng.choice(weekdays))
+    if weekends:
+        w = rng.choice(weekends)
+        if w not in chosen:
+            chosen.append(w)
+
+    if len(chosen) < 2:
+        remaining = [d for d in all_days if d not in chosen]
+        if remaining:
+            rng.shuffle(remaining)
+            while len(chosen) < 2 and remaining:
+                chosen.append(remaining.pop())
+    return sorted(chosen)
+
+
+def generate_dates_rule(start: datetime, months: int):
+    """
+    Rule:
+      - If fewer than 7 days remain in the start month (strictly after the start date),
+        skip this month and start from next month.
+      - Otherwise, include current month but pick only dates strictly after the chosen start.
+      - Always return exactly 2 dates per month (fallback if a bucket is empty).
+    """
+    end_curr = month_end(start)
+    days_after = (end_curr - start).days
+    include_current = days_after >= 7
+
+    out = []
+    if include_current:
+        ms = first_of_month(start)
+        out.extend(pick_two_dates_for_month(ms, after_dt=start))
+        base_month = add_months(ms, 1)
+        for i in range(months - 1):
+            msi = add_months(base_month, i)
+            out.extend(pick_two_dates_for_month(msi, after_dt=None))
+    else:
+        base_month = add_months(first_of_month(start), 1)
+        for i in range(months):
+            msi = add_months(base_month, i)
+            out.extend(pick_two_dates_for_month(msi, after_dt=None))
+    return sorted(set(out))